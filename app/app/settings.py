@@ -7,12 +7,17 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # See https://docs.djangoproject.com/en/2.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'kbx0z*bzw4vdysn_g*oaqp#2@9ub*0q)=t3fki6+unzi2h+u^5'
+SECRET_KEY = os.environ.get(
+    'SECRET_KEY', 'kbx0z*bzw4vdysn_g*oaqp#2@9ub*0q)=t3fki6+unzi2h+u^5')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DEBUG also keeps every SQL query of a request in memory, set DEBUG=1 in
+# the environment for development only
+DEBUG = bool(int(os.environ.get('DEBUG', 0)))
 
-ALLOWED_HOSTS = []
+# Comma separated, e.g. ALLOWED_HOSTS=api.example.com,localhost
+ALLOWED_HOSTS = [host for host in
+                 os.environ.get('ALLOWED_HOSTS', '').split(',') if host]
 
 # Application definition
 
@@ -25,12 +30,15 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework.authtoken',
-    "core",
+    "core.apps.CoreConfig",
     "user",
     'recipe',
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.db.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,9 +78,42 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASSWORD'),
+        # Seconds a connection is kept open across requests, 0 closes it
+        # after every request. Each gunicorn worker thread holds its own.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        # Set DB_PGBOUNCER=1 behind a transaction pooling PgBouncer, whose
+        # server connections change between transactions and cannot keep
+        # the cursors .iterator() would otherwise declare
+        'DISABLE_SERVER_SIDE_CURSORS': bool(
+            int(os.environ.get('DB_PGBOUNCER', 0))),
     }
 }
 
+# Close persistent connections the server dropped before a request uses
+# them, see core/db.py. Costs a round trip per request and connection.
+DB_HEALTH_CHECKS = bool(int(os.environ.get('DB_HEALTH_CHECKS', 1)))
+
+# Read replicas as comma separated host or host/name entries using the
+# credentials of the primary, e.g. DB_REPLICA_HOSTS=replica1,localhost/copy.
+# core.db.ReplicaRouter sends reads to one of them per request, chosen by
+# DB_REPLICA_SELECTION ('round-robin' or 'least-latency'). For
+# DB_PIN_SECONDS after a write, reads of the writing client and user go to
+# the primary, tracked by the DB_PIN_COOKIE cookie and the API cache, which
+# must then be shared (API_CACHE_LOCATION) unless DEBUG is on.
+DB_REPLICAS = []
+for number, replica in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, name = replica.partition('/')
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host,
+                            NAME=name or DATABASES['default']['NAME'],
+                            TEST={'MIRROR': 'default'})
+    DB_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+DB_REPLICA_SELECTION = os.environ.get('DB_REPLICA_SELECTION', 'round-robin')
+DB_PIN_SECONDS = 5
+DB_PIN_COOKIE = 'db_pin'
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -114,3 +155,88 @@ MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
 AUTH_USER_MODEL = 'core.user'
+
+# Token authentication cache, see core/authentication.py
+# Set AUTH_TOKEN_CACHE_ALIAS to a CACHES alias to share it across workers
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 60
+AUTH_TOKEN_CACHE_ALIAS = None
+
+# Largest list accepted by the bulk endpoints, see recipe/mixins.py
+BULK_MAX_ITEMS = 5000
+
+# Rows fetched per round trip by the recipe export
+EXPORT_CHUNK_SIZE = 2000
+
+# List responses are cached per user in API_CACHE_ALIAS, see core/caching.py.
+# It also holds the data versions invalidating ETags, autocomplete names and
+# ranking indexes, so it must be shared when running several processes,
+# otherwise writes only invalidate the local process. Set API_CACHE_LOCATION
+# to memcached addresses, e.g. memcached:11211, to share it.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+if os.environ.get('API_CACHE_LOCATION'):
+    CACHES['api'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ['API_CACHE_LOCATION'].split(','),
+    }
+API_CACHE_ALIAS = 'api'
+API_CACHE_TTL = 300
+# Larger lists are not cached to bound the memory used per entry
+API_CACHE_MAX_ITEMS = 1000
+
+# Recipe image thumbnails, written by a background pool, see core/images.py
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_SIZES = (('small', 160), ('medium', 480), ('large', 1024))
+# Formats the installed Pillow can not write are skipped with a warning
+THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+
+# Tag/ingredient ?prefix= autocomplete, see core/autocomplete.py. Names of
+# the most recent AUTOCOMPLETE_CACHE_USERS users are kept sorted in process,
+# users with more than AUTOCOMPLETE_CACHE_MAX_NAMES names query the index.
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_CACHE_USERS = 100
+AUTOCOMPLETE_CACHE_TTL = 600
+AUTOCOMPLETE_CACHE_MAX_NAMES = 100000
+
+# Most used tags and ingredients listed by the recipe stats endpoint
+RECIPE_STATS_TOP_NAMES = 10
+
+# Recipe rankings served from in-process bitset indexes of the most recent
+# RANKING_CACHE_USERS users, see core/ranking.py
+RANKING_LIMIT = 10
+RANKING_MAX_LIMIT = 100
+RANKING_CACHE_USERS = 20
+RANKING_CACHE_TTL = 3600
+
+# Opt-in request profiling, see core/profiling.py. Requests slower than
+# PROFILING_SLOW_MS are logged with their PROFILING_TOP_QUERIES costliest
+# statements, a PROFILING_SAMPLE_RATE fraction of them is run under cProfile
+# with the .prof files written to PROFILING_DIR.
+PROFILING_ENABLED = bool(int(os.environ.get('PROFILING_ENABLED', 0)))
+PROFILING_SLOW_MS = 500
+PROFILING_TOP_QUERIES = 5
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_DIR = '/vol/web/profiles'
+
+# Request metrics served at /metrics, see core/metrics.py. Each worker
+# process aggregates in memory and, with METRICS_DIR set, writes a snapshot
+# there every METRICS_FLUSH_INTERVAL seconds which /metrics sums up. Point
+# every worker at the same directory and empty it when the server starts.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# /metrics exposes traffic and query timings, so it requires the header
+# "Authorization: Bearer <METRICS_TOKEN>" (Prometheus' `authorization`
+# scrape option) and answers 401 to everyone while the token is unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_FLUSH_INTERVAL = 5
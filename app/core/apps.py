@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.signals import request_started
+
+        from . import signals  # noqa
+        from .db import close_broken_connections
+
+        if settings.DB_HEALTH_CHECKS:
+            request_started.connect(close_broken_connections)
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.metrics import registry
+
+
+class LRUCache:
+    """Thread safe in-process LRU mapping whose entries expire after ttl"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored for key or None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value for key, evicting the least recently used entry"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# The local TTL bounds how long other worker processes may keep serving a
+# token after it was invalidated, they only see the shared cache delete
+token_cache = LRUCache(
+    max_size=getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60),
+)
+
+
+def _shared_cache():
+    """Return the configured shared cache or None when disabled"""
+    alias = getattr(settings, 'AUTH_TOKEN_CACHE_ALIAS', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _shared_key(key):
+    return 'auth-token:%s' % key
+
+
+def invalidate_token(key):
+    """Forget the cached resolution of token key"""
+    token_cache.delete(key)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(_shared_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that caches token to user resolution
+
+    Tokens are looked up in an in-process LRU first, then in the optional
+    shared cache and only then in the database. Only the user id and
+    active flag are cached, other fields of request.user are deferred and
+    read from the database on first access. Entries are invalidated by
+    the signal handlers in core.signals.
+    """
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            entry = self._get_shared(key)
+            token_cache.set(key, entry)
+        else:
+            self._count('local_cache')
+
+        user_id, is_active = entry
+        user_model = get_user_model()
+        user = user_model.from_db(
+            None, [user_model._meta.pk.attname, 'is_active'],
+            [user_id, is_active])
+        token = self.get_model()(key=key, user=user)
+        return (user, token)
+
+    def _get_shared(self, key):
+        shared = _shared_cache()
+        if shared is not None:
+            entry = shared.get(_shared_key(key))
+            if entry is not None:
+                self._count('shared_cache')
+                return entry
+
+        try:
+            user, token = super().authenticate_credentials(key)
+        except AuthenticationFailed:
+            self._count('failed')
+            raise
+        self._count('database')
+        entry = (user.pk, user.is_active)
+        if shared is not None:
+            shared.set(_shared_key(key), entry)
+        return entry
+
+    def _count(self, outcome):
+        registry.inc('auth_token_lookups_total', (('outcome', outcome),))
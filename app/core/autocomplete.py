@@ -0,0 +1,81 @@
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models.functions import Lower
+
+from core.authentication import LRUCache
+from core.caching import get_data_version
+
+# Scoped data versions bumped whenever tag or ingredient names change
+NAME_SCOPES = ('tag', 'ingredient')
+
+name_cache = LRUCache(
+    max_size=getattr(settings, 'AUTOCOMPLETE_CACHE_USERS', 100),
+    ttl=getattr(settings, 'AUTOCOMPLETE_CACHE_TTL', 600),
+)
+
+
+class SortedNames:
+    """A user's names sorted case-insensitively for bisect prefix lookups"""
+
+    def __init__(self, rows):
+        entries = sorted((name.lower(), name, pk) for pk, name in rows)
+        self.keys = [key for key, name, pk in entries]
+        self.entries = [(pk, name) for key, name, pk in entries]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def match(self, prefix, limit):
+        """Return up to limit (id, name) pairs starting with prefix"""
+        prefix = prefix.lower()
+        start = bisect_left(self.keys, prefix)
+        matches = []
+        for index in range(start, min(start + limit, len(self.keys))):
+            if not self.keys[index].startswith(prefix):
+                break
+            matches.append(self.entries[index])
+        return matches
+
+
+def match_names(queryset, prefix, limit):
+    """Return up to limit (id, name) pairs of queryset starting with prefix
+
+    Served by the lower(name) text_pattern_ops index on PostgreSQL.
+    """
+    return list(
+        queryset.annotate(name_lower=Lower('name'))
+        .filter(name_lower__startswith=prefix.lower())
+        .order_by('name_lower', 'name', 'id')
+        .values_list('id', 'name')[:limit])
+
+
+def get_sorted_names(model, user_id):
+    """Return the cached SortedNames of a user, None if too many names
+
+    Entries are tagged with the user's scoped data version, so any write
+    to the names rebuilds the list on the next lookup.
+    """
+    version = get_data_version(user_id, model._meta.model_name)
+    key = (model._meta.label_lower, user_id)
+    cached = name_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    max_names = getattr(settings, 'AUTOCOMPLETE_CACHE_MAX_NAMES', 100000)
+    rows = list(model.objects.filter(user_id=user_id)
+                .values_list('id', 'name')[:max_names + 1])
+    names = SortedNames(rows) if len(rows) <= max_names else None
+    name_cache.set(key, (version, names))
+    return names
+
+
+def complete(model, user_id, prefix, limit):
+    """Return up to limit names of a user's objects starting with prefix"""
+    names = get_sorted_names(model, user_id)
+    if names is None:
+        matches = match_names(model.objects.filter(user_id=user_id),
+                              prefix, limit)
+    else:
+        matches = names.match(prefix, limit)
+    return [{'id': pk, 'name': name} for pk, name in matches]
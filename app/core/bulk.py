@@ -0,0 +1,313 @@
+import csv
+import io
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from core import images, ranking, stats
+from core.caching import bump_data_version
+from core.models import Recipe
+from core.search import update_search_vectors
+from core.utils import chunked
+
+RECIPE_FIELDS = ('title', 'time_minutes', 'price', 'link')
+RECIPE_RELATIONS = (('tag_ids', 'tags'), ('ingredient_ids', 'ingredients'))
+
+
+def owned_ids(queryset, ids):
+    """Return the subset of ids present in queryset"""
+    found = set()
+    for chunk in chunked(set(ids)):
+        found.update(queryset.filter(id__in=chunk)
+                     .values_list('id', flat=True))
+    return found
+
+
+def insert_objects(model, objs):
+    """Insert objs with bulk_create and make sure they get their pks
+
+    Must run inside a transaction. Backends that can not return ids from
+    a bulk insert (SQLite) hold the write lock for the whole transaction,
+    so the new rows are the `len(objs)` highest ids in insertion order.
+    """
+    for chunk in chunked(objs):
+        model.objects.bulk_create(chunk)
+        if connection.features.can_return_ids_from_bulk_insert:
+            continue
+        ids = model.objects.order_by('-pk') \
+            .values_list('pk', flat=True)[:len(chunk)]
+        for obj, pk in zip(chunk, reversed(ids)):
+            obj.pk = pk
+    return objs
+
+
+def update_objects(queryset, items, fields):
+    """Update rows of queryset from dicts holding an `id` key
+
+    All fields of a chunk are written by a single UPDATE with one CASE
+    expression per field instead of one UPDATE per row. auto_now fields
+    are set on every listed row. Returns the number of rows updated.
+    """
+    model = queryset.model
+    auto_now = [field.name for field in model._meta.concrete_fields
+                if getattr(field, 'auto_now', False)]
+    updated = set()
+    for chunk in chunked(items):
+        ids = [item['id'] for item in chunk]
+        values = {name: timezone.now() for name in auto_now}
+        for field in fields:
+            whens = [When(pk=item['id'], then=Value(item[field]))
+                     for item in chunk if field in item]
+            if whens:
+                values[field] = Case(
+                    *whens, default=field,
+                    output_field=model._meta.get_field(field))
+        if values:
+            queryset.filter(pk__in=ids).update(**values)
+        updated.update(queryset.filter(pk__in=ids)
+                       .values_list('pk', flat=True))
+    return len(updated)
+
+
+def replace_relations(relation, mapping, clear=True):
+    """Replace the M2M rows of `relation` for each id -> related ids pair
+
+    Pass clear=False for freshly inserted rows which have no relations yet.
+    """
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    source = field.m2m_field_name() + '_id'
+    target = field.m2m_reverse_field_name() + '_id'
+    for chunk in chunked(mapping.items()):
+        usage = stats.count_links(
+            set(related_ids) for _, related_ids in chunk)
+        if clear:
+            old_links = through.objects.filter(
+                **{source + '__in': [obj_id for obj_id, _ in chunk]})
+            usage.subtract(old_links.values_list(target, flat=True))
+            old_links.delete()
+        through.objects.bulk_create(
+            through(**{source: obj_id, target: related_id})
+            for obj_id, related_ids in chunk
+            for related_id in set(related_ids)
+        )
+        stats.add_usage(field.related_model, usage)
+
+
+_state = threading.local()
+
+
+def deletes_deferred():
+    """Return whether delete_objects() takes over the delete receivers"""
+    return getattr(_state, 'deletes_deferred', False)
+
+
+@contextmanager
+def _defer_deletes():
+    previous = deletes_deferred()
+    _state.deletes_deferred = True
+    try:
+        yield
+    finally:
+        _state.deletes_deferred = previous
+
+
+def _linked_ids(relation, recipes):
+    """Return a Counter of the tag/ingredient ids linked to recipes"""
+    field = Recipe._meta.get_field(relation)
+    source = field.m2m_field_name()
+    return Counter(field.remote_field.through.objects
+                   .filter(**{source + '__in': recipes})
+                   .values_list(field.m2m_reverse_field_name() + '_id',
+                                flat=True))
+
+
+def _release_recipes(recipes):
+    """Take recipes out of totals, usage counts and image references"""
+    for user_id, (count, price, time_minutes) in \
+            stats.recipe_totals(recipes).items():
+        stats.add_to_totals(user_id, -count, -price, -time_minutes)
+    for _, relation in RECIPE_RELATIONS:
+        field = Recipe._meta.get_field(relation)
+        stats.add_usage(field.related_model, {
+            pk: -count for pk, count in _linked_ids(relation, recipes).items()
+        })
+    # One release per reference, recipes may share an image
+    for name in recipes.exclude(image=None).exclude(image='') \
+            .values_list('image', flat=True):
+        images.release_image(name)
+
+
+def _linked_recipe_ids(names):
+    """Return the ids of recipes using any of the tags/ingredients"""
+    rel = names.model._meta.get_field('recipe')
+    target = rel.field.m2m_reverse_field_name()
+    return list(rel.through.objects.filter(**{target + '__in': names})
+                .values_list(rel.field.m2m_field_name() + '_id', flat=True)
+                .distinct())
+
+
+def _discard_ranked(model, ids):
+    """Return a core.ranking index change dropping the deleted rows"""
+    if model is Recipe:
+        def change(index):
+            for pk in ids:
+                index.discard_recipe(pk)
+    else:
+        relation = 'tags' if model._meta.model_name == 'tag' \
+            else 'ingredients'
+
+        def change(index):
+            for pk in ids:
+                index.discard_feature(relation, pk)
+    return change
+
+
+def delete_objects(queryset, ids=None):
+    """Delete the recipes, tags or ingredients of queryset in bulk
+
+    ids limits the deletion to those rows of queryset. Runs in one
+    transaction, a chunk of rows at a time. The per object delete
+    receivers of core.signals are skipped, totals, usage counts, images
+    and search vectors are updated once per chunk and data versions and
+    ranking indexes once per owner instead. Returns the number of deleted
+    rows.
+    """
+    model = queryset.model
+    scopes = () if model is Recipe else (model._meta.model_name,)
+    deleted = 0
+    owners = defaultdict(list)
+    with transaction.atomic(), _defer_deletes():
+        if ids is None:
+            ids = list(queryset.values_list('pk', flat=True))
+        for chunk in chunked(ids):
+            objs = queryset.filter(pk__in=chunk)
+            for pk, user_id in objs.order_by().values_list('pk', 'user_id'):
+                owners[user_id].append(pk)
+            if model is Recipe:
+                _release_recipes(objs)
+            else:
+                recipe_ids = _linked_recipe_ids(objs)
+            deleted += objs.delete()[1].get(model._meta.label, 0)
+            if model is not Recipe:
+                update_search_vectors(recipe_ids, touch=True)
+        for user_id, owned in owners.items():
+            bump_data_version(user_id, *scopes)
+            ranking.update_indexes(user_id, _discard_ranked(model, owned))
+    return deleted
+
+
+def create_recipes(items):
+    """Create recipes with their tags and ingredients in bulk
+
+    items are dicts of Recipe fields plus optional `tag_ids` and
+    `ingredient_ids` lists. The ids are kept on the returned recipes.
+    """
+    recipes = []
+    with transaction.atomic():
+        for item in items:
+            recipe = Recipe(**{key: value for key, value in item.items()
+                               if key not in dict(RECIPE_RELATIONS)})
+            for key, _ in RECIPE_RELATIONS:
+                setattr(recipe, key, list(item.get(key, [])))
+            recipes.append(recipe)
+        insert_objects(Recipe, recipes)
+        for key, relation in RECIPE_RELATIONS:
+            replace_relations(relation, {
+                recipe.pk: getattr(recipe, key) for recipe in recipes
+                if getattr(recipe, key)
+            }, clear=False)
+        update_search_vectors([recipe.pk for recipe in recipes])
+        stats.add_recipes(recipes)
+    return recipes
+
+
+def update_recipes(queryset, items):
+    """Update recipes of queryset from dicts holding an `id` key
+
+    Relations are only replaced for items that contain them.
+    """
+    with transaction.atomic():
+        changed = queryset.filter(pk__in=[item['id'] for item in items])
+        totals_changed = any('price' in item or 'time_minutes' in item
+                             for item in items)
+        if totals_changed:
+            before = stats.recipe_totals(changed)
+        updated = update_objects(queryset, items, RECIPE_FIELDS)
+        if totals_changed:
+            for user_id, (count, price, minutes) in \
+                    stats.recipe_totals(changed).items():
+                old_price, old_minutes = before[user_id][1:]
+                stats.add_to_totals(user_id, price=price - old_price,
+                                    time_minutes=minutes - old_minutes)
+        for key, relation in RECIPE_RELATIONS:
+            replace_relations(relation, {
+                item['id']: item[key] for item in items if key in item
+            })
+        update_search_vectors([item['id'] for item in items])
+    return updated
+
+
+def _copy_rows(cursor, table, columns, rows, not_null=()):
+    """Load rows into table with PostgreSQL COPY ... FROM STDIN
+
+    csv.writer writes None and '' alike as an empty field, which COPY
+    reads as NULL unless the column is listed in not_null.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    quote_name = connection.ops.quote_name
+    options = 'FORMAT csv'
+    if not_null:
+        options += ', FORCE_NOT_NULL (%s)' % ', '.join(
+            quote_name(column) for column in not_null)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (%s)' % (
+        quote_name(table), ', '.join(quote_name(column) for column in columns),
+        options,
+    ), buffer)
+
+
+def copy_recipes(items):
+    """PostgreSQL only create_recipes variant loading rows with COPY
+
+    Primary keys are drawn from the table's sequence up front, so the
+    relation rows can be copied without reading the recipes back.
+    """
+    meta = Recipe._meta
+    # Every column without a database default must be listed
+    fields = [field for field in meta.concrete_fields if field.name not in
+              ('id', 'user', 'updated_at', 'search_vector')]
+    columns = ['id', 'user_id', 'updated_at'] + \
+        [field.column for field in fields]
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+            "FROM generate_series(1, %s)", [meta.db_table, len(items)])
+        ids = [row[0] for row in cursor.fetchall()]
+        _copy_rows(cursor, meta.db_table, columns, (
+            [pk, item['user'].pk, now] +
+            [item.get(field.name, field.get_default()) for field in fields]
+            for pk, item in zip(ids, items)
+        ), not_null=[field.column for field in fields
+                     if field.empty_strings_allowed and not field.null])
+        for key, relation in RECIPE_RELATIONS:
+            field = meta.get_field(relation)
+            _copy_rows(
+                cursor, field.remote_field.through._meta.db_table,
+                [field.m2m_column_name(), field.m2m_reverse_name()],
+                ([pk, related_id]
+                 for pk, item in zip(ids, items)
+                 for related_id in set(item.get(key, ()))))
+            stats.add_usage(field.related_model, stats.count_links(
+                set(item.get(key, ())) for item in items))
+        update_search_vectors(ids)
+        stats.add_recipes(Recipe(user=item['user'], **{
+            name: item[name] for name in ('price', 'time_minutes')
+        }) for item in items)
+    return ids
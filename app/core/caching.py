@@ -0,0 +1,127 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+class CacheStats:
+    """Thread safe hit and miss counters of the current process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+stats = CacheStats()
+
+
+def api_cache():
+    """Return the cache holding API responses and data versions"""
+    return caches[getattr(settings, 'API_CACHE_ALIAS', 'default')]
+
+
+def _version_key(user_id, scope=None):
+    if scope is None:
+        return 'api-version:%s' % user_id
+    return 'api-version:%s:%s' % (user_id, scope)
+
+
+def _new_version():
+    # Start from the clock so a lost version key never revives old entries
+    return int(time.time() * 1000000)
+
+
+def get_data_version(user_id, scope=None):
+    """Return the current version of the data owned by user_id
+
+    Scoped versions (e.g. 'tag') only change with that kind of data.
+    """
+    cache = api_cache()
+    key = _version_key(user_id, scope)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _incr_versions(keys):
+    cache = api_cache()
+    versions = []
+    for key in keys:
+        try:
+            versions.append(cache.incr(key))
+        except ValueError:
+            versions.append(_new_version())
+            cache.set(key, versions[-1], None)
+    return versions
+
+
+def bump_data_version(user_id, *scopes):
+    """Invalidate every cached response for the data of user_id
+
+    The given scoped versions are bumped as well. Versions are bumped
+    again on commit, otherwise a concurrent request could cache the not
+    yet committed state under the new version.
+    """
+    keys = [_version_key(user_id)] + \
+        [_version_key(user_id, scope) for scope in scopes]
+    _incr_versions(keys)
+    transaction.on_commit(lambda: _incr_versions(keys))
+
+
+def incr_data_version(user_id, scope=None):
+    """Bump a version right away and return the new value
+
+    Meant for on_commit callbacks which track the version they applied.
+    """
+    return _incr_versions([_version_key(user_id, scope)])[0]
+
+
+def reset_data_version(user_id, *scopes):
+    """Start fresh versions, e.g. for a new user reusing a deleted id"""
+    version = _new_version()
+    api_cache().set_many({
+        key: version for key in [_version_key(user_id)] +
+        [_version_key(user_id, scope) for scope in scopes]
+    }, None)
+
+
+def list_cache_key(prefix, request):
+    """Return the cache key of a GET request of the authenticated user"""
+    user_id = request.user.pk
+    params = sorted(
+        (key, value) for key, values in request.query_params.lists()
+        for value in values
+    )
+    # Paginated responses embed absolute next/previous links
+    raw = '%s|%s|%r' % (request.get_host(), request.path, params)
+    return 'api-list:%s:%s:%s:%s' % (
+        prefix, user_id, get_data_version(user_id),
+        hashlib.md5(raw.encode()).hexdigest())
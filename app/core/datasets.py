@@ -0,0 +1,82 @@
+import random
+from decimal import Decimal
+
+from core import bulk, stats
+from core.utils import chunked
+from core.models import Tag, Ingredient
+
+# Distribution name -> (parameter count, sampler(rng, *parameters))
+DISTRIBUTIONS = {
+    'fixed': (1, lambda rng, n: n),
+    'uniform': (2, lambda rng, low, high: rng.randint(int(low), int(high))),
+    'normal': (2, lambda rng, mean, sd: rng.gauss(mean, sd)),
+    'exp': (1, lambda rng, mean: rng.expovariate(1 / mean) if mean else 0),
+}
+
+
+def parse_distribution(spec):
+    """Return a function drawing non negative ints from rng for spec
+
+    spec is an int or a string like 'fixed:8', 'uniform:3:12' (both
+    inclusive), 'normal:8:3' or 'exp:1000' (given the mean).
+    """
+    if isinstance(spec, int):
+        spec = 'fixed:%d' % spec
+    name, *params = str(spec).split(':')
+    if not params and name.isdigit():
+        name, params = 'fixed', [name]
+    try:
+        count, sample = DISTRIBUTIONS[name]
+        params = [float(param) for param in params]
+    except (KeyError, ValueError):
+        raise ValueError('Unknown distribution %r' % spec)
+    if len(params) != count or any(param < 0 for param in params) or \
+            name == 'uniform' and params[0] > params[1]:
+        raise ValueError('Invalid parameters in %r' % spec)
+    return lambda rng: max(0, int(sample(rng, *params)))
+
+
+def create_dataset(user, recipes, tags=0, ingredients=0,
+                   tags_per_recipe=0, ingredients_per_recipe=0,
+                   batch_size=10000, seed=0, copy=False):
+    """Bulk insert generated tags, ingredients and recipes for user
+
+    The per recipe counts are ints or parse_distribution() specs. Recipes
+    are generated and inserted with their relations a batch at a time,
+    like import_recipes does, so memory stays bounded by batch_size and
+    the user's tag and ingredient ids. copy=True loads them with
+    PostgreSQL COPY instead of bulk_create.
+    """
+    rng = random.Random(seed)
+    for chunk in chunked(range(tags), batch_size):
+        Tag.objects.bulk_create(
+            Tag(user=user, name='tag %d' % i) for i in chunk)
+    for chunk in chunked(range(ingredients), batch_size):
+        Ingredient.objects.bulk_create(
+            Ingredient(user=user, name='ingredient %d' % i) for i in chunk)
+
+    # Ordered, random.sample() picks by position
+    tag_ids = list(Tag.objects.filter(user=user).order_by('id')
+                   .values_list('id', flat=True))
+    ingredient_ids = list(Ingredient.objects.filter(user=user).order_by('id')
+                          .values_list('id', flat=True))
+    tags_per_recipe = parse_distribution(tags_per_recipe)
+    ingredients_per_recipe = parse_distribution(ingredients_per_recipe)
+    create = bulk.copy_recipes if copy else bulk.create_recipes
+    for chunk in chunked(range(recipes), batch_size):
+        create([{
+            'user': user,
+            'title': 'recipe %d' % i,
+            'time_minutes': rng.randint(5, 180),
+            'price': Decimal(rng.randint(100, 9999)) / 100,
+            'link': '',
+            'tag_ids': _sample(rng, tag_ids, tags_per_recipe),
+            'ingredient_ids': _sample(rng, ingredient_ids,
+                                      ingredients_per_recipe),
+        } for i in chunk])
+    # Also creates the stats row, which users made in bulk have not got
+    stats.rebuild_stats([user.pk])
+
+
+def _sample(rng, ids, distribution):
+    return rng.sample(ids, min(distribution(rng), len(ids)))
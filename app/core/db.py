@@ -0,0 +1,277 @@
+import math
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import LazyObject, empty
+
+from core.caching import api_cache
+
+REPLICA_SELECTIONS = ('round-robin', 'least-latency')
+# Least latency selection still picks every n-th replica round robin, so
+# the latency of replicas it avoids keeps being measured
+LATENCY_PROBE_INTERVAL = 20
+# Weight of the newest query in the moving average of replica latencies
+LATENCY_SMOOTHING = 0.2
+
+# Routing state of the request handled by the current thread
+_state = threading.local()
+
+
+def check_connection(connection):
+    """Close connection if it is open but the server no longer answers
+
+    Connections inside a transaction are left alone, closing them would
+    lose its writes.
+    """
+    if connection.connection is not None and \
+            not connection.in_atomic_block and \
+            not connection.is_usable():
+        connection.close()
+
+
+def close_broken_connections(**kwargs):
+    """Check every persistent connection, connected to request_started
+
+    Django only tests connections which raised an error in the last
+    request, one dropped by the server or PgBouncer while idle would
+    otherwise fail the first query of the next request.
+    """
+    for connection in connections.all():
+        check_connection(connection)
+
+
+class ReplicaSelector:
+    """Thread safe round robin or least latency choice of a replica"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.selections = 0
+            self.latencies = {}
+
+    def record(self, alias, seconds):
+        """Add the duration of a query to the average latency of alias"""
+        with self._lock:
+            average = self.latencies.get(alias)
+            self.latencies[alias] = seconds if average is None else \
+                average + LATENCY_SMOOTHING * (seconds - average)
+
+    def select(self, aliases, selection):
+        with self._lock:
+            self.selections += 1
+            if selection == 'least-latency' and \
+                    self.selections % LATENCY_PROBE_INTERVAL:
+                # Replicas not measured yet are tried first
+                return min(aliases, key=lambda alias:
+                           self.latencies.get(alias, 0))
+            return aliases[self.selections % len(aliases)]
+
+
+selector = ReplicaSelector()
+
+
+def _pin_key(user_id):
+    return 'db-pin:%s' % user_id
+
+
+def _user_id(request):
+    """Return the id of the authenticated user of request, if known yet
+
+    Never evaluates a lazy request.user, loading it reads the database.
+    """
+    user = vars(request).get('user')
+    if user is None or isinstance(user, LazyObject) and user._wrapped is empty:
+        return None
+    return user.pk if user.is_authenticated else None
+
+
+def start_request(request):
+    """Reset the routing state of the current thread for request"""
+    _state.request = request
+    _state.replica = None
+    _state.wrote = False
+    _state.user_checked = False
+    _state.pinned_until = 0
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        # Reads validating a write must see the client's earlier writes
+        _state.pinned_until = math.inf
+    else:
+        try:
+            _state.pinned_until = float(
+                request.COOKIES.get(settings.DB_PIN_COOKIE, 0))
+        except ValueError:
+            pass
+
+
+def end_request():
+    _state.__dict__.clear()
+
+
+def pin_to_primary():
+    """Read from the primary for DB_PIN_SECONDS after the current write"""
+    _state.wrote = True
+    _state.pinned_until = max(getattr(_state, 'pinned_until', 0),
+                              time.time() + settings.DB_PIN_SECONDS)
+
+
+@contextmanager
+def primary_only():
+    """Read from the primary inside the block, e.g. in background jobs
+
+    Jobs typically read rows written just before on the primary, which a
+    lagging replica may not have yet.
+    """
+    previous = getattr(_state, 'primary_only', False)
+    _state.primary_only = True
+    try:
+        yield
+    finally:
+        _state.primary_only = previous
+
+
+def is_pinned():
+    """Return whether reads of the current thread must see its writes
+
+    Besides its own writes a request sees those of the cookie it sent
+    and, once authenticated, the marker of its user.
+    """
+    if getattr(_state, 'primary_only', False):
+        return True
+    now = time.time()
+    if getattr(_state, 'pinned_until', 0) > now:
+        return True
+    request = getattr(_state, 'request', None)
+    if request is None or _state.user_checked:
+        return False
+    user_id = _user_id(request)
+    if user_id is None:
+        return False
+    _state.user_checked = True
+    _state.pinned_until = api_cache().get(_pin_key(user_id), 0)
+    return _state.pinned_until > now
+
+
+def select_replica():
+    """Return the replica alias of the current request
+
+    A request sticks to one replica so its reads see a single snapshot,
+    reads outside requests select a replica each.
+    """
+    replica = getattr(_state, 'replica', None)
+    if replica is None:
+        replica = selector.select(settings.DB_REPLICAS,
+                                  settings.DB_REPLICA_SELECTION)
+        if getattr(_state, 'request', None) is not None:
+            _state.replica = replica
+    return replica
+
+
+class ReplicaRouter:
+    """Send reads to the DB_REPLICAS unless they must see recent writes
+
+    Reads go to the primary inside transactions and primary_only()
+    blocks, while the thread is pinned after writes and for
+    primary_models. Without replicas every decision is left to Django.
+    """
+    # Stale rows would fail the authentication of a token or session
+    # created just before on the primary
+    primary_models = {'authtoken.token', 'sessions.session'}
+
+    def db_for_read(self, model, **hints):
+        if not settings.DB_REPLICAS:
+            return None
+        if model._meta.label_lower in self.primary_models or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block or \
+                is_pinned():
+            return DEFAULT_DB_ALIAS
+        return select_replica()
+
+    def db_for_write(self, model, **hints):
+        if not settings.DB_REPLICAS:
+            return None
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Replicas hold the same rows, relate objects of any of them"""
+        aliases = {DEFAULT_DB_ALIAS, *settings.DB_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        """Replicas get their schema from the primary"""
+        if db in settings.DB_REPLICAS:
+            return False
+        return None
+
+
+class _LatencyRecorder:
+    """Connection execute wrapper timing the queries of a replica"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            selector.record(self.alias, time.perf_counter() - start)
+
+
+class PrimaryPinMiddleware:
+    """Route the reads of a request and pin clients after their writes
+
+    After a write the client's reads go to the primary for DB_PIN_SECONDS
+    through a cookie and a cache marker of its user, which also covers
+    the user's other clients. The marker is kept in the API cache, which
+    must be shared by the processes outside of DEBUG.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DB_REPLICAS:
+            raise MiddlewareNotUsed
+        if isinstance(api_cache(), LocMemCache) and not settings.DEBUG:
+            # Clients of a user served by other processes would miss the
+            # user's marker and read its writes from a lagging replica
+            raise ImproperlyConfigured(
+                'DB_REPLICAS need a cache shared by every process as '
+                'API_CACHE_ALIAS, see API_CACHE_LOCATION')
+        if settings.DB_REPLICA_SELECTION not in REPLICA_SELECTIONS:
+            raise ImproperlyConfigured(
+                'DB_REPLICA_SELECTION must be one of %s' %
+                ', '.join(REPLICA_SELECTIONS))
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start_request(request)
+        with ExitStack() as stack:
+            if settings.DB_REPLICA_SELECTION == 'least-latency':
+                for alias in settings.DB_REPLICAS:
+                    stack.enter_context(connections[alias].execute_wrapper(
+                        _LatencyRecorder(alias)))
+            response = self.get_response(request)
+
+        if _state.wrote:
+            pinned_until = time.time() + settings.DB_PIN_SECONDS
+            response.set_cookie(settings.DB_PIN_COOKIE, '%.3f' % pinned_until,
+                                max_age=settings.DB_PIN_SECONDS,
+                                httponly=True)
+            user_id = _user_id(request)
+            if user_id is not None:
+                api_cache().set(_pin_key(user_id), pinned_until,
+                                settings.DB_PIN_SECONDS)
+        # Streamed bodies are read after this returns, their reads keep
+        # the state until the thread starts its next request
+        if not response.streaming:
+            end_request()
+        return response
@@ -0,0 +1,96 @@
+import csv
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from core.models import Recipe
+from core.utils import chunked
+
+EXPORT_FIELDS = ('id', 'title', 'time_minutes', 'price', 'link')
+EXPORT_RELATIONS = ('tags', 'ingredients')
+# Separates tag and ingredient names inside a CSV cell
+CSV_NAME_SEPARATOR = ';'
+
+
+def _related_names(relation, recipe_ids):
+    """Return recipe id -> sorted names of the recipes' tags/ingredients"""
+    field = Recipe._meta.get_field(relation)
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    names = defaultdict(list)
+    for chunk in chunked(recipe_ids):
+        rows = field.remote_field.through.objects \
+            .filter(**{source + '__in': chunk}) \
+            .values_list(source, target + '__name') \
+            .order_by(source, target + '__name')
+        for recipe_id, name in rows:
+            names[recipe_id].append(name)
+    return names
+
+
+def _keyset_rows(rows, chunk_size):
+    """Yield rows ordered by id, reading chunk_size rows per query"""
+    last_id = None
+    while True:
+        page = rows if last_id is None else rows.filter(id__gt=last_id)
+        chunk = list(page[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id']
+
+
+def iter_recipes(queryset, chunk_size):
+    """Yield recipes of queryset as dicts including tag/ingredient names
+
+    Rows are read through a server-side cursor and relations fetched in
+    batches per chunk of rows, so memory does not grow with the size of
+    the collection. Without server-side cursors, e.g. behind PgBouncer,
+    rows are paged by id instead.
+    """
+    rows = queryset.order_by('id').values(*EXPORT_FIELDS)
+    settings_dict = connections[queryset.db].settings_dict
+    if settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        rows = _keyset_rows(rows, chunk_size)
+    else:
+        rows = rows.iterator(chunk_size=chunk_size)
+    for chunk in chunked(rows, chunk_size):
+        recipe_ids = [row['id'] for row in chunk]
+        related = [(relation, _related_names(relation, recipe_ids))
+                   for relation in EXPORT_RELATIONS]
+        for row in chunk:
+            for relation, names in related:
+                row[relation] = names.get(row['id'], [])
+            yield row
+
+
+def ndjson_lines(recipes):
+    """Yield one JSON document per recipe"""
+    encoder = DjangoJSONEncoder()
+    for recipe in recipes:
+        yield encoder.encode(recipe) + '\n'
+
+
+class _Echo:
+    """File-like object handing written lines back to csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(recipes):
+    """Yield a CSV header followed by one row per recipe"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS + EXPORT_RELATIONS)
+    for recipe in recipes:
+        yield writer.writerow(
+            [recipe[field] for field in EXPORT_FIELDS] +
+            [CSV_NAME_SEPARATOR.join(recipe[relation])
+             for relation in EXPORT_RELATIONS])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
@@ -0,0 +1,182 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, features
+
+from core import db
+from core.caching import bump_data_version
+from core.models import Recipe, StoredFile
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+# Pillow feature needed to write each format, see PIL.features.check()
+THUMBNAIL_FEATURES = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+# Formats already reported as unsupported by this process
+_missing_formats = set()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process wide thumbnail worker pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+def thumbnail_name(image_name, label, image_format):
+    """Return the storage name of a thumbnail of image_name"""
+    head, tail = os.path.split(image_name)
+    root = os.path.splitext(tail)[0]
+    return os.path.join(head, 'thumbs', '%s-%s.%s' % (
+        root, label, THUMBNAIL_EXTENSIONS[image_format]))
+
+
+def thumbnail_formats():
+    """Return the configured thumbnail formats Pillow was built with"""
+    formats = []
+    for image_format in settings.THUMBNAIL_FORMATS:
+        if features.check(THUMBNAIL_FEATURES[image_format]):
+            formats.append(image_format)
+        elif image_format not in _missing_formats:
+            _missing_formats.add(image_format)
+            logger.warning('Pillow lacks %s support, skipping %s thumbnails',
+                           THUMBNAIL_FEATURES[image_format], image_format)
+    return formats
+
+
+def thumbnail_names(image_name):
+    """Yield (label, format, name) of every thumbnail written"""
+    for label, size in settings.THUMBNAIL_SIZES:
+        for image_format in thumbnail_formats():
+            yield label, image_format, \
+                thumbnail_name(image_name, label, image_format)
+
+
+def _shrink(image, size):
+    """Return image scaled to fit in a size x size box
+
+    JPEG images are decoded at the smallest DCT scale still larger than
+    the box and Pillow >= 7 cheaply reduces by an integer factor first,
+    so only the final step uses the expensive resampling filter.
+    """
+    image.draft('RGB', (size, size))
+    factor = min(image.width, image.height) // (size * 2)
+    if factor > 1 and hasattr(image, 'reduce'):
+        image = image.reduce(factor)
+    else:
+        image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+
+def image_storage():
+    """Return the content-addressed storage of recipe images"""
+    return Recipe._meta.get_field('image').storage
+
+
+def write_thumbnails(image_name):
+    """Write every configured thumbnail of a stored image
+
+    The original is decoded once, smaller sizes are derived from the
+    previous, larger thumbnail.
+    """
+    sizes = sorted(settings.THUMBNAIL_SIZES, key=lambda item: -item[1])
+    with image_storage().open(image_name) as f:
+        image = Image.open(f)
+        image = _shrink(image, sizes[0][1])
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    formats = thumbnail_formats()
+    for label, size in sizes:
+        image = _shrink(image, size)
+        for image_format in formats:
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, quality=85)
+            name = thumbnail_name(image_name, label, image_format)
+            default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def mark_thumbnails_ready(image_name):
+    """Expose the thumbnails of image_name on every recipe using it"""
+    recipes = Recipe.objects.filter(image=image_name, thumbnails_ready=False)
+    user_ids = set(recipes.values_list('user_id', flat=True))
+    if recipes.update(thumbnails_ready=True, updated_at=timezone.now()):
+        for user_id in user_ids:
+            bump_data_version(user_id)
+
+
+def generate_thumbnails(image_name):
+    """Worker job making the thumbnails of a stored image unless shared
+
+    Runs right after the upload committed, so it reads from the primary.
+    """
+    try:
+        with db.primary_only():
+            stored = StoredFile.objects.filter(name=image_name).first()
+            if stored is None:
+                # Every reference was released in the meantime
+                return
+            if not stored.thumbnails_ready:
+                write_thumbnails(image_name)
+                StoredFile.objects.filter(pk=stored.pk) \
+                    .update(thumbnails_ready=True)
+            mark_thumbnails_ready(image_name)
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            # Replica connections too, the pool threads live on
+            connections.close_all()
+
+
+def schedule_thumbnails(image_name):
+    """Reuse the thumbnails of an already stored image or make them
+
+    Returns True when existing thumbnails were reused.
+    """
+    if StoredFile.objects.filter(name=image_name,
+                                 thumbnails_ready=True).exists():
+        mark_thumbnails_ready(image_name)
+        return True
+    submit(generate_thumbnails, image_name)
+    return False
+
+
+def delete_thumbnails(image_name):
+    for label, image_format, name in thumbnail_names(image_name):
+        default_storage.delete(name)
+
+
+def release_image(image_name):
+    """Drop a reference to an image, its files go with the last on commit"""
+    image_storage().delete(
+        image_name, on_remove=lambda: delete_thumbnails(image_name))
+
+
+def _log_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error('Thumbnail job failed', exc_info=exc)
+
+
+def submit(fn, *args):
+    """Run fn in the worker pool once the current transaction commits"""
+    def run():
+        get_executor().submit(fn, *args).add_done_callback(_log_failure)
+    transaction.on_commit(run)
@@ -0,0 +1,451 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIClient
+
+from core import autocomplete, ranking
+from core.db import check_connection
+from core.utils import chunked, percentile
+from core.datasets import create_dataset
+from core.models import Ingredient, Recipe, Tag
+from recipe.pagination import RecipeCursorPagination
+
+
+class Command(BaseCommand):
+    """Django command to benchmark API endpoints on generated data
+
+    Every run creates a throwaway user owning the generated rows and
+    deletes it again at the end, so it can be pointed at a dev database.
+    """
+    help = 'Benchmark API endpoints against generated datasets'
+
+    scenarios = ('pagination', 'bulk', 'conditional', 'images',
+                 'autocomplete', 'filters', 'cookable',
+                 'similar', 'connections')
+    default_sizes = {
+        'autocomplete': [1000, 50000],
+        'cookable': [1000, 100000],
+        'similar': [1000, 100000],
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            help='Defaults to 1000 100000 1000000 rows, '
+                                 '1000 50000 names for autocomplete')
+        parser.add_argument('--requests', type=int, default=100)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--max-full-list', type=int, default=10000,
+                            help='Largest size to also time unpaginated')
+        parser.add_argument('--items', type=int, default=1000,
+                            help='Items written by the bulk scenario')
+        parser.add_argument('--uploads', type=int, default=200,
+                            help='Images uploaded by the images scenario')
+        parser.add_argument('--unique', type=int, default=20,
+                            help='Distinct images among the uploads')
+        parser.add_argument('--image-size', type=int, default=1024)
+        parser.add_argument('--filter-ids', type=int, default=10,
+                            help='Tag ids per filter in the filters scenario')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the list response cache enabled')
+
+    def handle(self, *args, **options):
+        self.options = options
+        if not options['sizes']:
+            options['sizes'] = self.default_sizes.get(
+                options['scenario'], [1000, 100000, 1000000])
+        self.client = APIClient()
+        overrides = {
+            # The in-process client always talks to the 'testserver' host
+            'ALLOWED_HOSTS': ['testserver'],
+        }
+        if not options['cache']:
+            # Repeated requests would otherwise only time the cache
+            overrides['API_CACHE_MAX_ITEMS'] = -1
+        with override_settings(**overrides):
+            getattr(self, 'run_%s' % options['scenario'])()
+
+    def create_user(self):
+        """Create a throwaway user and authenticate the client as it"""
+        user = get_user_model().objects.create_user(
+            email='bench-%s@example.com' % uuid.uuid4().hex,
+            password=None,
+        )
+        self.client.force_authenticate(user)
+        return user
+
+    def measure_each(self, url, params_list, before=None):
+        """Time one GET request per params, calling before() first"""
+        return self.measure_requests([(url, params) for params in params_list],
+                                     before)
+
+    def measure_requests(self, requests, before=None):
+        """Time one GET request per (url, params), calling before() first"""
+        timings = []
+        for url, params in requests:
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            res = self.client.get(url, params)
+            timings.append((time.perf_counter() - start) * 1000)
+            if res.status_code != 200:
+                raise CommandError('%s returned %s' % (url,
+                                                       res.status_code))
+        return timings
+
+    def measure(self, url, params=None, expect=200, **headers):
+        """Time GET requests and return the latencies in milliseconds
+
+        The body size of the last response is kept in `response_bytes`.
+        """
+        timings = []
+        for _ in range(self.options['requests']):
+            start = time.perf_counter()
+            res = self.client.get(url, params, **headers)
+            timings.append((time.perf_counter() - start) * 1000)
+            if res.status_code != expect:
+                raise CommandError('%s returned %s' % (url,
+                                                       res.status_code))
+            self.response_bytes = len(res.content)
+        return timings
+
+    def report_rate(self, label, count, seconds):
+        self.stdout.write('%-40s %10.1f items/s' % (label, count / seconds))
+
+    def report(self, label, timings):
+        self.stdout.write('%-40s p50 %8.2fms  p99 %8.2fms' % (
+            label, percentile(timings, 50), percentile(timings, 99)))
+
+    def run_pagination(self):
+        """Compare cursor pages with the full list as recipes grow"""
+        url = reverse('recipe:recipe-list')
+        params = {'page_size': self.options['page_size']}
+        for size in self.options['sizes']:
+            user = self.create_user()
+            try:
+                create_dataset(user, size,
+                               batch_size=self.options['batch_size'])
+                self.report('%d recipes, first page' % size,
+                            self.measure(url, params))
+
+                # Build a cursor pointing half way into the collection
+                middle = Recipe.objects.filter(user=user) \
+                    .order_by('-id').values_list('id', flat=True)[size // 2]
+                paginator = RecipeCursorPagination()
+                paginator.base_url = url
+                deep_url = paginator.encode_cursor(
+                    Cursor(offset=0, reverse=False, position=str(middle)))
+                self.report('%d recipes, middle page' % size,
+                            self.measure(deep_url, params))
+
+                if size <= self.options['max_full_list']:
+                    self.report('%d recipes, unpaginated' % size,
+                                self.measure(url))
+            finally:
+                user.delete()
+
+    def run_bulk(self):
+        """Compare creating recipes one by one with the bulk endpoint"""
+        count = self.options['items']
+        user = self.create_user()
+        try:
+            create_dataset(user, 0, tags=20, ingredients=20)
+            tag_ids = list(user.tag_set.values_list('id', flat=True))
+            ingredient_ids = list(
+                user.ingredient_set.values_list('id', flat=True))
+            payload = [{
+                'title': 'recipe %d' % i,
+                'time_minutes': 10,
+                'price': '5.00',
+                'tags': tag_ids[i % 20:i % 20 + 3],
+                'ingredients': ingredient_ids[i % 20:i % 20 + 5],
+            } for i in range(count)]
+
+            start = time.perf_counter()
+            for item in payload:
+                self.post(reverse('recipe:recipe-list'), item)
+            self.report_rate('single item POST', count,
+                             time.perf_counter() - start)
+
+            max_items = getattr(settings, 'BULK_MAX_ITEMS', 5000)
+            start = time.perf_counter()
+            for chunk in chunked(payload, max_items):
+                self.post(reverse('recipe:recipe-bulk'), chunk)
+            self.report_rate('bulk POST', count,
+                             time.perf_counter() - start)
+        finally:
+            user.delete()
+
+    def run_conditional(self):
+        """Compare re-downloading an unchanged list with a 304 answer"""
+        url = reverse('recipe:recipe-list')
+        for size in self.options['sizes']:
+            user = self.create_user()
+            try:
+                create_dataset(user, size, tags=10, ingredients=10,
+                               tags_per_recipe=2, ingredients_per_recipe=3,
+                               batch_size=self.options['batch_size'])
+                params = None
+                if size > self.options['max_full_list']:
+                    params = {'page_size': self.options['page_size']}
+                etag = self.client.get(url, params)['ETag']
+
+                full = self.measure(url, params)
+                full_bytes = self.response_bytes
+                self.report('%d recipes, full download' % size, full)
+                cached = self.measure(url, params, expect=304,
+                                      HTTP_IF_NONE_MATCH=etag)
+                self.report('%d recipes, not modified' % size, cached)
+                self.stdout.write('%-40s %10d bytes/request' % (
+                    '%d recipes, saved' % size,
+                    full_bytes - self.response_bytes))
+            finally:
+                user.delete()
+
+    def run_autocomplete(self):
+        """Compare prefix lookups in cached sorted names and the database"""
+        url = reverse('recipe:ingredient-list')
+        rng = random.Random(0)
+        for size in self.options['sizes']:
+            user = self.create_user()
+            key = (Ingredient._meta.label_lower, user.pk)
+            try:
+                create_dataset(user, 0, ingredients=size,
+                               batch_size=self.options['batch_size'])
+                # 'ingredient 1', 'ingredient 12', ... match fewer names
+                params = [{'prefix': ('ingredient %d' % rng.randrange(size))
+                           [:rng.randint(12, 16)]}
+                          for _ in range(self.options['requests'])]
+
+                self.report('%d names, cold cache' % size, self.measure_each(
+                    url, params, lambda: autocomplete.name_cache.delete(key)))
+                self.report('%d names, sorted in memory' % size,
+                            self.measure_each(url, params))
+                with override_settings(AUTOCOMPLETE_CACHE_MAX_NAMES=0):
+                    autocomplete.name_cache.delete(key)
+                    self.report('%d names, database' % size,
+                                self.measure_each(url, params))
+            finally:
+                autocomplete.name_cache.delete(key)
+                user.delete()
+
+    def run_filters(self):
+        """Time tag match-any/match-all and range filters on recipes"""
+        url = reverse('recipe:recipe-list')
+        count = self.options['filter_ids']
+        for size in self.options['sizes']:
+            user = self.create_user()
+            try:
+                create_dataset(user, size, tags=count * 3, ingredients=100,
+                               tags_per_recipe=count,
+                               ingredients_per_recipe=5,
+                               batch_size=self.options['batch_size'])
+                tag_ids = list(Tag.objects.filter(user=user)
+                               .values_list('id', flat=True)[:count])
+                ids = ','.join(str(pk) for pk in tag_ids)
+                pair = ','.join(str(pk) for pk in tag_ids[:2])
+                for label, params in (
+                        ('any of %d tags' % count, {'tags': ids}),
+                        ('all of 2 tags', {'tags_all': pair}),
+                        ('all of %d tags' % count, {'tags_all': ids}),
+                        ('time and price range', {'max_time': 60,
+                                                  'min_price': '10',
+                                                  'max_price': '40'})):
+                    params['page_size'] = self.options['page_size']
+                    self.report('%d recipes, %s' % (size, label),
+                                self.measure(url, params))
+
+                # Match-all as one grouped subquery vs one join per tag
+                recipes = Recipe.objects.filter(user=user).order_by('-id')
+                joined = recipes
+                for pk in tag_ids:
+                    joined = joined.filter(tags=pk)
+                page = slice(0, self.options['page_size'])
+                self.report('%d recipes, grouped subquery' % size,
+                            self.time_queryset(recipes.related_to_all(
+                                'tags', tag_ids)[page]))
+                self.report('%d recipes, %d chained joins' % (size, count),
+                            self.time_queryset(joined[page]))
+            finally:
+                user.delete()
+
+    def run_cookable(self):
+        """Time ranking recipes by ingredients at hand, cold and warm"""
+        url = reverse('recipe:recipe-cookable')
+        rng = random.Random(0)
+        for size in self.options['sizes']:
+            user = self.create_user()
+            try:
+                create_dataset(user, size, ingredients=500,
+                               ingredients_per_recipe=8,
+                               batch_size=self.options['batch_size'])
+                ingredient_ids = list(user.ingredient_set.values_list(
+                    'id', flat=True))
+                params = [{'have': ','.join(str(pk) for pk in rng.sample(
+                    ingredient_ids, 20))}
+                    for _ in range(self.options['requests'])]
+                key = (('ingredients',), user.pk)
+
+                self.report('%d recipes, index build' % size,
+                            self.measure_each(
+                                url, params[:5],
+                                lambda: ranking.index_cache.delete(key)))
+                self.report('%d recipes, ranked from index' % size,
+                            self.measure_each(url, params))
+            finally:
+                ranking.index_cache.delete(key)
+                user.delete()
+
+    def run_similar(self):
+        """Time listing similar recipes, cold and warm"""
+        rng = random.Random(0)
+        for size in self.options['sizes']:
+            user = self.create_user()
+            try:
+                create_dataset(user, size, tags=100, tags_per_recipe=3,
+                               ingredients=500, ingredients_per_recipe=8,
+                               batch_size=self.options['batch_size'])
+                recipe_ids = list(user.recipe_set.values_list(
+                    'id', flat=True))
+                urls = [reverse('recipe:recipe-similar', args=[pk])
+                        for pk in rng.sample(recipe_ids,
+                                             self.options['requests'])]
+                key = (ranking.SIMILARITY_RELATIONS, user.pk)
+
+                self.report('%d recipes, index build' % size,
+                            self.measure_requests(
+                                [(url, None) for url in urls[:5]],
+                                lambda: ranking.index_cache.delete(key)))
+                self.report('%d recipes, similar from index' % size,
+                            self.measure_requests(
+                                [(url, None) for url in urls]))
+            finally:
+                ranking.index_cache.delete(key)
+                user.delete()
+
+    def run_connections(self):
+        """Time the database work of a request with and without reuse
+
+        Each request runs Django's end of request connection handling on
+        a separate connection to the default database, so connecting
+        costs the same as in the server. Point DB_HOST at PgBouncer to
+        time connecting through it.
+        """
+        for label, max_age, health_checks in (
+                ('new connection per request', 0, False),
+                ('persistent connection', 60, False),
+                ('persistent, health checked', 60, True)):
+            settings_dict = dict(connections['default'].settings_dict,
+                                 CONN_MAX_AGE=max_age)
+            backend = load_backend(settings_dict['ENGINE'])
+            connection = backend.DatabaseWrapper(settings_dict, 'default')
+            timings = []
+            try:
+                for _ in range(self.options['requests']):
+                    start = time.perf_counter()
+                    connection.close_if_unusable_or_obsolete()
+                    if health_checks:
+                        check_connection(connection)
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                    connection.close_if_unusable_or_obsolete()
+                    timings.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+            self.report(label, timings)
+
+    def time_queryset(self, queryset):
+        """Time evaluating a queryset and return latencies in ms"""
+        timings = []
+        for _ in range(self.options['requests']):
+            start = time.perf_counter()
+            list(queryset.all())
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def run_images(self):
+        """Upload a corpus with duplicates and report latency and disk use"""
+        options = self.options
+        rng = random.Random(0)
+        side = options['image_size']
+        corpus = []
+        for i in range(options['unique']):
+            buffer = io.BytesIO()
+            Image.frombytes('RGB', (side, side), bytes(
+                rng.getrandbits(8) for _ in range(side * side * 3))
+            ).save(buffer, 'JPEG', quality=90)
+            corpus.append(buffer.getvalue())
+
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                user = self.create_user()
+                try:
+                    self.upload_corpus(user, corpus, media_root)
+                finally:
+                    user.delete()
+        finally:
+            shutil.rmtree(media_root)
+
+    def upload_corpus(self, user, corpus, media_root):
+        create_dataset(user, self.options['uploads'])
+        recipe_ids = Recipe.objects.filter(user=user) \
+            .values_list('id', flat=True)
+        timings = []
+        uploaded = 0
+        for i, recipe_id in enumerate(recipe_ids):
+            data = corpus[i % len(corpus)]
+            uploaded += len(data)
+            upload = io.BytesIO(data)
+            upload.name = 'photo.jpg'
+            url = reverse('recipe:recipe-upload-image', args=[recipe_id])
+            start = time.perf_counter()
+            res = self.client.post(url, {'image': upload},
+                                   format='multipart')
+            timings.append((time.perf_counter() - start) * 1000)
+            if res.status_code != 200:
+                raise CommandError('%s returned %s' % (url,
+                                                       res.status_code))
+        self.report('%d uploads, %d distinct' % (len(timings), len(corpus)),
+                    timings)
+
+        start = time.perf_counter()
+        pending = Recipe.objects.filter(user=user, thumbnails_ready=False)
+        while pending.exists():
+            if time.perf_counter() - start > 300:
+                raise CommandError('Thumbnails not ready')
+            time.sleep(0.1)
+        self.stdout.write('%-40s %10.2fs' % (
+            'thumbnails ready after', time.perf_counter() - start))
+
+        stored = sum(os.path.getsize(os.path.join(root, name))
+                     for root, dirs, names in os.walk(media_root)
+                     for name in names)
+        self.stdout.write('%-40s %10.1f MiB' % ('uploaded',
+                                                uploaded / 2 ** 20))
+        self.stdout.write('%-40s %10.1f MiB' % ('stored incl. thumbnails',
+                                                stored / 2 ** 20))
+
+    def post(self, url, data):
+        res = self.client.post(url, data, format='json')
+        if res.status_code != 201:
+            raise CommandError('%s returned %s' % (url, res.status_code))
+        return res
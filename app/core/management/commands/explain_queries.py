@@ -0,0 +1,118 @@
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.datasets import create_dataset
+from core.models import Tag, Ingredient, Recipe
+
+# Created with raw SQL in 0005_indexes, the M2M through models are
+# auto-generated and can not declare Meta.indexes themselves
+THROUGH_INDEXES = (
+    'core_recipe_tags_tag_recipe_idx',
+    'core_recipe_ingredients_ingredient_recipe_idx',
+)
+
+
+class Command(BaseCommand):
+    """Django command to print query plans before/after our indexes
+
+    The dataset is generated inside a transaction which is rolled back at
+    the end, together with temporarily dropping the indexes.
+    """
+    help = 'Report EXPLAIN (ANALYZE) plans of the API queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=500)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--per-recipe', type=int, default=5)
+        parser.add_argument('--noise-users', type=int, default=4,
+                            help='Other users owning the same amount')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.create_data(options)
+            self.explain_all(user, 'With indexes')
+            self.drop_indexes()
+            self.explain_all(user, 'Without indexes')
+            transaction.set_rollback(True)
+
+    def create_data(self, options):
+        """Generate the dataset and return the user queries run as"""
+        users = [
+            get_user_model().objects.create_user(
+                email='explain-%s@example.com' % uuid.uuid4().hex)
+            for _ in range(options['noise_users'] + 1)
+        ]
+        for seed, user in enumerate(users):
+            create_dataset(
+                user, options['recipes'],
+                tags=options['tags'],
+                ingredients=options['ingredients'],
+                tags_per_recipe=options['per_recipe'],
+                ingredients_per_recipe=options['per_recipe'],
+                seed=seed,
+            )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return users[0]
+
+    def drop_indexes(self):
+        names = [index.name for model in (Recipe, Tag, Ingredient)
+                 for index in model._meta.indexes]
+        with connection.cursor() as cursor:
+            for name in names + list(THROUGH_INDEXES):
+                cursor.execute('DROP INDEX %s' % name)
+
+    def get_queries(self, user):
+        """Return (label, queryset) pairs mirroring the API views"""
+        tag_ids = list(Tag.objects.filter(user=user)
+                       .values_list('id', flat=True)[:3])
+        ingredient_ids = list(Ingredient.objects.filter(user=user)
+                              .values_list('id', flat=True)[:3])
+        recipes = Recipe.objects.filter(user=user).order_by('-id')
+        return (
+            ('recipe list page', recipes[:100]),
+            ('recipes by tags',
+             recipes.related_to_any('tags', tag_ids)[:100]),
+            ('recipes by ingredients',
+             recipes.related_to_any('ingredients', ingredient_ids)[:100]),
+            ('recipes with all tags',
+             recipes.related_to_all('tags', tag_ids)[:100]),
+            ('recipes by time and price',
+             recipes.filter(time_minutes__lte=30, price__gte=10,
+                            price__lte=40)[:100]),
+            ('tag list page',
+             Tag.objects.filter(user=user).order_by('-name')[:100]),
+            ('ingredient list page',
+             Ingredient.objects.filter(user=user).order_by('-name')[:100]),
+            ('assigned tags, DISTINCT join',
+             Tag.objects.filter(user=user, recipe__isnull=False)
+             .order_by('-name').distinct()),
+            ('assigned tags, EXISTS',
+             Tag.objects.filter(user=user).assigned().order_by('-name')),
+            ('tags with recipe counts',
+             Tag.objects.filter(user=user).with_recipe_counts()
+             .order_by('-name')[:100]),
+        )
+
+    def explain_all(self, user, heading):
+        self.stdout.write(self.style.MIGRATE_HEADING(heading))
+        options = {}
+        if connection.vendor == 'postgresql':
+            options = {'analyze': True}
+        prefix = connection.ops.explain_query_prefix(**options)
+        for label, queryset in self.get_queries(user):
+            sql, params = queryset.query.sql_with_params()
+            # SQLite caches prepared statements by their text, the comment
+            # makes sure plans are recomputed after the indexes are gone
+            with connection.cursor() as cursor:
+                cursor.execute('%s %s /* %s */' % (prefix, sql, heading),
+                               params)
+                rows = cursor.fetchall()
+            self.stdout.write(self.style.SUCCESS(label))
+            for row in rows:
+                self.stdout.write(' '.join(str(column) for column in row))
+            self.stdout.write('')
@@ -0,0 +1,93 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.datasets import create_dataset, parse_distribution
+from core.utils import chunked
+
+
+class Command(BaseCommand):
+    """Django command to generate a reproducible synthetic dataset
+
+    Users are numbered <prefix>-<n>@example.com. Every user's counts and
+    rows are drawn from its own generator seeded by --seed and n, so the
+    same arguments always produce the same data. All tables, including
+    the tag and ingredient through tables, are filled with bulk_create
+    in batches of --batch-size rows, or with COPY given --copy.
+    """
+    help = 'Generate users with tags, ingredients and recipes in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1)
+        parser.add_argument('--recipes', default='1000',
+                            help="Recipes per user, e.g. 1000, "
+                                 "'uniform:10:500', 'normal:200:50' or "
+                                 "'exp:1000'")
+        parser.add_argument('--tags', type=int, default=50,
+                            help='Tags per user')
+        parser.add_argument('--ingredients', type=int, default=500,
+                            help='Ingredients per user')
+        parser.add_argument('--tags-per-recipe', default='uniform:0:5')
+        parser.add_argument('--ingredients-per-recipe', default='uniform:3:12')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--prefix', default='generated',
+                            help='Email prefix of the generated users')
+        parser.add_argument('--password',
+                            help='Password of every user, unusable if unset')
+        parser.add_argument('--copy', action='store_true',
+                            help='Load recipes with COPY (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        prefix = options['prefix']
+        if User.objects.filter(email__startswith=prefix + '-').exists():
+            raise CommandError('Users %s-* exist already, pick another '
+                               '--prefix' % prefix)
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy requires PostgreSQL')
+        try:
+            recipes = parse_distribution(options['recipes'])
+            for name in ('tags_per_recipe', 'ingredients_per_recipe'):
+                parse_distribution(options[name])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        # Hashing is slow on purpose, every user shares the one hash
+        password = make_password(options['password'])
+
+        start = time.perf_counter()
+        generated = 0
+        for batch in chunked(range(options['users']),
+                             options['batch_size']):
+            emails = ['%s-%d@example.com' % (prefix, n) for n in batch]
+            User.objects.bulk_create(User(email=email, password=password)
+                                     for email in emails)
+            ids = dict(User.objects.filter(email__in=emails)
+                       .values_list('email', 'pk'))
+            for n, email in zip(batch, emails):
+                rng = random.Random('%d-%d' % (options['seed'], n))
+                count = recipes(rng)
+                create_dataset(
+                    User(pk=ids[email], email=email), count,
+                    tags=options['tags'],
+                    ingredients=options['ingredients'],
+                    tags_per_recipe=options['tags_per_recipe'],
+                    ingredients_per_recipe=options[
+                        'ingredients_per_recipe'],
+                    batch_size=options['batch_size'],
+                    seed=rng.getrandbits(32),
+                    copy=options['copy'])
+                generated += count
+                self.report(n + 1, generated, time.perf_counter() - start)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Generated %d users and %d recipes in %.1fs' % (
+                options['users'], generated, time.perf_counter() - start)))
+
+    def report(self, users, recipes, seconds):
+        self.stdout.write('%d users  %d recipes  %.0f recipes/s' % (
+            users, recipes, recipes / max(seconds, 1e-9)))
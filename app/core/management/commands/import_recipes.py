@@ -0,0 +1,172 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core import bulk, caching, ranking
+from core.autocomplete import NAME_SCOPES
+from core.export import CSV_NAME_SEPARATOR
+from core.models import Tag, Ingredient
+from core.utils import chunked
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def read_ndjson(stream):
+    """Yield (line number, record) pairs of an NDJSON stream"""
+    for lineno, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield lineno, json.loads(line)
+            except ValueError as exc:
+                raise CommandError('Line %d: %s' % (lineno, exc))
+
+
+def read_csv(stream):
+    """Yield (line number, record) pairs of a CSV stream with a header"""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        for relation in ('tags', 'ingredients'):
+            names = record.get(relation) or ''
+            record[relation] = [name for name in
+                                names.split(CSV_NAME_SEPARATOR) if name]
+        yield reader.line_num, record
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def clean_records(records):
+    """Yield recipe dicts of the records, raising on invalid ones
+
+    Records have the shape written by the recipe export, `id` is ignored.
+    """
+    for lineno, record in records:
+        try:
+            title = record['title'].strip()
+            if not title:
+                raise ValueError('title may not be blank')
+            yield {
+                'title': title,
+                'time_minutes': int(record['time_minutes']),
+                'price': Decimal(str(record['price'])),
+                'link': record.get('link') or '',
+                'tags': [name.strip() for name in record.get('tags') or ()],
+                'ingredients': [name.strip() for name in
+                                record.get('ingredients') or ()],
+            }
+        except (KeyError, TypeError, ValueError, InvalidOperation,
+                AttributeError) as exc:
+            raise CommandError(
+                'Line %d: invalid record (%r)' % (lineno, exc))
+
+
+class NameMap:
+    """In-memory name -> id map of a user's tags or ingredients
+
+    Existing names are loaded once, missing ones are inserted in bulk.
+    """
+
+    def __init__(self, model, user):
+        self.model = model
+        self.user = user
+        self.ids = dict(model.objects.filter(user=user)
+                        .values_list('name', 'id').order_by('-id'))
+
+    def resolve(self, names_per_item):
+        """Return the ids of every list of names, creating missing names"""
+        missing = {name for names in names_per_item for name in names
+                   if name not in self.ids}
+        if missing:
+            objs = bulk.insert_objects(self.model, [
+                self.model(user=self.user, name=name)
+                for name in sorted(missing)
+            ])
+            self.ids.update((obj.name, obj.pk) for obj in objs)
+        return [[self.ids[name] for name in names]
+                for names in names_per_item]
+
+
+class Command(BaseCommand):
+    """Django command to bulk import recipes from NDJSON or CSV
+
+    The input is consumed as a stream, only one batch of records is held
+    in memory at a time. The format matches the recipe export endpoint.
+    """
+    help = 'Import recipes for a user from an NDJSON or CSV file'
+    stealth_options = ('stdin',)
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, '-' for stdin")
+        parser.add_argument('--user', required=True,
+                            help='Email of the owning user')
+        parser.add_argument('--format', choices=READERS,
+                            help='Defaults to the file extension or ndjson')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--copy', action='store_true',
+                            help='Load rows with COPY (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('User %s does not exist' % options['user'])
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy requires PostgreSQL')
+
+        path = options['path']
+        input_format = options['format'] or \
+            ('csv' if path.endswith('.csv') else 'ndjson')
+        if path == '-':
+            stream = options.get('stdin', sys.stdin)
+            self.run(user, stream, input_format, options)
+        else:
+            with open(path, newline='', encoding='utf-8') as stream:
+                self.run(user, stream, input_format, options)
+
+    def run(self, user, stream, input_format, options):
+        records = clean_records(READERS[input_format](stream))
+        create = bulk.copy_recipes if options['copy'] \
+            else bulk.create_recipes
+        tags = NameMap(Tag, user)
+        ingredients = NameMap(Ingredient, user)
+
+        start = time.perf_counter()
+        imported = 0
+        for batch in chunked(records, options['batch_size']):
+            with transaction.atomic():
+                tag_ids = tags.resolve([item.pop('tags') for item in batch])
+                ingredient_ids = ingredients.resolve(
+                    [item.pop('ingredients') for item in batch])
+                for item, item_tags, item_ingredients in zip(
+                        batch, tag_ids, ingredient_ids):
+                    item.update(user=user, tag_ids=item_tags,
+                                ingredient_ids=item_ingredients)
+                create(batch)
+            imported += len(batch)
+            self.report(imported, time.perf_counter() - start)
+
+        # Bulk inserts send no model signals
+        caching.bump_data_version(user.pk, ranking.LINKS_SCOPE, *NAME_SCOPES)
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d recipes' % imported))
+
+    def report(self, imported, seconds):
+        rate = imported / max(seconds, 1e-9)
+        line = '%d rows  %.0f rows/s' % (imported, rate)
+        if resource is not None:
+            # ru_maxrss is in KiB on Linux
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            line += '  peak RSS %.1f MiB' % (peak / 1024)
+        self.stdout.write(line)
@@ -0,0 +1,425 @@
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.datasets import create_dataset
+from core.metrics import QueryCounter
+from core.models import Ingredient, Recipe, Tag
+from core.utils import percentile
+
+PASSWORD = 'loadtest-password'
+# Recipe lists are requested a page at a time, like clients do
+PAGE_SIZE = 50
+
+# Set by ProfilingMiddleware, the only query count a remote server reports
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def _sample(rng, ids, count):
+    return ','.join(str(pk) for pk in rng.sample(ids, min(count, len(ids))))
+
+
+def _recipe_payload(data, rng):
+    return {
+        'title': 'load %s' % uuid.uuid4().hex[:8],
+        'time_minutes': rng.randint(5, 180),
+        'price': '%.2f' % (rng.randint(100, 9999) / 100),
+        'tags': rng.sample(data.tag_ids, min(3, len(data.tag_ids))),
+        'ingredients': rng.sample(data.ingredient_ids,
+                                  min(8, len(data.ingredient_ids))),
+    }
+
+
+def _recipe_url(name, data, rng, recipe_id=None):
+    if recipe_id is None:
+        recipe_id = rng.choice(data.recipe_ids)
+    return reverse(name, args=[recipe_id])
+
+
+# name -> (method, request(data, rng) returning (path, params or body))
+ENDPOINTS = {
+    'user.create': ('POST', lambda data, rng: (reverse('user:create'), {
+        'email': '%s-%s@example.com' % (data.prefix, uuid.uuid4().hex),
+        'password': PASSWORD, 'name': 'Load test'})),
+    'user.token': ('POST', lambda data, rng: (reverse('user:token'), {
+        'email': data.user.email, 'password': PASSWORD})),
+    'user.me': ('GET', lambda data, rng: (reverse('user:me'), {})),
+    'tags.list': ('GET', lambda data, rng: (reverse('recipe:tag-list'), {})),
+    'tags.assigned': ('GET', lambda data, rng: (
+        reverse('recipe:tag-list'), {'assigned_only': 1})),
+    'tags.counts': ('GET', lambda data, rng: (
+        reverse('recipe:tag-list'), {'with_counts': 1})),
+    'tags.autocomplete': ('GET', lambda data, rng: (
+        reverse('recipe:tag-list'), {'prefix': 'tag %d' % rng.randint(1, 9)})),
+    'tags.create': ('POST', lambda data, rng: (
+        reverse('recipe:tag-list'), {'name': 'load %s' % uuid.uuid4().hex})),
+    'ingredients.list': ('GET', lambda data, rng: (
+        reverse('recipe:ingredient-list'), {})),
+    'ingredients.autocomplete': ('GET', lambda data, rng: (
+        reverse('recipe:ingredient-list'),
+        {'prefix': 'ingredient %d' % rng.randint(1, 9)})),
+    'ingredients.create': ('POST', lambda data, rng: (
+        reverse('recipe:ingredient-list'),
+        {'name': 'load %s' % uuid.uuid4().hex})),
+    'recipes.list': ('GET', lambda data, rng: (
+        reverse('recipe:recipe-list'), {'page_size': PAGE_SIZE})),
+    'recipes.filter': ('GET', lambda data, rng: (
+        reverse('recipe:recipe-list'), {
+            'tags': _sample(rng, data.tag_ids, 2),
+            'max_price': rng.randint(10, 100), 'page_size': PAGE_SIZE})),
+    'recipes.search': ('GET', lambda data, rng: (
+        reverse('recipe:recipe-list'),
+        {'search': 'recipe %d' % rng.randint(1, 99)})),
+    'recipes.detail': ('GET', lambda data, rng: (
+        _recipe_url('recipe:recipe-detail', data, rng), {})),
+    'recipes.create': ('POST', lambda data, rng: (
+        reverse('recipe:recipe-list'), _recipe_payload(data, rng))),
+    'recipes.update': ('PATCH', lambda data, rng: (
+        _recipe_url('recipe:recipe-detail', data, rng),
+        {'title': 'updated %s' % uuid.uuid4().hex[:8]})),
+    'recipes.bulk': ('POST', lambda data, rng: (
+        reverse('recipe:recipe-bulk'),
+        [_recipe_payload(data, rng) for _ in range(10)])),
+    'recipes.cookable': ('GET', lambda data, rng: (
+        reverse('recipe:recipe-cookable'),
+        {'have': _sample(rng, data.ingredient_ids, 20)})),
+    'recipes.similar': ('GET', lambda data, rng: (
+        _recipe_url('recipe:recipe-similar', data, rng), {})),
+    'recipes.stats': ('GET', lambda data, rng: (reverse('recipe:stats'), {})),
+    'recipes.export': ('GET', lambda data, rng: (
+        reverse('recipe:recipe-export'), {})),
+    'recipes.delete': ('DELETE', lambda data, rng: (
+        _recipe_url('recipe:recipe-detail', data, rng, data.take_created()),
+        {})),
+}
+
+
+class UserData:
+    """A load test user and the ids of its rows"""
+
+    def __init__(self, user, token, prefix):
+        self.user = user
+        self.token = token
+        self.prefix = prefix
+        self.recipe_ids = list(Recipe.objects.filter(user=user)
+                               .values_list('id', flat=True))
+        self.tag_ids = list(Tag.objects.filter(user=user)
+                            .values_list('id', flat=True))
+        self.ingredient_ids = list(Ingredient.objects.filter(user=user)
+                                   .values_list('id', flat=True))
+        # Created by recipes.create, removed by recipes.delete
+        self.created = []
+        self.lock = threading.Lock()
+
+    def add_created(self, recipe_id):
+        with self.lock:
+            self.created.append(recipe_id)
+
+    def take_created(self):
+        with self.lock:
+            if self.created:
+                return self.created.pop()
+        raise CommandError('recipes.delete needs recipes.create to run first')
+
+
+class InProcessClient:
+    """Send requests through the Django test client, counting queries"""
+
+    def __init__(self, data):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + data.token)
+
+    def send(self, method, path, payload):
+        counter = QueryCounter()
+        if method == 'GET':
+            path, payload = self._with_query(path, payload), None
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(counter))
+            res = self.client.generic(
+                method, path, json.dumps(payload) if payload else '',
+                content_type='application/json')
+            # Drains streamed responses so they are timed completely
+            body = res.getvalue()
+        return res.status_code, body, counter.count
+
+    @staticmethod
+    def _with_query(path, params):
+        return '%s?%s' % (path, urlencode(params)) if params else path
+
+
+class HTTPClient(InProcessClient):
+    """Send requests to a running server"""
+
+    def __init__(self, data, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Authorization': 'Token ' + data.token,
+                        'Content-Type': 'application/json'}
+
+    def send(self, method, path, payload):
+        if method == 'GET':
+            path, payload = self._with_query(path, payload), None
+        request = Request(self.base_url + path, method=method,
+                          headers=self.headers,
+                          data=json.dumps(payload).encode()
+                          if payload else None)
+        try:
+            with urlopen(request) as res:
+                return res.status, res.read(), self._queries(res.headers)
+        except HTTPError as exc:
+            return exc.code, exc.read(), self._queries(exc.headers)
+
+    @staticmethod
+    def _queries(headers):
+        match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', ''))
+        return int(match.group(1)) if match else None
+
+
+class Command(BaseCommand):
+    """Django command to load test every API endpoint
+
+    Generates users owning tags, ingredients and recipes, then sends
+    --requests requests to each endpoint from --concurrency client
+    threads, either in process or to a server given by --base-url using
+    the same database. Results are written as JSON for comparison
+    between commits, all generated rows are deleted at the end.
+    """
+    help = 'Load test the API endpoints and report latency as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS,
+                            help='Defaults to all of them in order')
+        parser.add_argument('--users', type=int, default=4)
+        parser.add_argument('--recipes', type=int, default=1000,
+                            help='Recipes per user')
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--ingredients', type=int, default=300)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--base-url',
+                            help='Server to load, e.g. http://localhost:8000')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Disable the list response cache '
+                                 '(in process only)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--label', help='Stored with the results')
+        parser.add_argument('--output', help="JSON results file, '-' for "
+                                             "stdout instead of the table")
+        parser.add_argument('--compare',
+                            help='JSON results to report changes against')
+        parser.add_argument('--max-regression', type=float,
+                            help='Fail if any p95 grew by more percent')
+
+    def handle(self, *args, **options):
+        self.options = options
+        endpoints = options['endpoints'] or list(ENDPOINTS)
+        if 'recipes.delete' in endpoints and 'recipes.create' not in \
+                endpoints[:endpoints.index('recipes.delete')]:
+            raise CommandError('recipes.delete needs recipes.create first')
+        if options['concurrency'] > 1 and not options['base_url'] and \
+                connection.vendor == 'sqlite' and \
+                connection.is_in_memory_db():
+            raise CommandError('Threads cannot share an in-memory SQLite '
+                               'database, use --concurrency 1')
+
+        prefix = 'loadtest-%s' % uuid.uuid4().hex[:12]
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if options['no_cache']:
+            overrides['API_CACHE_MAX_ITEMS'] = -1
+        try:
+            users = self.create_users(prefix)
+            with override_settings(**overrides):
+                results = {name: self.run_endpoint(name, users)
+                           for name in endpoints}
+        finally:
+            get_user_model().objects.filter(
+                email__startswith=prefix).delete()
+
+        report = {'meta': self.meta(), 'endpoints': results}
+        self.write(report)
+
+    def create_users(self, prefix):
+        options = self.options
+        users = []
+        for i in range(options['users']):
+            user = get_user_model().objects.create_user(
+                email='%s-%d@example.com' % (prefix, i), password=PASSWORD)
+            create_dataset(user, options['recipes'], tags=options['tags'],
+                           ingredients=options['ingredients'],
+                           tags_per_recipe=3, ingredients_per_recipe=8,
+                           seed=options['seed'] + i)
+            users.append(UserData(user, Token.objects.create(user=user).key,
+                                  prefix))
+        return users
+
+    def make_client(self, data):
+        if self.options['base_url']:
+            return HTTPClient(data, self.options['base_url'])
+        return InProcessClient(data)
+
+    def run_endpoint(self, name, users):
+        """Send the endpoint's requests from concurrent client threads"""
+        method, build = ENDPOINTS[name]
+        total = self.options['requests']
+        concurrency = min(self.options['concurrency'], total)
+        samples = []
+        failures = []
+        lock = threading.Lock()
+        next_index = iter(range(total))
+
+        def work(worker, threaded):
+            rng = random.Random('%s-%s-%d' % (self.options['seed'], name,
+                                              worker))
+            clients = {}
+            try:
+                while True:
+                    with lock:
+                        index = next(next_index, None)
+                    if index is None:
+                        return
+                    data = users[index % len(users)]
+                    if data not in clients:
+                        clients[data] = self.make_client(data)
+                    try:
+                        path, payload = build(data, rng)
+                        start = time.perf_counter()
+                        status, body, queries = clients[data].send(
+                            method, path, payload)
+                        elapsed = (time.perf_counter() - start) * 1000
+                    except Exception as exc:
+                        # e.g. SQLite refusing concurrent writers
+                        failures.append(repr(exc))
+                        continue
+                    if status >= 400:
+                        failures.append(status)
+                        continue
+                    if name == 'recipes.create':
+                        data.add_created(json.loads(body.decode())['id'])
+                    samples.append((elapsed, queries, len(body)))
+            finally:
+                if threaded:
+                    connections.close_all()
+
+        start = time.perf_counter()
+        if concurrency == 1:
+            work(0, False)
+        else:
+            threads = [threading.Thread(target=work, args=(worker, True))
+                       for worker in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        seconds = time.perf_counter() - start
+
+        result = self.summarize(samples, failures, seconds)
+        self.report(name, result)
+        if failures and not samples:
+            raise CommandError('%s failed: %s' % (name, failures[0]))
+        return result
+
+    @staticmethod
+    def summarize(samples, failures, seconds):
+        timings = [elapsed for elapsed, queries, size in samples]
+        queries = [count for elapsed, count, size in samples
+                   if count is not None]
+        result = {
+            'requests': len(samples) + len(failures),
+            'errors': len(failures),
+            'throughput_rps': round(len(samples) / seconds, 1),
+        }
+        for percent in (50, 95, 99):
+            result['p%d_ms' % percent] = round(
+                percentile(timings, percent), 2) if timings else None
+        result['mean_queries'] = round(sum(queries) / len(queries), 2) \
+            if queries else None
+        result['mean_bytes'] = round(sum(
+            size for elapsed, count, size in samples) / len(samples)) \
+            if samples else None
+        return result
+
+    def report(self, name, result):
+        if self.options['output'] == '-':
+            return
+        line = '%-26s %8.1f req/s  p50 %8.2fms  p95 %8.2fms  p99 %8.2fms' % (
+            name, result['throughput_rps'], result['p50_ms'] or 0,
+            result['p95_ms'] or 0, result['p99_ms'] or 0)
+        if result['mean_queries'] is not None:
+            line += '  %5.1f queries' % result['mean_queries']
+        if result['errors']:
+            line += '  %d errors' % result['errors']
+        self.stdout.write(line)
+
+    def meta(self):
+        options = self.options
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                check=True).stdout.decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'label': options['label'],
+            'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'database': connection.vendor,
+            'target': options['base_url'] or 'in-process',
+            'python': sys.version.split()[0],
+            'users': options['users'],
+            'recipes_per_user': options['recipes'],
+            'tags_per_user': options['tags'],
+            'ingredients_per_user': options['ingredients'],
+            'requests_per_endpoint': options['requests'],
+            'concurrency': options['concurrency'],
+            'list_cache': not options['no_cache'],
+        }
+
+    def write(self, report):
+        output = self.options['output']
+        if output == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+        if self.options['compare']:
+            self.compare(report)
+
+    def compare(self, report):
+        """Report p50/p95 changes against earlier results"""
+        with open(self.options['compare']) as f:
+            baseline = json.load(f)['endpoints']
+        regressions = []
+        limit = self.options['max_regression']
+        for name, result in report['endpoints'].items():
+            before = baseline.get(name)
+            if not before or not before['p95_ms'] or not result['p95_ms']:
+                continue
+            changes = {percent: (result[percent] / before[percent] - 1) * 100
+                       for percent in ('p50_ms', 'p95_ms')}
+            self.stderr.write('%-26s p50 %+7.1f%%  p95 %+7.1f%%' % (
+                name, changes['p50_ms'], changes['p95_ms']))
+            if limit is not None and changes['p95_ms'] > limit:
+                regressions.append(name)
+        if regressions:
+            raise CommandError('p95 regressed by more than %s%%: %s' % (
+                limit, ', '.join(regressions)))
@@ -0,0 +1,40 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import stats
+from core.utils import chunked
+
+
+class Command(BaseCommand):
+    """Django command to recompute recipe stats from the recipes
+
+    Users are processed in batches, each in its own transaction, for the
+    initial backfill or to repair counters that drifted.
+    """
+    help = 'Rebuild the per-user recipe stats and usage counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='Email of a user to rebuild, repeatable')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['user']:
+            users = users.filter(email__in=options['user'])
+            if users.count() != len(set(options['user'])):
+                raise CommandError('Unknown user in %s' %
+                                   ', '.join(options['user']))
+
+        start = time.perf_counter()
+        rebuilt = drifted = 0
+        user_ids = users.values_list('pk', flat=True).iterator()
+        for batch in chunked(user_ids, options['batch_size']):
+            drifted += stats.rebuild_stats(batch)
+            rebuilt += len(batch)
+            self.stdout.write('%d users  %.1fs' % (
+                rebuilt, time.perf_counter() - start))
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt stats of %d users, %d had drifted' % (rebuilt, drifted)))
@@ -0,0 +1,271 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from core import caching
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Sum of the snapshots of exited worker processes, see merge_exited()
+EXITED_SNAPSHOT = 'metrics-exited.json'
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Request latency by view', LATENCY_BUCKETS),
+    'http_request_queries': (
+        'histogram', 'Database queries per request by view', QUERY_BUCKETS),
+    'http_response_size_bytes': (
+        'histogram', 'Response body size by view', SIZE_BUCKETS),
+    'http_requests_total': (
+        'counter', 'Requests by view and status', None),
+    'auth_token_lookups_total': (
+        'counter', 'Token authentications by where the token was found',
+        None),
+    'api_cache_requests_total': (
+        'counter', 'List response cache lookups', None),
+}
+
+
+class Registry:
+    """Thread safe counters and histograms of the current process
+
+    With METRICS_DIR set every process writes a snapshot there at most
+    every METRICS_FLUSH_INTERVAL seconds, read back by collect().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = defaultdict(float)
+            self.histograms = {}
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self.counters[name, labels] += value
+
+    def observe(self, name, value, labels=()):
+        buckets = METRICS[name][2]
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = \
+                    [[0] * (len(buckets) + 1), 0.0]
+            # The last slot counts observations above every bucket
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def snapshot(self):
+        """Return the series of this process as JSON serializable lists"""
+        cache_stats = caching.stats.as_dict()
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value
+                        in self.counters.items()]
+            histograms = [[name, list(labels), list(counts), total]
+                          for (name, labels), (counts, total)
+                          in self.histograms.items()]
+        for result, key in (('hit', 'hits'), ('miss', 'misses')):
+            counters.append(['api_cache_requests_total',
+                             [['result', result]], cache_stats[key]])
+        return {'counters': counters, 'histograms': histograms}
+
+    def flush(self):
+        """Write the snapshot of this process to METRICS_DIR"""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        self._flushed = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        _write_snapshot(directory, 'metrics-%d.json' % os.getpid(),
+                        self.snapshot())
+
+    def maybe_flush(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        if time.monotonic() - self._flushed >= interval:
+            self.flush()
+
+
+def _write_snapshot(directory, name, snapshot):
+    """Atomically replace the snapshot file name in directory"""
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path, os.path.join(directory, name))
+
+
+def _read_snapshots(paths):
+    snapshots = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # Removed or being replaced by a process
+            continue
+    return snapshots
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def merge_exited(directory, pid):
+    """Add the snapshot of exited process pid to that of all exited ones
+
+    Called by the gunicorn master for every worker it reaps, so /metrics
+    reads one file per live worker plus one however often workers are
+    recycled.
+    """
+    path = os.path.join(directory, 'metrics-%d.json' % pid)
+    if not os.path.exists(path):
+        return
+    counters, histograms = _merge(_read_snapshots(
+        [os.path.join(directory, EXITED_SNAPSHOT), path]))
+    _write_snapshot(directory, EXITED_SNAPSHOT, {
+        'counters': [[name, [list(label) for label in labels], value]
+                     for (name, labels), value in counters.items()],
+        'histograms': [[name, [list(label) for label in labels], counts,
+                        total] for (name, labels), (counts, total)
+                       in histograms.items()],
+    })
+    os.remove(path)
+
+
+def collect():
+    """Return the snapshots of all processes, or just this one"""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return [registry.snapshot()]
+    registry.flush()
+    return _read_snapshots(
+        glob.glob(os.path.join(directory, 'metrics-*.json')))
+
+
+def _merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, counts, total in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _series(name, labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (key, _escape(value))
+                                      for key, value in labels))
+
+
+def _number(value):
+    return '%d' % value if value == int(value) else repr(value)
+
+
+def render(snapshots):
+    """Render merged snapshots in the Prometheus text exposition format"""
+    counters, histograms = _merge(snapshots)
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        if kind == 'counter':
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    lines.append('%s %s' % (_series(name, labels),
+                                            _number(value)))
+            continue
+        for (series, labels), (counts, total) in sorted(histograms.items()):
+            if series != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s %d' % (
+                    _series(name + '_bucket', labels, [('le', bound)]),
+                    cumulative))
+            lines.append('%s %s' % (_series(name + '_sum', labels),
+                                    _number(total)))
+            lines.append('%s %d' % (_series(name + '_count', labels),
+                                    cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def view_name(request):
+    """Return e.g. RecipeViewSet.list for the view serving request"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view = match.func
+    cls = getattr(view, 'cls', None) or getattr(view, 'view_class', None)
+    if cls is None:
+        return getattr(view, '__name__', 'unknown')
+    actions = getattr(view, 'actions', None)
+    if actions and request.method.lower() in actions:
+        return '%s.%s' % (cls.__name__, actions[request.method.lower()])
+    return cls.__name__
+
+
+class QueryCounter:
+    """Database execute wrapper counting statements"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Aggregate latency, queries and response size per view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        labels = (('view', view_name(request)),)
+        registry.observe('http_request_duration_seconds', duration,
+                         labels + (('method', request.method),))
+        registry.observe('http_request_queries', counter.count, labels)
+        if not response.streaming:
+            registry.observe('http_response_size_bytes',
+                             len(response.content), labels)
+        registry.inc('http_requests_total', labels + (
+            ('method', request.method),
+            ('status', str(response.status_code))))
+        registry.maybe_flush()
+        return response
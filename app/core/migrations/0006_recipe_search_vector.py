@@ -0,0 +1,57 @@
+# Generated by Django 2.1.15 on 2026-10-18 02:55
+
+import core.models
+from django.db import migrations
+
+NAMES_SQL = """
+    coalesce((SELECT {agg}(related.name, ' ')
+              FROM core_{model} related
+              JOIN core_recipe_{relation} through
+                ON through.{model}_id = related.id
+              WHERE through.recipe_id = core_recipe.id), '')
+"""
+
+
+def create_search_index(apps, schema_editor):
+    """GIN index and backfill, PostgreSQL gets a real tsvector"""
+    tags = {'model': 'tag', 'relation': 'tags'}
+    ingredients = {'model': 'ingredient', 'relation': 'ingredients'}
+    if schema_editor.connection.vendor != 'postgresql':
+        names = [NAMES_SQL.format(agg='group_concat', **related)
+                 for related in (tags, ingredients)]
+        schema_editor.execute(
+            "UPDATE core_recipe SET search_vector = "
+            "lower(title || ' ' || {} || ' ' || {})".format(*names))
+        return
+
+    names = [NAMES_SQL.format(agg='string_agg', **related)
+             for related in (tags, ingredients)]
+    schema_editor.execute(
+        "UPDATE core_recipe SET search_vector = "
+        "setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', {}), 'B') || "
+        "setweight(to_tsvector('english', {}), 'C')".format(*names))
+    schema_editor.execute(
+        'CREATE INDEX core_recipe_search_vector_idx '
+        'ON core_recipe USING gin (search_vector)')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX core_recipe_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=core.models.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
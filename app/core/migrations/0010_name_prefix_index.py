@@ -0,0 +1,37 @@
+# Generated by Django 2.1.15 on 2026-10-18 16:40
+
+from django.db import migrations
+
+MODELS = ('tag', 'ingredient')
+
+
+def create_prefix_indexes(apps, schema_editor):
+    """Expression indexes serving lower(name) LIKE 'prefix%' per user
+
+    text_pattern_ops makes LIKE usable with the index under any collation.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model in MODELS:
+        schema_editor.execute(
+            'CREATE INDEX core_{0}_user_name_prefix_idx ON core_{0} '
+            '(user_id, lower(name) text_pattern_ops)'.format(model))
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model in MODELS:
+        schema_editor.execute(
+            'DROP INDEX core_{}_user_name_prefix_idx'.format(model))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_storedfile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.1.15 on 2026-10-18 18:20
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_usage_counts(apps, schema_editor):
+    """Count the recipes using every tag and ingredient
+
+    RecipeStats rows are not created here, 0013_create_recipe_stats
+    backfills them and core.signals creates one with every new user.
+    """
+    recipe = apps.get_model('core', 'Recipe')
+    for relation in ('tags', 'ingredients'):
+        field = recipe._meta.get_field(relation)
+        target = field.m2m_reverse_field_name()
+        counts = field.remote_field.through.objects \
+            .filter(**{target: OuterRef('pk')}) \
+            .order_by().values(target) \
+            .annotate(count=Count('*')).values('count')
+        field.related_model.objects.update(usage_count=Coalesce(
+            Subquery(counts, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_name_prefix_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recipe_stats', serialize=False, to='core.User')),
+                ('recipe_count', models.PositiveIntegerField(default=0)),
+                ('price_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('time_minutes_total', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', '-usage_count'], name='ingredient_user_usage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', '-usage_count'], name='tag_user_usage_idx'),
+        ),
+        migrations.RunPython(backfill_usage_counts,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def create_recipe_stats(apps, schema_editor):
+    """Create the stats rows of users which had not read them yet"""
+    user = apps.get_model('core', 'User')
+    recipe = apps.get_model('core', 'Recipe')
+    recipe_stats = apps.get_model('core', 'RecipeStats')
+    totals = {
+        row['user_id']: row for row in recipe.objects.order_by()
+        .values('user_id').annotate(recipe_count=Count('id'),
+                                    price_total=Sum('price'),
+                                    time_minutes_total=Sum('time_minutes'))
+    }
+    user_ids = user.objects.filter(recipe_stats__isnull=True) \
+        .values_list('pk', flat=True)
+    rows = []
+    for user_id in user_ids.iterator():
+        total = totals.get(user_id, {})
+        rows.append(recipe_stats(
+            user_id=user_id,
+            recipe_count=total.get('recipe_count', 0),
+            price_total=total.get('price_total') or 0,
+            time_minutes_total=total.get('time_minutes_total') or 0))
+    recipe_stats.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_recipe_range_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_recipe_stats,
+                             migrations.RunPython.noop),
+    ]
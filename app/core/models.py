@@ -1,8 +1,23 @@
-from django.db import models
+import os
+import uuid
+from decimal import Decimal
+
+from django.contrib.postgres.search import SearchVectorField as \
+    PostgresSearchVectorField
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
     PermissionsMixin
 from django.conf import settings
 
+from core.storage import ContentAddressedStorage
+
+
+def recipe_image_file_path(instance, filename):
+    """Generate file path for new recipe image"""
+    ext = filename.split('.')[-1]
+    filename = '%s.%s' % (uuid.uuid4(), ext)
+    return os.path.join('uploads/recipe/', filename)
+
 
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -24,6 +39,15 @@ class UserManager(BaseUserManager):
         return user
 
 
+class SearchVectorField(PostgresSearchVectorField):
+    """tsvector column on PostgreSQL, plain lowercase text elsewhere"""
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return super().db_type(connection)
+        return 'text'
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     """User model to save user by email instead of username"""
 
@@ -36,12 +60,56 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     USERNAME_FIELD = 'email'
 
+    def delete(self, *args, **kwargs):
+        """Delete the user's recipes and names in bulk first
+
+        The cascade would otherwise run the delete receivers of every
+        single recipe, tag and ingredient.
+        """
+        from core.bulk import delete_objects
+        with transaction.atomic():
+            for model in (Recipe, Tag, Ingredient):
+                delete_objects(model.objects.filter(user=self))
+            return super().delete(*args, **kwargs)
+
+
+class RecipeNameQuerySet(models.QuerySet):
+    """Queries on tags or ingredients by their use in recipes"""
+
+    def _recipe_links(self):
+        """Return the through rows linking the outer object to recipes"""
+        rel = self.model._meta.get_field('recipe')
+        return rel.through.objects.filter(**{
+            rel.field.m2m_reverse_field_name(): models.OuterRef('pk'),
+        })
+
+    def assigned(self):
+        """Keep objects used by a recipe, without joining every use"""
+        return self.annotate(assigned=models.Exists(self._recipe_links())) \
+            .filter(assigned=True)
+
+    def with_recipe_counts(self):
+        """Annotate the number of recipes using each object"""
+        return self.annotate(recipe_count=models.Count('recipe'))
+
 
 class Tag(models.Model):
     """Tag for adding to each recipe"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Number of recipes using it, maintained by core.stats
+    usage_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = RecipeNameQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'name'], name='tag_user_name_idx'),
+            models.Index(fields=['user', '-usage_count'],
+                         name='tag_user_usage_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -52,11 +120,53 @@ class Ingredient(models.Model):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Number of recipes using it, maintained by core.stats
+    usage_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = RecipeNameQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'name'],
+                         name='ingredient_user_name_idx'),
+            models.Index(fields=['user', '-usage_count'],
+                         name='ingredient_user_usage_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Recipe filters on related tags and ingredients"""
+
+    def _links(self, relation, ids):
+        """Return through rows linking recipes to any of ids"""
+        field = self.model._meta.get_field(relation)
+        return field.remote_field.through.objects.filter(**{
+            field.m2m_reverse_field_name() + '_id__in': ids,
+        }).values(field.m2m_field_name() + '_id')
+
+    def related_to_any(self, relation, ids):
+        """Keep recipes linked to any of ids, each recipe only once"""
+        return self.filter(pk__in=self._links(relation, ids))
+
+    def related_to_all(self, relation, ids):
+        """Keep recipes linked to all of ids
+
+        Served by the (related, recipe) index of the through table, one
+        grouped subquery no matter how many ids are given.
+        """
+        ids = set(ids)
+        source = self.model._meta.get_field(relation).m2m_field_name()
+        matches = self._links(relation, ids) \
+            .annotate(matched=models.Count('*')) \
+            .filter(matched=len(ids)) \
+            .values(source + '_id')
+        return self.filter(pk__in=matches)
+
+
 class Recipe(models.Model):
     """Recipe object"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -68,6 +178,71 @@ class Recipe(models.Model):
 
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
+    # Title, tag and ingredient names, maintained by core.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    image = models.ImageField(null=True, blank=True, db_index=True,
+                              upload_to=recipe_image_file_path,
+                              storage=ContentAddressedStorage())
+    # Set by core.images once every thumbnail of image was written
+    thumbnails_ready = models.BooleanField(default=False, editable=False)
+    # Also bumped when tags or ingredients of the recipe change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id'], name='recipe_user_id_idx'),
+            models.Index(fields=['user', 'updated_at'],
+                         name='recipe_user_updated_idx'),
+            models.Index(fields=['user', 'time_minutes'],
+                         name='recipe_user_time_idx'),
+            models.Index(fields=['user', 'price'],
+                         name='recipe_user_price_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save in a transaction, core.stats locks the row beforehand"""
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
+
+
+class RecipeStats(models.Model):
+    """Recipe totals of a user, maintained incrementally by core.stats"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE, primary_key=True,
+                                related_name='recipe_stats')
+    recipe_count = models.PositiveIntegerField(default=0)
+    price_total = models.DecimalField(max_digits=15, decimal_places=2,
+                                      default=0)
+    time_minutes_total = models.BigIntegerField(default=0)
+
+    @property
+    def average_price(self):
+        if not self.recipe_count:
+            return None
+        return (self.price_total / self.recipe_count) \
+            .quantize(Decimal('0.01'))
+
+    @property
+    def average_time_minutes(self):
+        if not self.recipe_count:
+            return None
+        return self.time_minutes_total / self.recipe_count
+
+    def __str__(self):
+        return '%s recipes' % self.recipe_count
+
+
+class StoredFile(models.Model):
+    """Reference count of a file in ContentAddressedStorage"""
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    # Thumbnails are named after the content, shared by all references
+    thumbnails_ready = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.name
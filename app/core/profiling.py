@@ -0,0 +1,161 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_instrument_lock = threading.Lock()
+
+
+class RequestProfile:
+    """Timings of a single request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = []
+        self.serializer_time = 0.0
+        self._serializing = False
+        self.response_size = None
+
+    @property
+    def query_time(self):
+        return sum(duration for duration, alias, sql in self.queries)
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper timing every statement"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - start,
+                                 context['connection'].alias, sql))
+
+    def top_queries(self, limit):
+        """Return (total time, count, sql) of the costliest statements"""
+        grouped = defaultdict(lambda: [0.0, 0])
+        for duration, alias, sql in self.queries:
+            group = grouped[sql]
+            group[0] += duration
+            group[1] += 1
+        return sorted(((total, count, sql) for sql, (total, count)
+                       in grouped.items()), reverse=True)[:limit]
+
+    def server_timing(self):
+        """Return the value of a Server-Timing header, in milliseconds"""
+        return 'db;dur=%.1f;desc="%d queries", serializer;dur=%.1f, ' \
+            'total;dur=%.1f' % (self.query_time * 1000, len(self.queries),
+                                self.serializer_time * 1000,
+                                self.duration * 1000)
+
+
+def current_profile():
+    """Return the profile of the request served by this thread, if any"""
+    return getattr(_local, 'profile', None)
+
+
+def _timed_data(data):
+    """Wrap BaseSerializer.data to add its time to the current profile"""
+    def timed(serializer):
+        profile = current_profile()
+        if profile is None or profile._serializing:
+            return data.fget(serializer)
+        profile._serializing = True
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            profile.serializer_time += time.perf_counter() - start
+            profile._serializing = False
+    timed.profiled = True
+    return property(timed)
+
+
+def instrument_serializers():
+    """Time serializer.data of all DRF serializers, nested ones once"""
+    with _instrument_lock:
+        if not getattr(BaseSerializer.data.fget, 'profiled', False):
+            BaseSerializer.data = _timed_data(BaseSerializer.data)
+
+
+def _profile_name(request):
+    path = re.sub(r'\W+', '_', request.path).strip('_') or 'root'
+    return '%s-%s-%s-%d.prof' % (time.strftime('%Y%m%dT%H%M%S'),
+                                 request.method, path[:100], os.getpid())
+
+
+class ProfilingMiddleware:
+    """Opt-in per request timings, slow request log and cProfile samples
+
+    Records wall time, database queries and their time on every
+    connection, serializer time and response size. They are returned in
+    a Server-Timing header, requests slower than PROFILING_SLOW_MS are
+    logged with their costliest queries, and a PROFILING_SAMPLE_RATE
+    fraction of requests is run under cProfile and dumped to
+    PROFILING_DIR for pstats or snakeviz.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'PROFILING_SLOW_MS', 500)
+        self.top_queries = getattr(settings, 'PROFILING_TOP_QUERIES', 5)
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        self.profile_dir = getattr(settings, 'PROFILING_DIR', None)
+        instrument_serializers()
+
+    def __call__(self, request):
+        profile = _local.profile = request.profile = RequestProfile()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                if self.profile_dir and random.random() < self.sample_rate:
+                    response = self.run_sampled(request)
+                else:
+                    response = self.get_response(request)
+        finally:
+            _local.profile = None
+        profile.duration = time.perf_counter() - profile.start
+
+        if not response.streaming:
+            profile.response_size = len(response.content)
+        response['Server-Timing'] = profile.server_timing()
+        if profile.duration * 1000 >= self.slow_ms:
+            self.log_slow(request, response, profile)
+        return response
+
+    def run_sampled(self, request):
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.get_response, request)
+        finally:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir,
+                                             _profile_name(request)))
+
+    def log_slow(self, request, response, profile):
+        lines = ['Slow request %s %s %s: %.1fms, %d queries in %.1fms, '
+                 'serializer %.1fms, %s bytes' % (
+                     request.method, request.get_full_path(),
+                     response.status_code, profile.duration * 1000,
+                     len(profile.queries), profile.query_time * 1000,
+                     profile.serializer_time * 1000,
+                     'streamed' if profile.response_size is None
+                     else profile.response_size)]
+        for total, count, sql in profile.top_queries(self.top_queries):
+            lines.append('  %.1fms x%d  %s' % (total * 1000, count, sql))
+        logger.warning('\n'.join(lines))
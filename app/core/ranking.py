@@ -0,0 +1,304 @@
+import threading
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+
+from core import caching
+from core.authentication import LRUCache
+from core.models import Recipe
+
+# Scoped data version of the indexes, bumped on commit of every change to
+# the tags or ingredients of a user's recipes
+LINKS_SCOPE = 'recipe-links'
+
+# Features compared by similar_recipes()
+SIMILARITY_RELATIONS = ('tags', 'ingredients')
+
+# Relation tuples indexed so far, e.g. ('ingredients',)
+_indexed_relations = set()
+
+index_cache = LRUCache(
+    max_size=getattr(settings, 'RANKING_CACHE_USERS', 20),
+    ttl=getattr(settings, 'RANKING_CACHE_TTL', 3600),
+)
+
+
+def _bitset(positions):
+    """Return an int with the given bit positions set"""
+    positions = list(positions)
+    if not positions:
+        return 0
+    data = bytearray((max(positions) >> 3) + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bytes(data), 'little')
+
+
+def _iter_bits(bits):
+    """Yield the positions of the set bits, highest first"""
+    while bits:
+        position = bits.bit_length() - 1
+        yield position
+        bits ^= 1 << position
+
+
+class FeatureIndex:
+    """Inverted index of a user's recipes by their tags or ingredients
+
+    Every recipe with a feature owns a bit position. The recipes having a
+    feature, and those having n features, are bitsets (Python ints), so
+    rankings combine whole bitsets instead of looping over recipes.
+    Features are (relation, related id) pairs.
+    """
+
+    def __init__(self, relations, version=None):
+        self.relations = relations
+        self.version = version
+        self.lock = threading.Lock()
+        self.positions = {}
+        self.recipe_ids = []
+        self.sizes = []
+        self.postings = {}
+        self.by_size = defaultdict(int)
+
+    @classmethod
+    def build(cls, user_id, relations, version=None):
+        """Read the index of a user's recipes from the through tables"""
+        index = cls(relations, version)
+        postings = defaultdict(list)
+        for relation in relations:
+            field = Recipe._meta.get_field(relation)
+            source = field.m2m_field_name()
+            rows = field.remote_field.through.objects \
+                .filter(**{source + '__user_id': user_id}) \
+                .values_list(source + '_id',
+                             field.m2m_reverse_field_name() + '_id')
+            for recipe_id, related_id in rows.iterator():
+                position = index._position(recipe_id)
+                postings[relation, related_id].append(position)
+                index.sizes[position] += 1
+
+        index.postings = {feature: _bitset(positions)
+                          for feature, positions in postings.items()}
+        by_size = defaultdict(list)
+        for position, size in enumerate(index.sizes):
+            by_size[size].append(position)
+        by_size.pop(0, None)
+        index.by_size.update((size, _bitset(positions))
+                             for size, positions in by_size.items())
+        return index
+
+    def __len__(self):
+        return sum(1 for size in self.sizes if size)
+
+    def _position(self, recipe_id):
+        position = self.positions.get(recipe_id)
+        if position is None:
+            position = self.positions[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+            self.sizes.append(0)
+        return position
+
+    def _resize(self, position, delta):
+        """Move a recipe to the bitset of its new feature count"""
+        bit = 1 << position
+        size = self.sizes[position]
+        if size:
+            self.by_size[size] &= ~bit
+            if not self.by_size[size]:
+                del self.by_size[size]
+        size += delta
+        self.sizes[position] = size
+        if size:
+            self.by_size[size] |= bit
+
+    def add(self, recipe_id, relation, related_ids):
+        """Record that a recipe got related objects"""
+        if relation not in self.relations:
+            return
+        position = self._position(recipe_id)
+        bit = 1 << position
+        for related_id in related_ids:
+            posting = self.postings.get((relation, related_id), 0)
+            if not posting & bit:
+                self.postings[relation, related_id] = posting | bit
+                self._resize(position, 1)
+
+    def remove(self, recipe_id, relation, related_ids=None):
+        """Record that a recipe lost related objects, None for all"""
+        position = self.positions.get(recipe_id)
+        if relation not in self.relations or position is None:
+            return
+        bit = 1 << position
+        if related_ids is None:
+            features = [feature for feature in self.postings
+                        if feature[0] == relation]
+        else:
+            features = [(relation, related_id) for related_id in related_ids]
+        for feature in features:
+            posting = self.postings.get(feature, 0)
+            if posting & bit:
+                posting ^= bit
+                if posting:
+                    self.postings[feature] = posting
+                else:
+                    del self.postings[feature]
+                self._resize(position, -1)
+
+    def discard_recipe(self, recipe_id):
+        for relation in self.relations:
+            self.remove(recipe_id, relation)
+
+    def discard_feature(self, relation, related_id):
+        """Forget a deleted or cleared tag/ingredient"""
+        for position in _iter_bits(self.postings.get((relation,
+                                                      related_id), 0)):
+            self.remove(self.recipe_ids[position], relation, [related_id])
+
+    def features(self, recipe_id):
+        """Return the features of an indexed recipe"""
+        position = self.positions.get(recipe_id)
+        if position is None:
+            return set()
+        with self.lock:
+            return {feature for feature, posting in self.postings.items()
+                    if posting >> position & 1}
+
+    def _count(self, features):
+        """Return bit planes of the per-recipe count of features
+
+        Plane i holds bit i of the count, bitsets are added like binary
+        numbers in parallel for all recipes.
+        """
+        planes = []
+        for feature in features:
+            carry = self.postings.get(feature, 0)
+            for i, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[i], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        return planes
+
+    @staticmethod
+    def _count_equals(planes, count, candidates):
+        """Return the recipes among candidates matching count features"""
+        if count >> len(planes):
+            return 0
+        for i, plane in enumerate(planes):
+            candidates &= plane if count >> i & 1 else ~plane
+        return candidates
+
+    def rank(self, features, score, limit, exclude=()):
+        """Return up to limit (recipe id, matched, size) best first
+
+        score(matched, size) rates a recipe having size features of which
+        matched are among the given ones. Recipes matching none are left
+        out, ties go to more matches, then to newer recipes.
+        """
+        features = set(features)
+        with self.lock:
+            planes = self._count(features)
+            candidates = reduce(or_, planes, 0)
+            buckets = sorted(
+                ((matched, size) for size in self.by_size
+                 for matched in range(1, min(size, len(features)) + 1)),
+                key=lambda bucket: (-score(*bucket), -bucket[0]))
+            matching = {}
+            results = []
+            for matched, size in buckets:
+                if matched not in matching:
+                    matching[matched] = self._count_equals(
+                        planes, matched, candidates)
+                for position in _iter_bits(matching[matched] &
+                                           self.by_size[size]):
+                    recipe_id = self.recipe_ids[position]
+                    if recipe_id in exclude:
+                        continue
+                    results.append((recipe_id, matched, size))
+                    if len(results) == limit:
+                        return results
+            return results
+
+
+def coverage(matched, size):
+    """Fraction of a recipe's ingredients at hand"""
+    return matched / size
+
+
+def jaccard(shared, size, query_size):
+    """Shared features over the features of either recipe"""
+    return shared / (query_size + size - shared)
+
+
+def get_index(user_id, relations):
+    """Return the cached index of a user, rebuilt when it fell behind"""
+    _indexed_relations.add(relations)
+    version = caching.get_data_version(user_id, LINKS_SCOPE)
+    key = (relations, user_id)
+    index = index_cache.get(key)
+    if index is None or index.version != version:
+        index = FeatureIndex.build(user_id, relations, version)
+        index_cache.set(key, index)
+    return index
+
+
+def _apply(user_id, change):
+    version = caching.incr_data_version(user_id, LINKS_SCOPE)
+    for relations in list(_indexed_relations):
+        key = (relations, user_id)
+        index = index_cache.get(key)
+        if index is None:
+            continue
+        with index.lock:
+            if index.version == version - 1:
+                change(index)
+                index.version = version
+                continue
+        # Missed a change made by another process
+        index_cache.delete(key)
+
+
+def update_indexes(user_id, change):
+    """Apply change(index) to the user's indexes on commit
+
+    Changes must be idempotent, an index built after the commit already
+    holds them.
+    """
+    transaction.on_commit(lambda: _apply(user_id, change))
+
+
+def _scored(ranked, score):
+    """Return (recipe id, score) pairs of rank() results"""
+    return [(recipe_id, score(matched, size))
+            for recipe_id, matched, size in ranked]
+
+
+def recipes_to_cook(user, ingredient_ids, limit):
+    """Rank recipes of user by the fraction of ingredients at hand
+
+    Returns up to limit (recipe id, coverage) pairs, best first.
+    """
+    index = get_index(user.pk, ('ingredients',))
+    return _scored(index.rank([('ingredients', pk) for pk in ingredient_ids],
+                              coverage, limit), coverage)
+
+
+def similar_recipes(recipe, limit):
+    """Rank other recipes of the owner by Jaccard similarity to recipe
+
+    Returns up to limit (recipe id, similarity) pairs, best first. Both
+    recipes' features are read from the same index snapshot.
+    """
+    index = get_index(recipe.user_id, SIMILARITY_RELATIONS)
+    features = index.features(recipe.pk)
+
+    def score(shared, size):
+        return jaccard(shared, size, len(features))
+
+    return _scored(index.rank(features, score, limit, exclude={recipe.pk}),
+                   score)
@@ -0,0 +1,97 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, \
+    SearchVector
+from django.db import connections
+from django.db.models import Aggregate, F, OuterRef, Subquery, TextField, \
+    Value
+from django.db.models.functions import Coalesce, Concat, Lower
+from django.utils import timezone
+
+from core.utils import chunked
+from core.models import Recipe
+
+SEARCH_CONFIG = 'english'
+
+
+class GroupConcat(Aggregate):
+    """Space separated concatenation of the grouped values"""
+    function = 'GROUP_CONCAT'
+    template = "%(function)s(%(expressions)s, ' ')"
+
+    def __init__(self, expression, **extra):
+        super().__init__(expression, output_field=TextField(), **extra)
+
+    def as_postgresql(self, compiler, connection):
+        return self.as_sql(compiler, connection, function='STRING_AGG')
+
+
+def _related_names(relation):
+    """Subquery returning the names of a recipe's tags or ingredients"""
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    names = through.objects.filter(**{source: OuterRef('pk')}) \
+        .values(source) \
+        .annotate(names=GroupConcat(target + '__name')) \
+        .values('names')
+    return Coalesce(Subquery(names, output_field=TextField()), Value(''))
+
+
+def search_vector_expression(vendor):
+    """Expression computing a recipe's search_vector inside the database"""
+    tags = _related_names('tags')
+    ingredients = _related_names('ingredients')
+    if vendor == 'postgresql':
+        return (
+            SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+            SearchVector(tags, weight='B', config=SEARCH_CONFIG) +
+            SearchVector(ingredients, weight='C', config=SEARCH_CONFIG)
+        )
+    return Lower(Concat('title', Value(' '), tags, Value(' '), ingredients,
+                        output_field=TextField()))
+
+
+def update_search_vectors(recipe_ids, using='default', touch=False):
+    """Recompute search_vector of the given recipes, one UPDATE per chunk
+
+    Pass touch=True when the recipes' tags or ingredients changed to also
+    bump their updated_at in the same statement.
+    """
+    values = {
+        'search_vector': search_vector_expression(connections[using].vendor),
+    }
+    if touch:
+        values['updated_at'] = timezone.now()
+    for chunk in chunked(recipe_ids):
+        Recipe.objects.using(using).filter(pk__in=chunk).update(**values)
+
+
+def update_related_search_vectors(model, ids, using='default'):
+    """Recompute search_vector of recipes using the given tags/ingredients"""
+    field = next(field for field in Recipe._meta.many_to_many
+                 if field.related_model is model)
+    through = field.remote_field.through
+    lookup = field.m2m_reverse_field_name() + '__in'
+    recipe_ids = set()
+    for chunk in chunked(ids):
+        recipe_ids.update(
+            through.objects.using(using).filter(**{lookup: chunk})
+            .values_list(field.m2m_field_name(), flat=True))
+    update_search_vectors(recipe_ids, using=using, touch=True)
+
+
+def search_recipes(queryset, terms):
+    """Filter queryset to recipes matching terms, best matches first
+
+    PostgreSQL ranks the GIN indexed tsvector, elsewhere (tests) every
+    word has to be contained in the stored text.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        query = SearchQuery(terms, config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=query) \
+            .annotate(rank=SearchRank(F('search_vector'), query)) \
+            .order_by('-rank', '-id')
+
+    for word in terms.lower().split():
+        queryset = queryset.filter(search_vector__contains=word)
+    return queryset.order_by('-id')
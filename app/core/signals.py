@@ -0,0 +1,248 @@
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+    pre_delete, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core import bulk, images, ranking, stats
+from core.authentication import invalidate_token
+from core.autocomplete import NAME_SCOPES
+from core.caching import bump_data_version, reset_data_version
+from core.models import Tag, Ingredient, Recipe, RecipeStats
+from core.search import update_search_vectors
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Drop a deleted token from the authentication cache"""
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    """Drop cached tokens of a changed (e.g. deactivated) user"""
+    if created:
+        return
+    for key in Token.objects.filter(user=instance) \
+            .values_list('key', flat=True):
+        invalidate_token(key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reset_new_user_data_version(sender, instance, created, **kwargs):
+    """Never serve cached responses of an earlier user with the same id"""
+    if created:
+        reset_data_version(instance.pk, ranking.LINKS_SCOPE, *NAME_SCOPES)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_recipe_stats(sender, instance, created, raw, **kwargs):
+    """Start the recipe totals of a new user at zero
+
+    Created here rather than on first read, so concurrent writes always
+    find the row to update.
+    """
+    if created and not raw:
+        RecipeStats.objects.create(user=instance)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def bump_owner_data_version(sender, instance, **kwargs):
+    """Invalidate cached list responses of the owner"""
+    if bulk.deletes_deferred():
+        # Bumped once per owner by bulk.delete_objects()
+        return
+    scopes = ()
+    if sender in (Tag, Ingredient):
+        # Names changed, see core.autocomplete
+        scopes = (sender._meta.model_name,)
+    bump_data_version(instance.user_id, *scopes)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def bump_relation_data_version(sender, instance, action, **kwargs):
+    """Invalidate cached list responses when recipe relations change"""
+    if action.startswith('post_'):
+        bump_data_version(instance.user_id)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, using, update_fields,
+                                **kwargs):
+    """Index the title of a saved recipe"""
+    if update_fields is not None and 'title' not in update_fields:
+        return
+    update_search_vectors([instance.pk], using=using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_related_search_vectors(sender, instance, action, reverse,
+                                  pk_set, using, **kwargs):
+    """Index tag and ingredient names added to or removed from recipes"""
+    if action == 'pre_clear' and reverse:
+        # Clearing from the tag/ingredient side gives no pk_set
+        instance._search_recipe_ids = list(
+            instance.recipe_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        recipe_ids = instance._search_recipe_ids
+    else:
+        recipe_ids = pk_set
+    update_search_vectors(recipe_ids, using=using, touch=True)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def update_renamed_search_vectors(sender, instance, created, using,
+                                  **kwargs):
+    """Re-index recipes using a renamed tag or ingredient"""
+    if created:
+        return
+    update_search_vectors(
+        list(instance.recipe_set.values_list('pk', flat=True)),
+        using=using, touch=True)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_deleted_recipe_ids(sender, instance, **kwargs):
+    if bulk.deletes_deferred():
+        return
+    instance._search_recipe_ids = list(
+        instance.recipe_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def update_deleted_search_vectors(sender, instance, using, **kwargs):
+    """Re-index recipes which lost a deleted tag or ingredient"""
+    if bulk.deletes_deferred():
+        return
+    update_search_vectors(instance._search_recipe_ids, using=using,
+                          touch=True)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    """Release the stored image of a deleted recipe"""
+    if bulk.deletes_deferred():
+        return
+    if instance.image:
+        images.release_image(instance.image.name)
+
+
+@receiver(pre_save, sender=Recipe)
+def replace_recipe_stats(sender, instance, raw, update_fields, **kwargs):
+    """Swap the old price and time of an updated recipe in the totals"""
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and \
+            not {'price', 'time_minutes'} & set(update_fields):
+        return
+    stats.replace_recipe(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_stats(sender, instance, created, raw, **kwargs):
+    """Add a new recipe to the totals of its owner"""
+    if created and not raw:
+        stats.add_recipes([instance])
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_usage_counts(sender, instance, **kwargs):
+    """Stop counting the deleted recipe's tags and ingredients as used"""
+    if bulk.deletes_deferred():
+        return
+    for model in stats.NAME_MODELS:
+        stats.release_usage(model.objects.filter(recipe=instance))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_stats(sender, instance, **kwargs):
+    """Remove a deleted recipe from the totals of its owner"""
+    if bulk.deletes_deferred():
+        return
+    stats.add_recipes([instance], sign=-1)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_usage_counts(sender, instance, action, reverse, model, pk_set,
+                        **kwargs):
+    """Count tags and ingredients added to or removed from recipes"""
+    if reverse:
+        # Rare, recount the single tag or ingredient afterwards
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            stats.refresh_usage(
+                type(instance).objects.filter(pk=instance.pk))
+    elif action == 'post_add':
+        # pk_set only holds the newly linked objects here
+        stats.add_usage(model, dict.fromkeys(pk_set, 1))
+    elif action in ('pre_remove', 'pre_clear'):
+        # Only objects which are actually linked are decremented
+        linked = model.objects.filter(recipe=instance)
+        if action == 'pre_remove':
+            linked = linked.filter(pk__in=pk_set)
+        stats.release_usage(linked)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_ranking_indexes(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """Apply relation changes to the in-process core.ranking indexes"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    relation = 'tags' if sender is Recipe.tags.through else 'ingredients'
+    related_ids = list(pk_set or ())
+
+    def change(index):
+        if not reverse:
+            if action == 'post_add':
+                index.add(instance.pk, relation, related_ids)
+            else:
+                # post_clear removes every related object
+                index.remove(instance.pk, relation,
+                             related_ids if action == 'post_remove' else None)
+        elif action == 'post_clear':
+            index.discard_feature(relation, instance.pk)
+        else:
+            update = index.add if action == 'post_add' else index.remove
+            for recipe_id in related_ids:
+                update(recipe_id, relation, [instance.pk])
+
+    ranking.update_indexes(instance.user_id, change)
+
+
+@receiver(post_delete, sender=Recipe)
+def discard_ranked_recipe(sender, instance, **kwargs):
+    """Drop a deleted recipe from the core.ranking indexes"""
+    if bulk.deletes_deferred():
+        return
+    pk = instance.pk
+    ranking.update_indexes(instance.user_id,
+                           lambda index: index.discard_recipe(pk))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def discard_ranked_feature(sender, instance, **kwargs):
+    """Drop a deleted tag or ingredient from the core.ranking indexes"""
+    if bulk.deletes_deferred():
+        return
+    relation = 'tags' if sender is Tag else 'ingredients'
+    pk = instance.pk
+    ranking.update_indexes(instance.user_id,
+                           lambda index: index.discard_feature(relation, pk))
@@ -0,0 +1,177 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, \
+    Sum
+from django.db.models.functions import Coalesce, Greatest
+
+from core.models import Ingredient, Recipe, RecipeStats, Tag
+from core.utils import chunked
+
+NAME_MODELS = (Tag, Ingredient)
+
+
+def _decimal(value):
+    return Recipe._meta.get_field('price').to_python(value)
+
+
+def add_to_totals(user_id, recipes=0, price=0, time_minutes=0):
+    """Add to the recipe totals of a user
+
+    Every user gets a stats row when created, see core.signals.
+    """
+    RecipeStats.objects.filter(user_id=user_id).update(
+        recipe_count=F('recipe_count') + recipes,
+        price_total=F('price_total') + _decimal(price),
+        time_minutes_total=F('time_minutes_total') + time_minutes)
+
+
+def add_recipes(recipes, sign=1):
+    """Add (or with sign=-1 remove) recipes to their owners' totals"""
+    totals = defaultdict(lambda: [0, 0, 0])
+    for recipe in recipes:
+        total = totals[recipe.user_id]
+        total[0] += sign
+        total[1] += sign * _decimal(recipe.price)
+        total[2] += sign * recipe.time_minutes
+    for user_id, (count, price, time_minutes) in totals.items():
+        add_to_totals(user_id, count, price, time_minutes)
+
+
+def replace_recipe(recipe):
+    """Swap the stored price and time of a recipe about to be saved
+
+    Locks the recipe row, so it must run in the transaction that writes
+    it (see Recipe.save()). Concurrent saves then apply their deltas one
+    after the other.
+    """
+    old = Recipe.objects.select_for_update().filter(pk=recipe.pk) \
+        .values('price', 'time_minutes').first()
+    if old is None:
+        return
+    price = _decimal(recipe.price) - old['price']
+    time_minutes = recipe.time_minutes - old['time_minutes']
+    if price or time_minutes:
+        add_to_totals(recipe.user_id, 0, price, time_minutes)
+
+
+def recipe_totals(queryset):
+    """Return user id -> (count, price, time_minutes) sums of recipes"""
+    rows = queryset.order_by().values('user_id').annotate(
+        recipe_count=Count('id'), price_total=Sum('price'),
+        time_minutes_total=Sum('time_minutes'))
+    return {row['user_id']: (row['recipe_count'], row['price_total'],
+                             row['time_minutes_total']) for row in rows}
+
+
+def add_usage(model, counts):
+    """Add a mapping of pk -> delta to the usage_count of tags/ingredients
+
+    Rows sharing a delta are updated together, usually one UPDATE per
+    chunk.
+    """
+    by_delta = defaultdict(list)
+    for pk, delta in counts.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        usage_count = F('usage_count') + delta
+        if delta < 0:
+            usage_count = Greatest(usage_count, 0)
+        for chunk in chunked(pks):
+            model.objects.filter(pk__in=chunk).update(usage_count=usage_count)
+
+
+def release_usage(queryset):
+    """Decrement usage_count of a tag/ingredient queryset by one
+
+    Counts never go below zero, e.g. for rows inserted around the
+    signals; rebuild_stats() repairs them.
+    """
+    queryset.filter(usage_count__gt=0) \
+        .update(usage_count=F('usage_count') - 1)
+
+
+def count_links(ids):
+    """Return a Counter of related ids, e.g. from tag id lists"""
+    return Counter(pk for related_ids in ids for pk in related_ids)
+
+
+def usage_expression(model):
+    """Expression counting the recipes using a tag or ingredient"""
+    rel = model._meta.get_field('recipe')
+    target = rel.field.m2m_reverse_field_name()
+    counts = rel.through.objects.filter(**{target: OuterRef('pk')}) \
+        .order_by().values(target) \
+        .annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def refresh_usage(queryset):
+    """Recount usage_count of a tag/ingredient queryset
+
+    Only rows that drifted are written, returns their number.
+    """
+    counts = usage_expression(queryset.model)
+    return queryset.annotate(counted=counts) \
+        .exclude(usage_count=F('counted')) \
+        .update(usage_count=counts)
+
+
+def rebuild_stats(user_ids):
+    """Recompute the stats of users from their recipes
+
+    Returns the number of users whose totals or usage counts had drifted,
+    missing stats rows count as drifted. Existing rows are locked before
+    the recipes are summed and updated in place, so concurrent updates
+    of the totals wait and apply on top of the recomputed values.
+    """
+    with transaction.atomic():
+        existing = {
+            stats.user_id: (stats.recipe_count, stats.price_total,
+                            stats.time_minutes_total)
+            for stats in RecipeStats.objects.select_for_update()
+            .filter(user_id__in=user_ids)
+        }
+        totals = recipe_totals(Recipe.objects.filter(user_id__in=user_ids))
+        missing = []
+        drifted = set()
+        for user_id in user_ids:
+            count, price, time_minutes = totals.get(user_id, (0, 0, 0))
+            values = (count, _decimal(price or 0), time_minutes or 0)
+            if existing.get(user_id) == values:
+                continue
+            drifted.add(user_id)
+            fields = dict(zip(('recipe_count', 'price_total',
+                               'time_minutes_total'), values))
+            if user_id in existing:
+                RecipeStats.objects.filter(user_id=user_id).update(**fields)
+            else:
+                missing.append(RecipeStats(user_id=user_id, **fields))
+        RecipeStats.objects.bulk_create(missing)
+
+        for model in NAME_MODELS:
+            queryset = model.objects.filter(user_id__in=user_ids)
+            counts = usage_expression(model)
+            drifted.update(
+                queryset.annotate(counted=counts)
+                .exclude(usage_count=F('counted'))
+                .values_list('user_id', flat=True).distinct())
+            refresh_usage(queryset)
+    return len(drifted)
+
+
+def get_recipe_stats(user):
+    """Return the RecipeStats of user
+
+    Rows are created with their user. Users inserted without signals get
+    an empty row here, rebuild_stats() fills it in.
+    """
+    return RecipeStats.objects.get_or_create(user=user)[0]
+
+
+def top_used(model, user, limit):
+    """Return the most used tags/ingredients of user"""
+    return model.objects.filter(user=user) \
+        .annotate(recipe_count=F('usage_count')) \
+        .order_by('-usage_count', 'name')[:limit]
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+HASH_ALGORITHM = 'sha256'
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads to a temporary file, hashing them on the way
+
+    The digest is kept as `content_hash` on the uploaded file, so the
+    storage below can move the file into place without reading it again.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hash = hashlib.new(HASH_ALGORITHM)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.content_hash = self.hash.hexdigest()
+        return uploaded
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming files by the hash of their content
+
+    Saving content which is already stored only adds a reference, the
+    file is removed once delete() released the last one. References are
+    counted in core.models.StoredFile rows. Both paths write to the row
+    first, so it stays locked while the file is checked or removed.
+    """
+
+    def _stored_files(self):
+        # Looked up lazily, core.models uses this storage
+        return apps.get_model('core', 'StoredFile').objects
+
+    def hashed_name(self, name, digest):
+        directory, basename = os.path.split(name)
+        ext = os.path.splitext(basename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + ext)
+
+    def _save(self, name, content):
+        digest = getattr(content, 'content_hash', None)
+        if digest is not None and hasattr(content, 'temporary_file_path'):
+            source, owned = content.temporary_file_path(), False
+        else:
+            source, digest = self._spool(content)
+            owned = True
+
+        name = self.hashed_name(name, digest)
+        full_path = self.path(name)
+        try:
+            with transaction.atomic():
+                # The row stays locked until commit, see delete()
+                self._acquire(name)
+                if not os.path.exists(full_path):
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    file_move_safe(source, full_path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(full_path, self.file_permissions_mode)
+        finally:
+            if owned and os.path.exists(source):
+                os.remove(source)
+        return name
+
+    def _acquire(self, name):
+        """Add a reference to name, writing first to take the row lock"""
+        stored_files = self._stored_files()
+        while not stored_files.filter(name=name) \
+                .update(refcount=F('refcount') + 1):
+            try:
+                with transaction.atomic():
+                    stored_files.create(name=name, refcount=1)
+                return
+            except IntegrityError:
+                # Created concurrently, increment that row instead
+                continue
+
+    def _spool(self, content):
+        """Copy content in chunks to a temporary file, returning its hash"""
+        digest = hashlib.new(HASH_ALGORITHM)
+        os.makedirs(self.location, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.location, suffix='.upload')
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                digest.update(chunk)
+                f.write(chunk)
+        return path, digest.hexdigest()
+
+    def delete(self, name, on_remove=None):
+        """Release a reference to name, returns True if it was the last
+
+        The file is removed once the transaction commits, so a rollback
+        keeps it along with the reference row. on_remove() is then called
+        to remove files derived from it. Files without a reference row
+        (stored before this storage was used) are removed as well.
+        """
+        stored_files = self._stored_files()
+        with transaction.atomic():
+            while True:
+                if stored_files.filter(name=name, refcount__gt=1) \
+                        .update(refcount=F('refcount') - 1):
+                    return False
+                if stored_files.filter(name=name, refcount__lte=1) \
+                        .delete()[0]:
+                    break
+                if not stored_files.filter(name=name).exists():
+                    break
+            transaction.on_commit(lambda: self._remove(name, on_remove))
+        return True
+
+    def _remove(self, name, on_remove=None):
+        """Remove a released file unless it was stored again meanwhile"""
+        stored_files = self._stored_files()
+        try:
+            with transaction.atomic():
+                # A placeholder row makes concurrent saves of the same
+                # content wait until the file is gone, see _acquire()
+                stored_files.create(name=name, refcount=0)
+                super().delete(name)
+                if on_remove is not None:
+                    on_remove()
+                stored_files.filter(name=name, refcount=0).delete()
+        except IntegrityError:
+            # Stored again after the release, the file is in use
+            pass
@@ -0,0 +1,144 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import LRUCache, token_cache
+
+ME_URL = reverse('user:me')
+
+
+class LRUCacheTest(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest untouched entry is evicted first"""
+        lru = LRUCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+
+    def test_entries_expire(self):
+        """Test that entries are dropped after their ttl"""
+        lru = LRUCache(max_size=2, ttl=10)
+        with patch('time.monotonic', return_value=100):
+            lru.set('a', 1)
+        with patch('time.monotonic', return_value=111):
+            self.assertIsNone(lru.get('a'))
+
+
+class CachedTokenAuthenticationTest(TestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com',
+            password='test1234',
+            name='Salman')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_token_lookup_is_cached(self):
+        """Test that only the first request resolves the token in the db"""
+        # Token lookup and loading the profile
+        with self.assertNumQueries(2):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_cached_entry_has_no_credentials(self):
+        """Test that only the user id and active flag are cached"""
+        self.client.get(ME_URL)
+
+        self.assertEqual(token_cache.get(self.token.key),
+                         (self.user.pk, True))
+
+    def test_update_does_not_restore_stale_fields(self):
+        """Test that saving the profile reloads the user first"""
+        self.client.get(ME_URL)
+        # Changed by another process, the local cache is not invalidated
+        get_user_model().objects.filter(pk=self.user.pk) \
+            .update(is_active=False, is_staff=True)
+
+        self.client.patch(ME_URL, {'name': 'Barani'})
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'Barani')
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(self.user.is_staff)
+
+    def test_invalid_token_rejected(self):
+        """Test that unknown tokens are still rejected"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_invalidated(self):
+        """Test that deleting a token evicts it from the cache"""
+        self.client.get(ME_URL)
+        self.token.delete()
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_invalidated(self):
+        """Test that deactivating a user evicts their tokens"""
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_update_invalidated(self):
+        """Test that updating the profile is visible on the next request"""
+        self.client.get(ME_URL)
+        self.client.patch(ME_URL, {'name': 'Barani'})
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['name'], 'Barani')
+
+    @override_settings(AUTH_TOKEN_CACHE_ALIAS='default')
+    def test_shared_cache_used(self):
+        """Test that other processes can resolve tokens from the cache"""
+        self.client.get(ME_URL)
+        # Simulate another worker with an empty local cache
+        token_cache.clear()
+
+        with self.assertNumQueries(1):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(cache.get('auth-token:%s' % self.token.key),
+                         (self.user.pk, True))
+
+    @override_settings(AUTH_TOKEN_CACHE_ALIAS='default')
+    def test_shared_cache_invalidated(self):
+        """Test that deleting a token also evicts the shared entry"""
+        self.client.get(ME_URL)
+        self.token.delete()
+        token_cache.clear()
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,9 +1,20 @@
-from unittest.mock import patch
+import csv
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import Mock, patch
 
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.models import Ingredient, Recipe, RecipeStats, Tag
+
 
 class CommandTest(TestCase):
     def test_wait_for_db_read(self):
@@ -20,3 +31,402 @@ class CommandTest(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+    def test_benchmark_pagination(self):
+        """Test that the pagination benchmark reports and cleans up"""
+        out = StringIO()
+        call_command('benchmark', 'pagination', sizes=[5], requests=2,
+                     page_size=2, stdout=out)
+
+        self.assertIn('5 recipes, first page', out.getvalue())
+        self.assertIn('5 recipes, middle page', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_benchmark_bulk(self):
+        """Test that the bulk benchmark reports both write paths"""
+        out = StringIO()
+        call_command('benchmark', 'bulk', items=3, stdout=out)
+
+        self.assertIn('single item POST', out.getvalue())
+        self.assertIn('bulk POST', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_benchmark_conditional(self):
+        """Test that the conditional GET benchmark reports savings"""
+        out = StringIO()
+        call_command('benchmark', 'conditional', sizes=[5], requests=2,
+                     stdout=out)
+
+        self.assertIn('5 recipes, not modified', out.getvalue())
+        self.assertIn('5 recipes, saved', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_benchmark_filters(self):
+        """Test that the filters benchmark compares both match-all plans"""
+        out = StringIO()
+        call_command('benchmark', 'filters', sizes=[5], requests=2,
+                     filter_ids=2, stdout=out)
+
+        self.assertIn('5 recipes, all of 2 tags', out.getvalue())
+        self.assertIn('5 recipes, 2 chained joins', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_benchmark_cookable(self):
+        """Test that the cookable benchmark reports cold and warm timings"""
+        out = StringIO()
+        call_command('benchmark', 'cookable', sizes=[30], requests=2,
+                     stdout=out)
+
+        self.assertIn('30 recipes, ranked from index', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_benchmark_similar(self):
+        """Test that the similar benchmark reports cold and warm timings"""
+        out = StringIO()
+        call_command('benchmark', 'similar', sizes=[30], requests=2,
+                     stdout=out)
+
+        self.assertIn('30 recipes, similar from index', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_benchmark_connections(self):
+        """Test that the connections benchmark reports every mode"""
+        out = StringIO()
+        call_command('benchmark', 'connections', requests=2, stdout=out)
+
+        self.assertIn('new connection per request', out.getvalue())
+        self.assertIn('persistent, health checked', out.getvalue())
+
+    def test_benchmark_autocomplete(self):
+        """Test that the autocomplete benchmark reports every path"""
+        out = StringIO()
+        call_command('benchmark', 'autocomplete', sizes=[5], requests=2,
+                     stdout=out)
+
+        self.assertIn('5 names, sorted in memory', out.getvalue())
+        self.assertIn('5 names, database', out.getvalue())
+        self.assertFalse(Ingredient.objects.exists())
+
+    @patch('core.images.submit', side_effect=lambda fn, *args: fn(*args))
+    def test_benchmark_images(self, submit):
+        """Test that the image benchmark reports disk usage"""
+        out = StringIO()
+        call_command('benchmark', 'images', uploads=3, unique=2,
+                     image_size=32, stdout=out)
+
+        self.assertIn('3 uploads, 2 distinct', out.getvalue())
+        self.assertIn('stored incl. thumbnails', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_explain_queries_rolls_back(self):
+        """Test that explaining queries leaves no data or schema change"""
+        out = StringIO()
+        call_command('explain_queries', recipes=20, tags=5, ingredients=5,
+                     per_recipe=2, noise_users=1, stdout=out)
+
+        self.assertIn('With indexes', out.getvalue())
+        self.assertIn('Without indexes', out.getvalue())
+        self.assertIn('recipes by tags', out.getvalue())
+        self.assertIn('assigned tags, EXISTS', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+        index_names = [index.name for index in Recipe._meta.indexes]
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Recipe._meta.db_table)
+        for name in index_names:
+            self.assertIn(name, constraints)
+
+
+class RebuildRecipeStatsTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(user=self.user, title='Curry',
+                                       time_minutes=20, price=5.00)
+        recipe.tags.add(self.tag)
+
+    def test_rebuild_repairs_drift(self):
+        """Test that drifted counters are recomputed from the recipes"""
+        RecipeStats.objects.filter(user=self.user).update(recipe_count=7)
+        Tag.objects.update(usage_count=3)
+        out = StringIO()
+
+        call_command('rebuild_recipe_stats', batch_size=1, stdout=out)
+
+        self.assertIn('Rebuilt stats of 1 users, 1 had drifted',
+                      out.getvalue())
+        stats = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.price_total, Decimal('5.00'))
+        self.assertEqual(stats.time_minutes_total, 20)
+        self.assertEqual(Tag.objects.get().usage_count, 1)
+
+    def test_rebuild_single_user(self):
+        """Test rebuilding only the listed users"""
+        other = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        RecipeStats.objects.update(recipe_count=7)
+        out = StringIO()
+
+        call_command('rebuild_recipe_stats', user=[self.user.email],
+                     stdout=out)
+
+        self.assertEqual(RecipeStats.objects.get(user=self.user).recipe_count,
+                         1)
+        self.assertEqual(RecipeStats.objects.get(user=other).recipe_count, 7)
+
+    def test_rebuild_creates_missing_rows(self):
+        """Test that users inserted without signals get their row"""
+        RecipeStats.objects.all().delete()
+
+        call_command('rebuild_recipe_stats', stdout=StringIO())
+
+        self.assertEqual(RecipeStats.objects.get(user=self.user).recipe_count,
+                         1)
+
+    def test_rebuild_unknown_user(self):
+        """Test that unknown users are rejected"""
+        with self.assertRaises(CommandError):
+            call_command('rebuild_recipe_stats', user=['nobody@gmail.com'])
+
+
+class CopyCursor:
+    """Cursor standing in for psycopg2's, recording COPY payloads"""
+
+    def __init__(self):
+        self.copies = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params):
+        # Ids drawn from the recipe sequence
+        self.rows = [(1000 + n,) for n in range(params[1])]
+
+    def fetchall(self):
+        return self.rows
+
+    def copy_expert(self, sql, file):
+        self.copies.append((sql, file.read()))
+
+
+class ImportRecipesTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+
+    def import_recipes(self, path='-', **options):
+        out = StringIO()
+        call_command('import_recipes', path, user=self.user.email,
+                     stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_ndjson_from_stdin(self):
+        """Test importing NDJSON records reusing existing tag names"""
+        lines = [
+            {'title': 'Curry', 'time_minutes': 30, 'price': '5.50',
+             'tags': ['Vegan', 'Asian'], 'ingredients': ['Rice']},
+            {'title': 'Salad', 'time_minutes': 5, 'price': 3,
+             'tags': ['Vegan']},
+        ]
+        stdin = StringIO('\n'.join(json.dumps(line) for line in lines))
+
+        out = self.import_recipes(stdin=stdin, batch_size=1)
+
+        self.assertIn('Imported 2 recipes', out)
+        self.assertIn('rows/s', out)
+        curry = Recipe.objects.get(title='Curry')
+        self.assertEqual(sorted(tag.name for tag in curry.tags.all()),
+                         ['Asian', 'Vegan'])
+        self.assertEqual(Tag.objects.filter(name='Vegan').count(), 1)
+        self.assertEqual(
+            list(Recipe.objects.get(title='Salad').tags.all()), [self.vegan])
+        self.assertIn('rice', curry.search_vector)
+
+    def test_import_csv_file(self):
+        """Test importing a CSV file in the export format"""
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.write('id,title,time_minutes,price,link,tags,ingredients\n'
+                    '7,Toast,3,1.20,,Vegan;Quick,Bread;Butter\n')
+
+        self.import_recipes(path)
+
+        toast = Recipe.objects.get(user=self.user)
+        self.assertEqual(toast.title, 'Toast')
+        self.assertEqual(toast.ingredients.count(), 2)
+        self.assertEqual(toast.tags.count(), 2)
+
+    def test_invalid_record(self):
+        """Test that invalid records abort with their line number"""
+        stdin = StringIO('{"title": "Curry", "price": "1"}\n')
+
+        with self.assertRaisesMessage(CommandError, 'Line 1'):
+            self.import_recipes(stdin=stdin)
+
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_copy_payload(self):
+        """Test that empty text is not loaded as NULL by COPY"""
+        cursor = CopyCursor()
+        postgres = Mock(vendor='postgresql', ops=connection.ops,
+                        cursor=lambda: cursor)
+        stdin = StringIO('{"title": "Toast", "time_minutes": 3, '
+                         '"price": "1.20", "tags": ["Vegan"]}\n')
+
+        with patch('core.management.commands.import_recipes.connection',
+                   postgres), patch('core.bulk.connection', postgres):
+            self.import_recipes(stdin=stdin, copy=True)
+
+        (recipe_sql, payload), (_, links) = cursor.copies[:2]
+        # COPY reads unquoted empty fields as NULL except in FORCE_NOT_NULL
+        columns = recipe_sql.split('(', 1)[1].split(')', 1)[0] \
+            .replace('"', '').split(', ')
+        not_null = recipe_sql.split('FORCE_NOT_NULL (', 1)[1] \
+            .split(')', 1)[0].replace('"', '').split(', ')
+        row = next(csv.reader(StringIO(payload)))
+        self.assertEqual(row[columns.index('link')], '')
+        self.assertIn('link', not_null)
+        self.assertIn('title', not_null)
+        self.assertNotIn('image', not_null)
+        self.assertEqual(links, '1000,%d\r\n' % self.vegan.pk)
+
+    def test_copy_requires_postgres(self):
+        """Test that COPY mode is refused on other databases"""
+        if connection.vendor == 'postgresql':
+            self.skipTest('COPY is supported')
+        with self.assertRaises(CommandError):
+            self.import_recipes(stdin=StringIO(''), copy=True)
+
+
+class LoadTestCommandTest(TestCase):
+
+    def run_loadtest(self, **options):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'results.json')
+            call_command('loadtest', users=2, recipes=5, tags=3,
+                         ingredients=10, requests=2, concurrency=1,
+                         output=path, stdout=out, stderr=StringIO(),
+                         **options)
+            with open(path) as f:
+                return json.load(f), out.getvalue()
+
+    def test_loadtest_reports_every_endpoint(self):
+        """Test that all endpoints are driven and the data is removed"""
+        report, out = self.run_loadtest(label='baseline')
+
+        self.assertEqual(report['meta']['label'], 'baseline')
+        self.assertEqual(report['meta']['concurrency'], 1)
+        for name in ('user.create', 'tags.autocomplete', 'recipes.create',
+                     'recipes.similar', 'recipes.export', 'recipes.delete'):
+            result = report['endpoints'][name]
+            self.assertEqual(result['requests'], 2)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['p95_ms'], 0)
+            self.assertIsNotNone(result['mean_queries'])
+            self.assertIn(name, out)
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_loadtest_compare_fails_on_regression(self):
+        """Test that results slower than the baseline can fail the run"""
+        baseline = {'endpoints': {'tags.list': {'p50_ms': 1e-6,
+                                                'p95_ms': 1e-6}}}
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(baseline, f)
+            f.flush()
+
+            self.run_loadtest(endpoints=['tags.list'], compare=f.name)
+            with self.assertRaises(CommandError):
+                self.run_loadtest(endpoints=['tags.list'], compare=f.name,
+                                  max_regression=50)
+
+    def test_loadtest_delete_needs_create(self):
+        """Test that deleting recipes requires creating them first"""
+        with self.assertRaises(CommandError):
+            call_command('loadtest', endpoints=['recipes.delete'])
+
+
+class GenerateDataTest(TestCase):
+
+    def generate(self, prefix, **options):
+        options.setdefault('recipes', 'uniform:2:6')
+        call_command('generate_data', users=3, tags=4, ingredients=6,
+                     tags_per_recipe='uniform:0:3',
+                     ingredients_per_recipe='normal:3:1', prefix=prefix,
+                     batch_size=4, stdout=StringIO(), **options)
+
+    def dataset(self, prefix):
+        """Return the generated rows without ids or emails"""
+        return [
+            [(recipe.title, recipe.time_minutes, recipe.price,
+              sorted(tag.name for tag in recipe.tags.all()),
+              sorted(ingredient.name for ingredient
+                     in recipe.ingredients.all()))
+             for recipe in Recipe.objects.filter(user=user).order_by('id')]
+            for user in get_user_model().objects.filter(
+                email__startswith=prefix).order_by('id')
+        ]
+
+    def test_generate_data_is_deterministic(self):
+        """Test that the same seed generates the same rows"""
+        self.generate('first', seed=1)
+        self.generate('second', seed=1)
+        self.generate('third', seed=2)
+
+        first = self.dataset('first')
+        self.assertEqual(len(first), 3)
+        for recipes in first:
+            self.assertTrue(2 <= len(recipes) <= 6)
+            for title, time_minutes, price, tags, ingredients in recipes:
+                self.assertTrue(len(tags) <= 3)
+        self.assertEqual(first, self.dataset('second'))
+        self.assertNotEqual(first, self.dataset('third'))
+
+    def test_generate_data_maintains_stats(self):
+        """Test that recipe stats and usage counts match the rows"""
+        self.generate('gen', recipes='5')
+
+        for user in get_user_model().objects.all():
+            self.assertEqual(RecipeStats.objects.get(user=user).recipe_count,
+                             5)
+            for tag in Tag.objects.filter(user=user):
+                self.assertEqual(tag.usage_count, tag.recipe_set.count())
+
+    def test_generate_data_copy(self):
+        """Test that COPY mode loads every generated recipe"""
+        cursor = CopyCursor()
+        postgres = Mock(vendor='postgresql', ops=connection.ops,
+                        cursor=lambda: cursor)
+
+        with patch('core.management.commands.generate_data.connection',
+                   postgres), patch('core.bulk.connection', postgres):
+            self.generate('gen', recipes='5', copy=True)
+
+        recipe_copies = [(sql, payload) for sql, payload in cursor.copies
+                         if 'FORCE_NOT_NULL' in sql]
+        # One batch of at most 4 and one of the rest per user
+        self.assertEqual(len(recipe_copies), 6)
+        rows = [row for sql, payload in recipe_copies
+                for row in csv.reader(StringIO(payload))]
+        self.assertEqual(len(rows), 15)
+        self.assertTrue(all(len(row) == len(rows[0]) for row in rows))
+
+    def test_generate_data_rejects_bad_input(self):
+        """Test that invalid distributions and reused prefixes fail"""
+        for spec in ('zipf:2', 'uniform:1', 'normal:-1:2', 'uniform:5:3'):
+            with self.assertRaises(CommandError):
+                self.generate('gen', recipes=spec)
+        self.generate('gen')
+        with self.assertRaises(CommandError):
+            self.generate('gen')
@@ -0,0 +1,198 @@
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core import db, images
+from core.caching import api_cache
+from core.models import Recipe
+
+REPLICAS = ['replica1', 'replica2']
+
+
+def sample_connection(connected=True, usable=True, in_atomic_block=False):
+    """Create and return a mock database connection"""
+    return Mock(connection=Mock() if connected else None,
+                in_atomic_block=in_atomic_block,
+                is_usable=Mock(return_value=usable))
+
+
+class HealthCheckTest(TestCase):
+
+    def test_broken_connection_closed(self):
+        """Test that a connection the server dropped is closed"""
+        broken = sample_connection(usable=False)
+        healthy = sample_connection()
+
+        with patch('core.db.connections') as connections:
+            connections.all.return_value = [broken, healthy]
+            db.close_broken_connections()
+
+        broken.close.assert_called_once_with()
+        healthy.close.assert_not_called()
+
+    def test_closed_connection_not_checked(self):
+        """Test that no query is sent for connections not yet open"""
+        connection = sample_connection(connected=False)
+
+        db.check_connection(connection)
+
+        connection.is_usable.assert_not_called()
+        connection.close.assert_not_called()
+
+    def test_connection_in_transaction_kept(self):
+        """Test that a connection inside a transaction is left alone"""
+        connection = sample_connection(usable=False, in_atomic_block=True)
+
+        db.check_connection(connection)
+
+        connection.close.assert_not_called()
+
+
+@override_settings(DB_REPLICAS=REPLICAS, DB_PIN_SECONDS=5)
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        db.selector.reset()
+        db.end_request()
+        self.router = db.ReplicaRouter()
+        # Every test runs inside a transaction, which reads the primary
+        patcher = patch.object(connection, 'in_atomic_block', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db.end_request)
+
+    def test_round_robin(self):
+        """Test that reads outside requests rotate over the replicas"""
+        aliases = [self.router.db_for_read(Recipe) for _ in range(4)]
+
+        self.assertEqual(aliases, ['replica2', 'replica1'] * 2)
+
+    def test_least_latency(self):
+        """Test that the replica answering fastest gets the reads"""
+        db.selector.record('replica1', 0.05)
+        db.selector.record('replica2', 0.01)
+
+        with override_settings(DB_REPLICA_SELECTION='least-latency'):
+            aliases = [self.router.db_for_read(Recipe)
+                       for _ in range(db.LATENCY_PROBE_INTERVAL)]
+
+        # Apart from the probe keeping the latency of replica1 current
+        self.assertEqual(aliases.count('replica2'),
+                         db.LATENCY_PROBE_INTERVAL - 1)
+
+    def test_reads_after_write_use_primary(self):
+        """Test that a thread reads the primary after it wrote"""
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_transaction_reads_primary(self):
+        """Test that reads inside a transaction see its writes"""
+        connection.in_atomic_block = True
+
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_tokens_read_from_primary(self):
+        """Test that tokens are never read from a lagging replica"""
+        self.assertEqual(self.router.db_for_read(Token), 'default')
+
+    def test_primary_only(self):
+        """Test that reads inside primary_only() use the primary"""
+        with db.primary_only():
+            self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+        self.assertIn(self.router.db_for_read(Recipe), REPLICAS)
+
+    def test_thumbnail_job_reads_primary(self):
+        """Test that the job does not miss a just stored image on a replica"""
+        # Unknown aliases would raise if the job read from a replica
+        images.generate_thumbnails('uploads/recipe/missing.jpg')
+
+    def test_no_migrations_on_replicas(self):
+        """Test that replicas are left to replication"""
+        self.assertFalse(self.router.allow_migrate('replica1', 'core'))
+        self.assertIsNone(self.router.allow_migrate('default', 'core'))
+
+
+# The local memory API cache of the tests is only allowed in DEBUG
+@override_settings(DB_REPLICAS=REPLICAS, DB_PIN_SECONDS=5,
+                   DB_PIN_COOKIE='db_pin', DEBUG=True)
+class PrimaryPinMiddlewareTest(TestCase):
+
+    def setUp(self):
+        db.selector.reset()
+        api_cache().clear()
+        self.router = db.ReplicaRouter()
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        patcher = patch.object(connection, 'in_atomic_block', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db.end_request)
+
+    def call(self, request, write=False):
+        """Run request through the middleware, return response and reads"""
+        reads = []
+
+        def view(request):
+            # Authenticates like DRF views do
+            request.user = self.user
+            reads.append(self.router.db_for_read(Recipe))
+            if write:
+                self.router.db_for_write(Recipe)
+            reads.append(self.router.db_for_read(Recipe))
+            return HttpResponse()
+
+        response = db.PrimaryPinMiddleware(view)(request)
+        return response, reads
+
+    def test_request_sticks_to_replica(self):
+        """Test that the reads of a request use a single replica"""
+        response, reads = self.call(self.factory.get('/'))
+
+        self.assertIn(reads[0], REPLICAS)
+        self.assertEqual(reads[0], reads[1])
+        self.assertNotIn('db_pin', response.cookies)
+
+    def test_write_pins_client_and_user(self):
+        """Test that a write pins its client and user to the primary"""
+        response, reads = self.call(self.factory.get('/'), write=True)
+
+        self.assertIn(reads[0], REPLICAS)
+        self.assertEqual(reads[1], 'default')
+        self.assertEqual(response.cookies['db_pin']['max-age'], 5)
+
+        request = self.factory.get('/')
+        request.COOKIES['db_pin'] = response.cookies['db_pin'].value
+        self.assertEqual(self.call(request)[1], ['default', 'default'])
+        # Another client of the same user, e.g. a second device
+        self.assertEqual(self.call(self.factory.get('/'))[1],
+                         ['default', 'default'])
+
+    def test_unsafe_methods_read_primary(self):
+        """Test that reads validating a write see earlier writes"""
+        response, reads = self.call(self.factory.post('/'))
+
+        self.assertEqual(reads, ['default', 'default'])
+
+    @override_settings(DEBUG=False)
+    def test_shared_cache_required(self):
+        """Test that markers are not kept in a per process cache"""
+        with self.assertRaises(ImproperlyConfigured):
+            db.PrimaryPinMiddleware(HttpResponse)
+
+    def test_expired_pin_ignored(self):
+        """Test that a pin cookie from the past is not honoured"""
+        request = self.factory.get('/')
+        request.COOKIES['db_pin'] = '1'
+
+        response, reads = self.call(request)
+
+        self.assertIn(reads[0], REPLICAS)
@@ -0,0 +1,140 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import metrics
+from core.authentication import token_cache
+
+METRICS_URL = reverse('metrics')
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        token_cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.token = Token.objects.create(user=self.user)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def get_metrics(self):
+        res = APIClient().get(METRICS_URL,
+                              HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        return res.content.decode()
+
+    def test_token_required(self):
+        """Test that metrics are only served with the configured token"""
+        self.user.is_staff = True
+        self.user.save()
+        for token, header in ((None, 'Bearer '), ('secret', ''),
+                              ('secret', 'Bearer wrong'),
+                              ('secret', 'Token ' + self.token.key)):
+            with self.settings(METRICS_TOKEN=token):
+                res = self.client.get(METRICS_URL,
+                                      HTTP_AUTHORIZATION=header)
+
+            self.assertEqual(res.status_code, 401)
+            self.assertEqual(res['WWW-Authenticate'], 'Bearer')
+
+    def test_request_metrics_per_view(self):
+        """Test that latency, queries and sizes are recorded per action"""
+        self.client.force_authenticate(self.user)
+        self.client.get(RECIPES_URL)
+        self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        body = self.get_metrics()
+
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{view="RecipeViewSet.list",method="GET"} 1', body)
+        self.assertIn('http_request_queries_bucket'
+                      '{view="TagViewSet.create",le="1"} 1', body)
+        self.assertIn('http_response_size_bytes_count'
+                      '{view="TagViewSet.create"} 1', body)
+        self.assertIn('http_requests_total{view="TagViewSet.create",'
+                      'method="POST",status="201"} 1', body)
+
+    def test_auth_outcomes(self):
+        """Test that token lookups are counted by where they were found"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.client.get(TAGS_URL)
+        self.client.get(TAGS_URL)
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        self.client.get(TAGS_URL)
+
+        body = self.get_metrics()
+
+        self.assertIn('auth_token_lookups_total{outcome="database"} 1', body)
+        self.assertIn('auth_token_lookups_total{outcome="local_cache"} 1',
+                      body)
+        self.assertIn('auth_token_lookups_total{outcome="failed"} 1', body)
+
+    def test_render_histogram(self):
+        """Test that histogram buckets are cumulative"""
+        registry = metrics.Registry()
+        for value in (0, 3, 500):
+            registry.observe('http_request_queries', value,
+                             (('view', 'v'),))
+
+        body = metrics.render([registry.snapshot()])
+
+        self.assertIn('http_request_queries_bucket{view="v",le="0"} 1', body)
+        self.assertIn('http_request_queries_bucket{view="v",le="5"} 2', body)
+        self.assertIn('http_request_queries_bucket{view="v",le="200"} 2',
+                      body)
+        self.assertIn('http_request_queries_bucket{view="v",le="+Inf"} 3',
+                      body)
+        self.assertIn('http_request_queries_sum{view="v"} 503', body)
+        self.assertIn('http_request_queries_count{view="v"} 3', body)
+
+    def test_multiprocess_snapshots_summed(self):
+        """Test that snapshots of other worker processes are added up"""
+        other = metrics.Registry()
+        other.inc('http_requests_total', (('view', 'v'), ('status', '200')),
+                  2)
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            with open(os.path.join(metrics_dir, 'metrics-1.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+            metrics.registry.inc('http_requests_total',
+                                 (('view', 'v'), ('status', '200')))
+
+            with override_settings(METRICS_DIR=metrics_dir):
+                body = self.get_metrics()
+
+            self.assertIn('metrics-%d.json' % os.getpid(),
+                          os.listdir(metrics_dir))
+
+        self.assertIn('http_requests_total{view="v",status="200"} 3', body)
+
+    def test_exited_workers_merged(self):
+        """Test that snapshots of exited workers are folded into one"""
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            for pid in (101, 102):
+                worker = metrics.Registry()
+                worker.inc('http_requests_total', (('view', 'v'),), pid)
+                worker.observe('http_request_queries', 3, (('view', 'v'),))
+                with open(os.path.join(metrics_dir,
+                                       'metrics-%d.json' % pid), 'w') as f:
+                    json.dump(worker.snapshot(), f)
+                metrics.merge_exited(metrics_dir, pid)
+
+            self.assertEqual(os.listdir(metrics_dir),
+                             [metrics.EXITED_SNAPSHOT])
+            with override_settings(METRICS_DIR=metrics_dir):
+                body = self.get_metrics()
+
+        self.assertIn('http_requests_total{view="v"} 203', body)
+        self.assertIn('http_request_queries_count{view="v"} 2', body)
@@ -1,5 +1,10 @@
+from unittest.mock import patch
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from core import caching
 from core.models import Tag, Ingredient, Recipe
 
 
@@ -68,3 +73,39 @@ class TestModel(TestCase):
             price=23.00
         )
         self.assertEqual(str(recipe), recipe.title)
+
+    def test_delete_user_cost_independent_of_recipes(self):
+        """Test that deleting a user handles its recipes in bulk"""
+        counts = []
+        for count in (1, 20):
+            user = sample_user(email='user%d@gmail.com' % count)
+            tag = Tag.objects.create(user=user, name='Vegan')
+            for i in range(count):
+                Recipe.objects.create(user=user, title='recipe', price=1,
+                                      time_minutes=5).tags.add(tag)
+            with CaptureQueriesContext(connection) as queries:
+                user.delete()
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertFalse(Recipe.objects.exists())
+
+    @patch('django.db.transaction.on_commit', side_effect=lambda fn: fn())
+    def test_delete_user_cache_cost_independent_of_rows(self, on_commit):
+        """Test that deleting a user bumps versions once per kind of row"""
+        counts = []
+        for count in (1, 20):
+            user = sample_user(email='user%d@gmail.com' % count)
+            for i in range(count):
+                recipe = Recipe.objects.create(user=user, title='recipe',
+                                               price=1, time_minutes=5)
+                recipe.tags.add(Tag.objects.create(user=user,
+                                                   name='tag%d' % i))
+                recipe.ingredients.add(Ingredient.objects.create(
+                    user=user, name='ingredient%d' % i))
+            with patch('core.caching._incr_versions',
+                       wraps=caching._incr_versions) as incr:
+                user.delete()
+            counts.append(incr.call_count)
+
+        self.assertEqual(counts[0], counts[1])
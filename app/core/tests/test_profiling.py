@@ -0,0 +1,76 @@
+import os
+import pstats
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import profiling
+from core.models import Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SLOW_MS=60000,
+                   PROFILING_SAMPLE_RATE=0)
+class ProfilingMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def test_server_timing_header(self):
+        """Test that query and serializer timings are returned"""
+        res = self.client.get(TAGS_URL)
+
+        timing = res['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="2 queries"', timing)
+        self.assertIn('serializer;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    @override_settings(PROFILING_SLOW_MS=0)
+    def test_slow_request_logged_with_queries(self):
+        """Test that slow requests are logged with their top queries"""
+        with self.assertLogs('core.profiling', 'WARNING') as logs:
+            self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        message = logs.output[0]
+        self.assertIn('Slow request GET %s?assigned_only=1 200' % TAGS_URL,
+                      message)
+        self.assertIn('3 queries', message)
+        self.assertIn('core_tag', message)
+
+    def test_fast_request_not_logged(self):
+        """Test that requests under the threshold are not logged"""
+        with patch.object(profiling.logger, 'warning') as warning:
+            self.client.get(TAGS_URL)
+
+        warning.assert_not_called()
+
+    def test_sampled_request_dumps_profile(self):
+        """Test that sampled requests are written as cProfile stats"""
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with self.settings(PROFILING_SAMPLE_RATE=1,
+                               PROFILING_DIR=profile_dir):
+                self.client.get(TAGS_URL)
+
+            names = os.listdir(profile_dir)
+            self.assertEqual(len(names), 1)
+            self.assertIn('GET-api_recipe_tags', names[0])
+            stats = pstats.Stats(os.path.join(profile_dir, names[0]))
+            self.assertTrue(stats.total_calls)
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_by_default(self):
+        """Test that nothing is recorded unless enabled"""
+        res = self.client.get(TAGS_URL)
+
+        self.assertNotIn('Server-Timing', res)
@@ -0,0 +1,133 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from core import bulk, ranking
+from core.models import Ingredient, Recipe
+
+RELATIONS = ('ingredients',)
+
+
+def run_on_commit(fn):
+    fn()
+
+
+class FeatureIndexTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('rice', 'salt', 'egg', 'milk')
+        ]
+        rice, salt, egg, milk = self.ingredients
+        self.fried_rice = self.recipe('fried rice', rice, salt, egg)
+        self.omelette = self.recipe('omelette', egg, salt)
+        self.pudding = self.recipe('pudding', rice, milk)
+
+    def recipe(self, title, *ingredients):
+        recipe = Recipe.objects.create(user=self.user, title=title,
+                                       time_minutes=10, price=5.00)
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def features(self, *ingredients):
+        return [('ingredients', ingredient.pk) for ingredient in ingredients]
+
+    def snapshot(self, index):
+        """Return the index content independent of bit positions"""
+        return {recipe_id: index.features(recipe_id)
+                for recipe_id in index.recipe_ids
+                if index.features(recipe_id)}
+
+    def test_rank_by_coverage(self):
+        """Test that recipes are ordered by the fraction covered"""
+        rice, salt, egg, milk = self.ingredients
+        index = ranking.FeatureIndex.build(self.user.pk, RELATIONS)
+
+        ranked = index.rank(self.features(egg, salt), ranking.coverage, 10)
+
+        self.assertEqual(ranked, [
+            (self.omelette.pk, 2, 2),
+            (self.fried_rice.pk, 2, 3),
+        ])
+        self.assertEqual(
+            index.rank(self.features(rice), ranking.coverage, 1),
+            [(self.pudding.pk, 1, 2)])
+        self.assertEqual(index.rank([], ranking.coverage, 10), [])
+
+    def test_similar_recipes(self):
+        """Test that recipes are ordered by Jaccard similarity"""
+        rice, salt, egg, milk = self.ingredients
+        rice_pudding = self.recipe('rice pudding', rice, milk, egg)
+
+        ranked = ranking.similar_recipes(self.pudding, 10)
+
+        # {rice, milk} vs {rice, milk, egg}, {rice, salt, egg}
+        self.assertEqual(ranked, [
+            (rice_pudding.pk, 2 / 3),
+            (self.fried_rice.pk, 1 / 4),
+        ])
+        self.assertEqual(ranking.jaccard(2, 3, 2), 2 / 3)
+        self.assertEqual(ranking.jaccard(1, 3, 2), 1 / 4)
+
+    def test_incremental_updates_match_rebuild(self):
+        """Test that add/remove/discard leave the index of a rebuild"""
+        rice, salt, egg, milk = self.ingredients
+        index = ranking.FeatureIndex.build(self.user.pk, RELATIONS)
+
+        self.omelette.ingredients.add(milk)
+        index.add(self.omelette.pk, 'ingredients', [milk.pk, egg.pk])
+        self.fried_rice.ingredients.remove(salt)
+        index.remove(self.fried_rice.pk, 'ingredients', [salt.pk])
+        new = self.recipe('rice milk', rice, milk)
+        index.add(new.pk, 'ingredients', [rice.pk, milk.pk])
+        index.discard_recipe(self.pudding.pk)
+        self.pudding.delete()
+        index.discard_feature('ingredients', egg.pk)
+        egg.delete()
+        index.add(new.pk, 'tags', [1])
+
+        rebuilt = ranking.FeatureIndex.build(self.user.pk, RELATIONS)
+        self.assertEqual(self.snapshot(index), self.snapshot(rebuilt))
+        self.assertEqual(
+            index.rank(self.features(milk), ranking.coverage, 10),
+            rebuilt.rank(self.features(milk), ranking.coverage, 10))
+
+    @patch('core.ranking.transaction.on_commit', side_effect=run_on_commit)
+    def test_signals_update_cached_index(self, on_commit):
+        """Test that relation changes are applied to the cached index"""
+        rice, salt, egg, milk = self.ingredients
+        index = ranking.get_index(self.user.pk, RELATIONS)
+
+        self.omelette.ingredients.add(milk)
+        milk.recipe_set.remove(self.pudding)
+        self.fried_rice.ingredients.clear()
+
+        self.assertIs(ranking.get_index(self.user.pk, RELATIONS), index)
+        self.assertEqual(self.snapshot(index), self.snapshot(
+            ranking.FeatureIndex.build(self.user.pk, RELATIONS)))
+
+    @patch('core.ranking.transaction.on_commit', side_effect=run_on_commit)
+    def test_bulk_delete_updates_cached_index(self, on_commit):
+        """Test that bulk deletes are applied to the cached index"""
+        rice, salt, egg, milk = self.ingredients
+        index = ranking.get_index(self.user.pk, RELATIONS)
+
+        bulk.delete_objects(Recipe.objects.filter(pk=self.pudding.pk))
+        bulk.delete_objects(Ingredient.objects.filter(pk=salt.pk))
+
+        self.assertIs(ranking.get_index(self.user.pk, RELATIONS), index)
+        self.assertEqual(self.snapshot(index), self.snapshot(
+            ranking.FeatureIndex.build(self.user.pk, RELATIONS)))
+
+    def test_missed_change_rebuilds_index(self):
+        """Test that an index behind the shared version is rebuilt"""
+        index = ranking.get_index(self.user.pk, RELATIONS)
+
+        # Changes of other processes only bump the shared version
+        ranking.caching.incr_data_version(self.user.pk, ranking.LINKS_SCOPE)
+
+        self.assertIsNot(ranking.get_index(self.user.pk, RELATIONS), index)
@@ -0,0 +1,21 @@
+# Keeps IN lists and CASE expressions below SQLite's variable limit
+CHUNK_SIZE = 500
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    """Yield lists of at most `size` items from iterable"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def percentile(samples, percent):
+    """Return the nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = max(0, int(round(percent / 100 * len(ordered))) - 1)
+    return ordered[index]
@@ -0,0 +1,29 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from core import metrics
+
+
+def _has_metrics_token(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        return False
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return hmac.compare_digest(header.encode(),
+                               ('Bearer %s' % token).encode())
+
+
+def metrics_view(request):
+    """Expose the metrics of all worker processes to Prometheus
+
+    Requires the METRICS_TOKEN bearer token, served to nobody while unset.
+    """
+    if not _has_metrics_token(request):
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(metrics.render(metrics.collect()),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
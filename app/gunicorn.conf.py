@@ -0,0 +1,55 @@
+"""Gunicorn settings of the production server
+
+Run with `gunicorn -c gunicorn.conf.py app.wsgi`. Every setting can be
+changed through the environment variables read below.
+"""
+import glob
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# sync workers serve one request at a time, gthread workers serve up to
+# GUNICORN_THREADS each, which suits requests waiting on the database
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS',
+                             multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import Django once in the master, workers share its memory after fork
+preload_app = bool(int(os.environ.get('GUNICORN_PRELOAD', 1)))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound slow memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+# Set GUNICORN_ACCESSLOG= (empty) to turn the access log off
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+errorlog = '-'
+
+
+def on_starting(server):
+    """Drop the metrics snapshots of workers of an earlier run"""
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+            os.remove(path)
+
+
+def post_fork(server, worker):
+    """Never share a database connection opened in the master"""
+    if preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def child_exit(server, worker):
+    """Fold the metrics snapshot of an exited worker into a single file"""
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+        from core.metrics import merge_exited
+        merge_exited(metrics_dir, worker.pid)
@@ -0,0 +1,188 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from core import bulk, caching
+
+
+class BulkModelMixin:
+    """Create, update or delete many of the user's objects per request
+
+    POST takes a list of objects, PATCH a list of partial objects with
+    their `id` and DELETE a list of ids.
+    """
+    bulk_serializer_class = None
+
+    def get_serializer_class(self):
+        """Use the bulk serializer for the bulk action"""
+        if self.action == 'bulk':
+            return self.bulk_serializer_class
+        return super().get_serializer_class()
+
+    def get_bulk_queryset(self):
+        return self.queryset.filter(user=self.request.user)
+
+    def bump_data_version(self):
+        """Invalidate the user's cached data of this viewset's model"""
+        caching.bump_data_version(self.request.user.pk,
+                                  self.queryset.model._meta.model_name)
+
+    @action(methods=['post', 'patch', 'delete'], detail=False)
+    def bulk(self, request):
+        """Dispatch to bulk create, update or delete"""
+        items = request.data
+        max_items = getattr(settings, 'BULK_MAX_ITEMS', 5000)
+        if not isinstance(items, list):
+            raise serializers.ValidationError(
+                _('Expected a list of items.'))
+        if len(items) > max_items:
+            raise serializers.ValidationError(
+                _('At most %d items are allowed per request.') % max_items)
+
+        if request.method == 'DELETE':
+            return self.bulk_destroy(items)
+
+        partial = request.method == 'PATCH'
+        serializer = self.get_serializer(data=items, many=True,
+                                         partial=partial)
+        serializer.is_valid(raise_exception=True)
+        if partial:
+            updated = serializer.update_all(self.get_bulk_queryset())
+            # Bulk writes bypass the model signals
+            self.bump_data_version()
+            return Response({'updated': updated})
+
+        serializer.save(user=request.user)
+        self.bump_data_version()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def bulk_destroy(self, items):
+        """Delete the user's objects whose ids are listed"""
+        ids = serializers.ListField(
+            child=serializers.IntegerField()).run_validation(items)
+        queryset = self.get_bulk_queryset()
+        found = bulk.owned_ids(queryset, ids)
+        errors = [
+            {} if pk in found else
+            {'id': [_('Invalid pk "%s" - object does not exist.') % pk]}
+            for pk in ids
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        deleted = bulk.delete_objects(queryset, found)
+        self.bump_data_version()
+        return Response({'deleted': deleted})
+
+
+class CachedListMixin:
+    """Serve list responses from the API cache until the user's data changes
+
+    Keys contain the per-user data version from core.caching, which the
+    model signals bump on every write, so entries never need deleting.
+    """
+
+    def list(self, request, *args, **kwargs):
+        cache = caching.api_cache()
+        key = caching.list_cache_key(self.basename, request)
+        data = cache.get(key)
+        if data is not None:
+            caching.stats.hit()
+            return Response(data)
+
+        caching.stats.miss()
+        response = super().list(request, *args, **kwargs)
+        results = response.data
+        if isinstance(results, dict):
+            results = results.get('results', ())
+        max_items = getattr(settings, 'API_CACHE_MAX_ITEMS', 1000)
+        if response.status_code == status.HTTP_200_OK and \
+                len(results) <= max_items:
+            cache.set(key, response.data,
+                      getattr(settings, 'API_CACHE_TTL', 300))
+        return response
+
+
+class ConditionalGetMixin:
+    """Answer GETs of unchanged data with 304 Not Modified
+
+    ETags hash the row count and latest updated_at of the user's objects
+    with the request, so they are derived without serializing anything.
+    They are memoized in the API cache under the user's data version.
+    Lists get no Last-Modified header since deletes would not change it.
+    """
+
+    def get_etag_querysets(self):
+        """Return the querysets whose state a list response depends on"""
+        return (self.get_bulk_queryset(),)
+
+    def get_list_state(self):
+        state = []
+        for queryset in self.get_etag_querysets():
+            aggregates = queryset.aggregate(count=Count('pk'),
+                                            updated=Max('updated_at'))
+            state.append((aggregates['count'], aggregates['updated']))
+        return state, None
+
+    def get_detail_state(self):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            updated = self.get_bulk_queryset() \
+                .filter(**{self.lookup_field: lookup}) \
+                .values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            return None
+        if updated is None:
+            return None
+        return (lookup, updated), int(updated.timestamp())
+
+    def get_validators(self, request, get_state):
+        """Return the (etag, last_modified) pair of the request or Nones"""
+        cache = caching.api_cache()
+        key = caching.list_cache_key('etag-%s' % self.basename, request)
+        validators = cache.get(key)
+        if validators is None:
+            state = get_state()
+            if state is None:
+                return None, None
+            state, last_modified = state
+            raw = '%s|%s|%s|%r' % (request.get_host(),
+                                   request.get_full_path(),
+                                   request.accepted_renderer.format, state)
+            validators = ('"%s"' % hashlib.md5(raw.encode()).hexdigest(),
+                          last_modified)
+            cache.set(key, validators,
+                      getattr(settings, 'API_CACHE_TTL', 300))
+        return validators
+
+    def conditional(self, request, get_state, handler, *args, **kwargs):
+        """Return 304 when the validators match, else call handler"""
+        etag, last_modified = self.get_validators(request, get_state)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.get_list_state,
+                                super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, self.get_detail_state,
+                                super().retrieve, *args, **kwargs)
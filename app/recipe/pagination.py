@@ -0,0 +1,49 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """Keyset pagination used only when the client asks for it
+
+    Requests without `cursor` or `page_size` keep getting the plain list
+    so existing clients are not broken.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        """Return None (no pagination) unless a page was requested"""
+        params = request.query_params
+        if self.cursor_query_param not in params and \
+                self.page_size_query_param not in params:
+            return None
+        return super().get_page_size(request)
+
+
+class RecipeCursorPagination(OptionalCursorPagination):
+    """Paginate recipes on their primary key, newest first"""
+    ordering = '-id'
+
+
+class RecipeSearchPagination(LimitOffsetPagination):
+    """Paginate search results by offset, keeping their relevance order
+
+    Cursor pagination re-applies its own ordering. Like the cursor
+    pagination, used only when `page_size` or `offset` is given.
+    """
+    default_limit = OptionalCursorPagination.page_size
+    limit_query_param = 'page_size'
+    max_limit = OptionalCursorPagination.max_page_size
+
+    def get_limit(self, request):
+        """Return None (no pagination) unless a page was requested"""
+        params = request.query_params
+        if self.offset_query_param not in params and \
+                self.limit_query_param not in params:
+            return None
+        return super().get_limit(request)
+
+
+class NameCursorPagination(OptionalCursorPagination):
+    """Paginate tags and ingredients on name, newest id breaking ties"""
+    ordering = ('-name', '-id')
@@ -1,5 +1,91 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
-from core.models import Tag, Ingredient, Recipe
+
+from core import bulk, images
+from core.models import Tag, Ingredient, Recipe, RecipeStats
+from core.search import update_related_search_vectors
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """List serializer validating and saving its items in bulk
+
+    Ownership of the item ids (when updating) and of related ids is
+    checked with one query per model rather than one per item. Errors are
+    reported per item, in the same shape DRF uses for field errors.
+    """
+
+    def to_internal_value(self, data):
+        # Errors raised from validate() would lose their per item shape
+        attrs = super().to_internal_value(data)
+        user = self.context['request'].user
+        errors = [{} for item in attrs]
+        if self.partial:
+            model = self.child.Meta.model
+            self._check_owned(attrs, errors, 'id',
+                              model.objects.filter(user=user))
+        for name, model in getattr(self.child.Meta,
+                                   'related_models', {}).items():
+            self._check_owned(attrs, errors, name,
+                              model.objects.filter(user=user))
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    def _check_owned(self, attrs, errors, name, queryset):
+        """Record an error for every item referencing a foreign id"""
+        source = self.child.fields[name].source
+
+        def item_ids(item):
+            value = item.get(source)
+            if value is None:
+                return []
+            return value if isinstance(value, list) else [value]
+
+        found = bulk.owned_ids(
+            queryset, [pk for item in attrs for pk in item_ids(item)])
+        for item, error in zip(attrs, errors):
+            if name == 'id' and source not in item:
+                error[name] = [_('This field is required.')]
+                continue
+            missing = [pk for pk in item_ids(item) if pk not in found]
+            if missing:
+                error[name] = [
+                    _('Invalid pk "%s" - object does not exist.') % pk
+                    for pk in missing
+                ]
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        for attrs in validated_data:
+            attrs.pop('id', None)
+        with transaction.atomic():
+            return bulk.insert_objects(
+                model, [model(**attrs) for attrs in validated_data])
+
+    def update_all(self, queryset):
+        """Apply the validated partial items to queryset"""
+        fields = [name for name in self.child.Meta.fields if name != 'id']
+        with transaction.atomic():
+            updated = bulk.update_objects(queryset, self.validated_data,
+                                          fields)
+            # Names are part of the recipes' search documents
+            update_related_search_vectors(
+                queryset.model, [item['id'] for item in self.validated_data])
+        return updated
+
+
+class RecipeBulkListSerializer(BulkListSerializer):
+    """Bulk list serializer also writing recipe tags and ingredients"""
+
+    def create(self, validated_data):
+        for attrs in validated_data:
+            attrs.pop('id', None)
+        return bulk.create_recipes(validated_data)
+
+    def update_all(self, queryset):
+        return bulk.update_recipes(queryset, self.validated_data)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -11,6 +97,14 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class TagCountSerializer(TagSerializer):
+    """Tag with the number of recipes using it"""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ('recipe_count',)
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     """Serializer class for Ingredient object"""
 
@@ -20,6 +114,26 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class IngredientCountSerializer(IngredientSerializer):
+    """Ingredient with the number of recipes using it"""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ('recipe_count',)
+
+
+class RecipeStatsSerializer(serializers.ModelSerializer):
+    """Serializer for the recipe totals of a user"""
+    average_price = serializers.DecimalField(max_digits=15,
+                                             decimal_places=2,
+                                             read_only=True)
+    average_time_minutes = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = RecipeStats
+        fields = ('recipe_count', 'average_price', 'average_time_minutes')
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer class for Recipe object"""
     ingredients = serializers.PrimaryKeyRelatedField(
@@ -38,7 +152,108 @@ class RecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class TagBulkSerializer(TagSerializer):
+    """Tag serializer for the bulk endpoint, accepting ids for updates"""
+    id = serializers.IntegerField(required=False)
+
+    class Meta(TagSerializer.Meta):
+        read_only_fields = ()
+        list_serializer_class = BulkListSerializer
+
+
+class IngredientBulkSerializer(IngredientSerializer):
+    """Ingredient serializer for the bulk endpoint"""
+    id = serializers.IntegerField(required=False)
+
+    class Meta(IngredientSerializer.Meta):
+        read_only_fields = ()
+        list_serializer_class = BulkListSerializer
+
+
+class RecipeBulkSerializer(serializers.ModelSerializer):
+    """Recipe serializer for the bulk endpoint
+
+    Related ids are plain integer lists validated by the list serializer
+    in one query, instead of a PrimaryKeyRelatedField lookup per id.
+    """
+    id = serializers.IntegerField(required=False)
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(),
+        source='ingredient_ids',
+        required=False,
+    )
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+        source='tag_ids',
+        required=False,
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'title', 'ingredients', 'tags',
+                  'time_minutes', 'price', 'link')
+        list_serializer_class = RecipeBulkListSerializer
+        related_models = {'tags': Tag, 'ingredients': Ingredient}
+
+
+class ThumbnailsField(serializers.ReadOnlyField):
+    """Absolute thumbnail URLs by size and extension once generated"""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image or not recipe.thumbnails_ready:
+            return None
+        request = self.context.get('request')
+        thumbnails = {}
+        for label, image_format, name in images.thumbnail_names(
+                recipe.image.name):
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            thumbnails.setdefault(label, {})[
+                images.THUMBNAIL_EXTENSIONS[image_format]] = url
+        return thumbnails
+
+
+class RecipeCoverageSerializer(RecipeSerializer):
+    """Recipe ranked by the ingredients at hand"""
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = serializers.ListField(
+        child=serializers.IntegerField(), read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage',
+                                                 'missing_ingredients')
+
+
+class RecipeSimilaritySerializer(RecipeSerializer):
+    """Recipe ranked by the tags and ingredients shared with another"""
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('similarity',)
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     """Recipe serializer when fetching detail"""
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
+    thumbnails = ThumbnailsField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('image', 'thumbnails')
+        read_only_fields = ('id', 'image')
+
+
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Serializer for uploading images to recipes"""
+    thumbnails = ThumbnailsField()
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'image', 'thumbnails')
+        read_only_fields = ('id',)
+        extra_kwargs = {'image': {'required': True, 'allow_null': False}}
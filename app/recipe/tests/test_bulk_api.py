@@ -0,0 +1,290 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import caching, ranking
+from core.models import Recipe, Tag, Ingredient
+
+RECIPES_BULK_URL = reverse('recipe:recipe-bulk')
+TAGS_BULK_URL = reverse('recipe:tag-bulk')
+INGREDIENTS_BULK_URL = reverse('recipe:ingredient-bulk')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    default = {
+        'title': 'sample recipe',
+        'time_minutes': 12,
+        'price': 12.00
+    }
+    default.update(params)
+    return Recipe.objects.create(user=user, **default)
+
+
+class PublicBulkAPITest(TestCase):
+    """Test unauthenticated bulk API access"""
+
+    def test_login_required(self):
+        """Test that authentication is required"""
+        res = APIClient().post(RECIPES_BULK_URL, [], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBulkAPITest(TestCase):
+    """Test authenticated bulk API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com',
+            password='test1234')
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='Salt')
+
+    def recipe_payload(self, count):
+        return [{
+            'title': 'recipe %d' % i,
+            'time_minutes': i + 1,
+            'price': '%d.50' % i,
+            'tags': [self.tag.id],
+            'ingredients': [self.ingredient.id],
+        } for i in range(count)]
+
+    def test_bulk_create_recipes(self):
+        """Test creating many recipes with tags and ingredients"""
+        res = self.client.post(RECIPES_BULK_URL, self.recipe_payload(3),
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 3)
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual([r.title for r in recipes],
+                         ['recipe 0', 'recipe 1', 'recipe 2'])
+        self.assertEqual([r['id'] for r in res.data],
+                         [r.id for r in recipes])
+        for recipe in recipes:
+            self.assertEqual(list(recipe.tags.all()), [self.tag])
+            self.assertEqual(list(recipe.ingredients.all()),
+                             [self.ingredient])
+
+    def test_bulk_created_recipes_searchable(self):
+        """Test that bulk created recipes are added to the search index"""
+        self.client.post(RECIPES_BULK_URL, self.recipe_payload(2),
+                         format='json')
+
+        res = self.client.get(reverse('recipe:recipe-list'),
+                              {'search': 'vegan salt'})
+
+        self.assertEqual(len(res.data), 2)
+
+    def test_bulk_create_query_count(self):
+        """Test that bulk create cost does not depend on item count"""
+        for count in (1, 20):
+            with self.assertNumQueries(12):
+                res = self.client.post(RECIPES_BULK_URL,
+                                       self.recipe_payload(count),
+                                       format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_create_reports_item_errors(self):
+        """Test that invalid items are reported and nothing is created"""
+        other_user = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        foreign_tag = Tag.objects.create(user=other_user, name='Meat')
+        payload = self.recipe_payload(3)
+        payload[1]['tags'] = [foreign_tag.id]
+        del payload[2]['title']
+
+        res = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('title', res.data[2])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_create_foreign_related_ids(self):
+        """Test that tags of other users can not be attached"""
+        other_user = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        foreign_tag = Tag.objects.create(user=other_user, name='Meat')
+        payload = self.recipe_payload(2)
+        payload[1]['tags'] = [foreign_tag.id]
+
+        res = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('tags', res.data[1])
+
+    @override_settings(BULK_MAX_ITEMS=2)
+    def test_bulk_item_limit(self):
+        """Test that too large batches are rejected"""
+        res = self.client.post(RECIPES_BULK_URL, self.recipe_payload(3),
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_requires_list(self):
+        """Test that a single object is rejected"""
+        res = self.client.post(RECIPES_BULK_URL, self.recipe_payload(1)[0],
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_recipes(self):
+        """Test partially updating many recipes"""
+        recipe1 = sample_recipe(self.user)
+        recipe2 = sample_recipe(self.user)
+        recipe2.tags.add(self.tag)
+        new_tag = Tag.objects.create(user=self.user, name='Dessert')
+        payload = [
+            {'id': recipe1.id, 'title': 'Soup', 'price': '3.25'},
+            {'id': recipe2.id, 'tags': [new_tag.id]},
+        ]
+
+        res = self.client.patch(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'updated': 2})
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe1.title, 'Soup')
+        self.assertEqual(recipe1.price, Decimal('3.25'))
+        self.assertEqual(recipe2.title, 'sample recipe')
+        self.assertEqual(list(recipe2.tags.all()), [new_tag])
+
+    def test_bulk_update_requires_owned_ids(self):
+        """Test that recipes of other users can not be updated"""
+        other_user = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        recipe = sample_recipe(other_user)
+
+        res = self.client.patch(RECIPES_BULK_URL,
+                                [{'id': recipe.id, 'title': 'Hacked'},
+                                 {'title': 'No id'}],
+                                format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('id', res.data[0])
+        self.assertIn('id', res.data[1])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'sample recipe')
+
+    def test_bulk_delete_recipes(self):
+        """Test deleting many recipes by id"""
+        recipe1 = sample_recipe(self.user)
+        recipe2 = sample_recipe(self.user)
+        recipe3 = sample_recipe(self.user)
+
+        res = self.client.delete(RECIPES_BULK_URL,
+                                 [recipe1.id, recipe2.id], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'deleted': 2})
+        self.assertEqual(list(Recipe.objects.all()), [recipe3])
+
+    def test_bulk_delete_query_count(self):
+        """Test that bulk delete cost does not depend on item count"""
+        counts = []
+        for count in (1, 20):
+            res = self.client.post(RECIPES_BULK_URL,
+                                   self.recipe_payload(count), format='json')
+            ids = [recipe['id'] for recipe in res.data]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.delete(RECIPES_BULK_URL, ids,
+                                         format='json')
+            self.assertEqual(res.data, {'deleted': count})
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Tag.objects.get().usage_count, 0)
+
+    @patch('django.db.transaction.on_commit', side_effect=lambda fn: fn())
+    def test_bulk_delete_updates_ranking_once(self, on_commit):
+        """Test that ranking indexes are updated once per bulk delete"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        counts = []
+        for count in (1, 20):
+            recipes = [sample_recipe(self.user) for _ in range(count)]
+            for recipe in recipes:
+                recipe.tags.add(tag)
+            ranking.get_index(self.user.pk, ranking.SIMILARITY_RELATIONS)
+            with patch('core.caching.incr_data_version',
+                       wraps=caching.incr_data_version) as incr:
+                self.client.delete(RECIPES_BULK_URL,
+                                   [recipe.id for recipe in recipes],
+                                   format='json')
+            counts.append(incr.call_count)
+            self.assertEqual(len(ranking.get_index(
+                self.user.pk, ranking.SIMILARITY_RELATIONS)), 0)
+
+        self.assertEqual(counts, [1, 1])
+
+    @patch('core.bulk.chunked', lambda items: ([item] for item in items))
+    def test_bulk_delete_is_atomic(self):
+        """Test that a failing chunk rolls back the whole delete"""
+        recipes = [sample_recipe(self.user) for _ in range(2)]
+
+        with patch('core.bulk._release_recipes',
+                   side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                self.client.delete(RECIPES_BULK_URL,
+                                   [recipe.id for recipe in recipes],
+                                   format='json')
+
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_bulk_delete_foreign_ids(self):
+        """Test that recipes of other users can not be deleted"""
+        other_user = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        recipe = sample_recipe(other_user)
+
+        res = self.client.delete(RECIPES_BULK_URL, [recipe.id],
+                                 format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_bulk_tags(self):
+        """Test creating, renaming and deleting tags in bulk"""
+        res = self.client.post(TAGS_BULK_URL,
+                               [{'name': 'one'}, {'name': 'two'}],
+                               format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        ids = [tag['id'] for tag in res.data]
+        self.assertEqual(
+            sorted(Tag.objects.filter(id__in=ids)
+                   .values_list('name', flat=True)), ['one', 'two'])
+
+        res = self.client.patch(TAGS_BULK_URL,
+                                [{'id': ids[0], 'name': 'uno'}],
+                                format='json')
+        self.assertEqual(res.data, {'updated': 1})
+        self.assertEqual(Tag.objects.get(id=ids[0]).name, 'uno')
+
+        res = self.client.delete(TAGS_BULK_URL, ids, format='json')
+        self.assertEqual(res.data, {'deleted': 2})
+        self.assertFalse(Tag.objects.filter(id__in=ids).exists())
+
+    def test_bulk_ingredients(self):
+        """Test creating ingredients in bulk"""
+        res = self.client.post(INGREDIENTS_BULK_URL,
+                               [{'name': 'Pepper'}, {'name': ''}],
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('name', res.data[1])
+        self.assertFalse(Ingredient.objects.filter(name='Pepper').exists())
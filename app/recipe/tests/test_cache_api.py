@@ -0,0 +1,123 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import caching
+from core.models import Recipe, Tag
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+CACHE_STATS_URL = reverse('recipe:cache-stats')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    default = {
+        'title': 'sample recipe',
+        'time_minutes': 12,
+        'price': 12.00
+    }
+    default.update(params)
+    return Recipe.objects.create(user=user, **default)
+
+
+class ListCacheTest(TestCase):
+    """Test caching of list responses"""
+
+    def setUp(self):
+        caching.stats.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com',
+            password='test1234')
+        self.client.force_authenticate(self.user)
+
+    def test_list_served_from_cache(self):
+        """Test that repeating a list request hits no database"""
+        sample_recipe(self.user)
+        res = self.client.get(RECIPES_URL)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(RECIPES_URL)
+
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(caching.stats.as_dict(),
+                         {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_query_params_are_part_of_key(self):
+        """Test that different parameters are cached separately"""
+        sample_recipe(self.user)
+        self.client.get(RECIPES_URL)
+
+        res = self.client.get(RECIPES_URL, {'page_size': 1})
+
+        self.assertIn('results', res.data)
+
+    def test_write_invalidates_list(self):
+        """Test that creating, changing and deleting refresh the list"""
+        recipe = sample_recipe(self.user)
+        self.client.get(RECIPES_URL)
+
+        recipe.title = 'Soup'
+        recipe.save()
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.data[0]['title'], 'Soup')
+
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(len(res.data[0]['tags']), 1)
+
+        recipe.delete()
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.data, [])
+
+    def test_tag_rename_invalidates_tag_list(self):
+        """Test that renamed tags are listed with their new name"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.client.get(TAGS_URL)
+
+        tag.name = 'Dessert'
+        tag.save()
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.data[0]['name'], 'Dessert')
+
+    def test_bulk_write_invalidates_list(self):
+        """Test that bulk endpoints bypassing signals refresh the list"""
+        self.client.get(RECIPES_URL)
+
+        self.client.post(reverse('recipe:recipe-bulk'), [
+            {'title': 'Soup', 'time_minutes': 5, 'price': '2.00'},
+        ], format='json')
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.data), 1)
+
+    def test_other_users_change_keeps_cache(self):
+        """Test that writes of another user do not invalidate the list"""
+        user2 = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        self.client.get(RECIPES_URL)
+
+        sample_recipe(user2)
+        with self.assertNumQueries(0):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data, [])
+
+    def test_cache_stats_requires_admin(self):
+        """Test that only staff users can read cache statistics"""
+        res = self.client.get(CACHE_STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(RECIPES_URL)
+        res = self.client.get(CACHE_STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['misses'], 1)
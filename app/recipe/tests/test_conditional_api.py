@@ -0,0 +1,147 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def detail_url(recipe_id):
+    """create and return detail url"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    default = {
+        'title': 'sample recipe',
+        'time_minutes': 12,
+        'price': 12.00
+    }
+    default.update(params)
+    return Recipe.objects.create(user=user, **default)
+
+
+class ConditionalGetTest(TestCase):
+    """Test ETag and Last-Modified handling of the recipe API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com',
+            password='test1234')
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user)
+
+    def assertNotModified(self, url, etag, params=None):
+        res = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(res['ETag'], etag)
+
+    def assertModified(self, url, etag, params=None):
+        res = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+        return res['ETag']
+
+    def test_unchanged_list_not_modified(self):
+        """Test that a matching ETag returns 304 without queries"""
+        res = self.client.get(RECIPES_URL)
+        etag = res['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertNotIn('Last-Modified', res)
+
+        with self.assertNumQueries(0):
+            self.assertNotModified(RECIPES_URL, etag)
+
+    def test_etag_depends_on_params(self):
+        """Test that filtered and paginated lists get their own ETag"""
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        self.assertModified(RECIPES_URL, etag, {'page_size': 1})
+
+    def test_changes_modify_list(self):
+        """Test that writes, relation changes and deletes change the ETag"""
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        self.recipe.title = 'Soup'
+        self.recipe.save()
+        etag = self.assertModified(RECIPES_URL, etag)
+
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+        etag = self.assertModified(RECIPES_URL, etag)
+
+        recipe = sample_recipe(self.user)
+        etag = self.assertModified(RECIPES_URL, etag)
+
+        recipe.delete()
+        etag = self.assertModified(RECIPES_URL, etag)
+
+        self.assertNotModified(RECIPES_URL, etag)
+
+    def test_tag_rename_touches_recipes(self):
+        """Test that renaming a tag marks its recipes as updated"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe.tags.add(tag)
+        self.recipe.refresh_from_db()
+        updated_at = self.recipe.updated_at
+
+        tag.name = 'Dessert'
+        tag.save()
+
+        self.recipe.refresh_from_db()
+        self.assertGreater(self.recipe.updated_at, updated_at)
+
+    def test_bulk_update_touches_recipes(self):
+        """Test that bulk updates set updated_at"""
+        updated_at = self.recipe.updated_at
+
+        self.client.patch(reverse('recipe:recipe-bulk'),
+                          [{'id': self.recipe.id, 'title': 'Soup'}],
+                          format='json')
+
+        self.recipe.refresh_from_db()
+        self.assertGreater(self.recipe.updated_at, updated_at)
+
+    def test_detail_last_modified(self):
+        """Test detail responses support If-Modified-Since"""
+        url = detail_url(self.recipe.id)
+        res = self.client.get(url)
+        self.assertIn('Last-Modified', res)
+
+        res = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_etag(self):
+        """Test that detail ETags change with the recipe"""
+        url = detail_url(self.recipe.id)
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, etag)
+
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+
+        self.assertModified(url, etag)
+
+    def test_missing_detail_has_no_etag(self):
+        """Test that unknown recipes still return 404"""
+        res = self.client.get(detail_url(self.recipe.id + 1))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', res)
+
+    def test_assigned_tags_etag(self):
+        """Test that assigning a tag changes the assigned_only ETag"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        params = {'assigned_only': 1}
+        etag = self.client.get(TAGS_URL, params)['ETag']
+
+        self.recipe.tags.add(tag)
+
+        self.assertModified(TAGS_URL, etag, params)
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    default = {
+        'title': 'sample recipe',
+        'time_minutes': 12,
+        'price': 12.00
+    }
+    default.update(params)
+    return Recipe.objects.create(user=user, **default)
+
+
+class PublicExportAPITest(TestCase):
+    """Test unauthenticated export access"""
+
+    def test_login_required(self):
+        """Test that authentication is required"""
+        res = APIClient().get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateExportAPITest(TestCase):
+    """Test exporting the user's recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com',
+            password='test1234')
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user, title='Curry', price=5.50)
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'),
+                             Tag.objects.create(user=self.user, name='Asian'))
+        self.recipe.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='Rice'))
+        sample_recipe(self.user, title='Toast')
+
+    def export(self, **params):
+        res = self.client.get(EXPORT_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res, b''.join(res.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        """Test that NDJSON is the default export format"""
+        res, content = self.export()
+
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(rows[0], {
+            'id': self.recipe.id,
+            'title': 'Curry',
+            'time_minutes': 12,
+            'price': '5.50',
+            'link': '',
+            'tags': ['Asian', 'Vegan'],
+            'ingredients': ['Rice'],
+        })
+        self.assertEqual(rows[1]['title'], 'Toast')
+        self.assertEqual(rows[1]['tags'], [])
+
+    def test_export_csv(self):
+        """Test exporting recipes as CSV"""
+        res, content = self.export(export_format='csv')
+
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        self.assertIn('recipes.csv', res['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['tags'], 'Asian;Vegan')
+        self.assertEqual(rows[0]['ingredients'], 'Rice')
+
+    def test_export_limited_to_user(self):
+        """Test that recipes of other users are not exported"""
+        user2 = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        sample_recipe(user2, title='Steak')
+
+        res, content = self.export()
+
+        self.assertNotIn('Steak', content)
+
+    def test_invalid_format(self):
+        """Test that unknown export formats are rejected"""
+        res = self.client.get(EXPORT_URL, {'export_format': 'xml'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_batches_relations(self):
+        """Test that relations are fetched per chunk, not per recipe"""
+        for i in range(3):
+            sample_recipe(self.user)
+        res = self.client.get(EXPORT_URL)
+
+        # One cursor plus a query per relation for each of 3 chunks
+        with self.assertNumQueries(7):
+            lines = list(res.streaming_content)
+
+        self.assertEqual(len(lines), 5)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_without_server_side_cursors(self):
+        """Test that rows are paged by id when cursors are disabled"""
+        for i in range(3):
+            sample_recipe(self.user)
+        expected = list(Recipe.objects.filter(user=self.user)
+                        .order_by('id').values_list('id', flat=True))
+        res = self.client.get(EXPORT_URL)
+
+        # A query per page plus a query per relation for each of 3 pages
+        with patch.dict(connection.settings_dict,
+                        DISABLE_SERVER_SIDE_CURSORS=True), \
+                self.assertNumQueries(9):
+            lines = list(res.streaming_content)
+
+        ids = [json.loads(line)['id'] for line in lines]
+        self.assertEqual(ids, expected)
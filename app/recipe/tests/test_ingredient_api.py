@@ -1,6 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -134,3 +134,83 @@ class PrivateIngredientAPITest(TestCase):
 
         res = self.client.get(INGREDIENT_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)
+
+    def test_ingredients_with_counts(self):
+        """Test annotating ingredients with their recipe count"""
+        ingredient = Ingredient.objects.create(user=self.user, name='one')
+        recipe = Recipe.objects.create(user=self.user, title='Cake',
+                                       time_minutes=13, price=7.05)
+        recipe.ingredients.add(ingredient)
+
+        res = self.client.get(INGREDIENT_URL, {'with_counts': 1})
+
+        self.assertEqual(res.data[0]['recipe_count'], 1)
+        self.assertEqual(Ingredient.objects.filter(pk=ingredient.pk)
+                         .with_recipe_counts().get().recipe_count, 1)
+
+
+class IngredientAutocompleteAPITest(TestCase):
+    """Test the ?prefix= autocomplete mode of the ingredient list"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.client.force_authenticate(self.user)
+        for name in ('Salt', 'salmon', 'Sage', 'Sugar', 'Rice'):
+            Ingredient.objects.create(user=self.user, name=name)
+
+    def complete(self, prefix, **params):
+        params['prefix'] = prefix
+        res = self.client.get(INGREDIENT_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in res.data]
+
+    def test_autocomplete_prefix(self):
+        """Test that matches are case-insensitive and sorted by name"""
+        self.assertEqual(self.complete('sa'), ['Sage', 'salmon', 'Salt'])
+        self.assertEqual(self.complete('SAL'), ['salmon', 'Salt'])
+        self.assertEqual(self.complete('x'), [])
+
+    def test_autocomplete_limit(self):
+        """Test that the number of matches is limited"""
+        self.assertEqual(self.complete('s', limit=2), ['Sage', 'salmon'])
+
+        res = self.client.get(INGREDIENT_URL, {'prefix': 's', 'limit': 0})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_autocomplete_limited_to_user(self):
+        """Test that names of other users are not suggested"""
+        Ingredient.objects.create(user=sample_user(email='other@gmail.com'),
+                                  name='Saffron')
+
+        self.assertEqual(self.complete('saf'), [])
+
+    def test_autocomplete_sees_new_names(self):
+        """Test that the cached names are rebuilt after a create"""
+        self.assertEqual(self.complete('sa'), ['Sage', 'salmon', 'Salt'])
+        self.client.post(INGREDIENT_URL, {'name': 'Saffron'})
+
+        self.assertEqual(self.complete('sa'),
+                         ['Saffron', 'Sage', 'salmon', 'Salt'])
+
+    def test_autocomplete_cached(self):
+        """Test that repeated lookups do not query the names again"""
+        self.complete('sa')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.complete('su'), ['Sugar'])
+
+    @override_settings(AUTOCOMPLETE_CACHE_MAX_NAMES=2)
+    def test_autocomplete_database_fallback(self):
+        """Test that users with many names are matched in the database"""
+        self.assertEqual(self.complete('sa'), ['Sage', 'salmon', 'Salt'])
+        self.assertEqual(self.complete('sa', limit=1), ['Sage'])
+
+    def test_autocomplete_assigned_only(self):
+        """Test combining autocomplete with assigned_only"""
+        recipe = Recipe.objects.create(user=self.user, title='Fish',
+                                       time_minutes=20, price=9.00)
+        recipe.ingredients.add(Ingredient.objects.get(name='salmon'))
+
+        self.assertEqual(self.complete('sa', assigned_only=1), ['salmon'])
@@ -0,0 +1,135 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+INGREDIENTS_URL = reverse('recipe:ingredient-list')
+
+
+def detail_url(recipe_id):
+    """create and return detail url"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipes(user, count):
+    """Create `count` recipes each with a couple of tags and ingredients"""
+    recipes = []
+    for i in range(count):
+        recipe = Recipe.objects.create(user=user, title='recipe %d' % i,
+                                       time_minutes=10, price=5.00)
+        recipe.tags.add(Tag.objects.create(user=user, name='tag %d' % i),
+                        Tag.objects.create(user=user, name='other %d' % i))
+        recipe.ingredients.add(
+            Ingredient.objects.create(user=user, name='ingredient %d' % i),
+            Ingredient.objects.create(user=user, name='salt %d' % i))
+        recipes.append(recipe)
+    return recipes
+
+
+class QueryCountTest(TestCase):
+    """Test that endpoints issue a constant number of queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com',
+            password='test1234')
+        self.client.force_authenticate(self.user)
+
+    def assertConstantQueries(self, num, url, params=None):
+        """Assert GET url costs `num` queries for small and large data"""
+        for count in (1, 10):
+            sample_recipes(self.user, count)
+            with self.assertNumQueries(num):
+                res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_recipe_list_queries(self):
+        """Test listing recipes prefetches tags and ingredients"""
+        self.assertConstantQueries(4, RECIPES_URL)
+
+    def test_recipe_list_paginated_queries(self):
+        """Test a page of recipes prefetches tags and ingredients"""
+        self.assertConstantQueries(4, RECIPES_URL, {'page_size': 5})
+
+    def test_recipe_list_filtered_queries(self):
+        """Test filtered recipe list keeps a constant query count"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        for count in (1, 10):
+            for recipe in sample_recipes(self.user, count):
+                recipe.tags.add(tag)
+            with self.assertNumQueries(4):
+                res = self.client.get(RECIPES_URL, {'tags': tag.id})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_recipe_detail_queries(self):
+        """Test recipe detail prefetches nested tags and ingredients"""
+        recipe = sample_recipes(self.user, 1)[0]
+        recipe.tags.add(*[Tag.objects.create(user=self.user, name=str(i))
+                          for i in range(10)])
+
+        with self.assertNumQueries(4):
+            res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['tags']), 12)
+
+    def test_tag_list_queries(self):
+        """Test listing tags is a single query plus the ETag aggregates"""
+        self.assertConstantQueries(2, TAGS_URL)
+        self.assertConstantQueries(3, TAGS_URL, {'assigned_only': 1})
+        self.assertConstantQueries(3, TAGS_URL, {'with_counts': 1})
+
+    def test_ingredient_list_queries(self):
+        """Test listing ingredients is a single query plus ETag aggregates"""
+        self.assertConstantQueries(2, INGREDIENTS_URL)
+        self.assertConstantQueries(3, INGREDIENTS_URL, {'assigned_only': 1})
+
+    def test_create_recipe_queries(self):
+        """Test creating a recipe does not depend on the user's data"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        payload = {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': 5.00,
+            'tags': [tag.id],
+            'ingredients': [ingredient.id],
+        }
+        for count in (1, 10):
+            sample_recipes(self.user, count)
+            with self.assertNumQueries(17):
+                res = self.client.post(RECIPES_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_update_recipe_queries(self):
+        """Test updating a recipe does not depend on the user's data"""
+        recipe = sample_recipes(self.user, 1)[0]
+        for count in (1, 10):
+            sample_recipes(self.user, count)
+            tag = Tag.objects.create(user=self.user, name='Vegan')
+            with self.assertNumQueries(16):
+                res = self.client.patch(detail_url(recipe.id),
+                                        {'tags': [tag.id]})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_delete_recipe_queries(self):
+        """Test deleting a recipe does not depend on the user's data"""
+        for count in (1, 10):
+            recipe = sample_recipes(self.user, count)[0]
+            with self.assertNumQueries(9):
+                res = self.client.delete(detail_url(recipe.id))
+            self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_create_tag_and_ingredient_queries(self):
+        """Test creating a tag or ingredient is a single insert"""
+        for url in (TAGS_URL, INGREDIENTS_URL):
+            with self.assertNumQueries(1):
+                res = self.client.post(url, {'name': 'Vegan'})
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
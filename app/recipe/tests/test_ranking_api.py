@@ -0,0 +1,143 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+
+
+def similar_url(recipe_id):
+    """Return the similar recipes url of a recipe"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def sample_recipe(user, title, ingredients):
+    """Create and return a sample recipe using ingredients"""
+    recipe = Recipe.objects.create(user=user, title=title, time_minutes=10,
+                                   price=5.00)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+class CookableAPITest(TestCase):
+    """Test ranking recipes by the ingredients at hand"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.client.force_authenticate(self.user)
+        self.rice, self.salt, self.egg = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('rice', 'salt', 'egg')
+        ]
+        sample_recipe(self.user, 'fried rice',
+                      [self.rice, self.salt, self.egg])
+        sample_recipe(self.user, 'boiled egg', [self.egg])
+        sample_recipe(self.user, 'toast', [])
+
+    def test_login_required(self):
+        """Test that authentication is required"""
+        res = APIClient().get(COOKABLE_URL, {'have': self.egg.id})
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rank_by_ingredients_at_hand(self):
+        """Test that fully covered recipes come first"""
+        res = self.client.get(COOKABLE_URL, {
+            'have': '%s,%s' % (self.egg.id, self.salt.id),
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['title'] for recipe in res.data],
+                         ['boiled egg', 'fried rice'])
+        self.assertEqual(res.data[0]['coverage'], 1.0)
+        self.assertAlmostEqual(res.data[1]['coverage'], 2 / 3)
+        self.assertEqual(res.data[1]['missing_ingredients'], [self.rice.id])
+
+    def test_limit_and_other_users(self):
+        """Test the limit and that other users' recipes are not ranked"""
+        other = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        sample_recipe(other, 'steak', [
+            Ingredient.objects.create(user=other, name='egg')])
+
+        res = self.client.get(COOKABLE_URL, {'have': self.egg.id,
+                                             'limit': 1})
+
+        self.assertEqual([recipe['title'] for recipe in res.data],
+                         ['boiled egg'])
+
+    def test_have_required(self):
+        """Test that the ingredients at hand must be given"""
+        for params in ({}, {'have': 'x'}):
+            res = self.client.get(COOKABLE_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('have', res.data)
+
+
+class SimilarAPITest(TestCase):
+    """Test listing recipes similar to a recipe"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.client.force_authenticate(self.user)
+        rice, egg, milk = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('rice', 'egg', 'milk')
+        ]
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.pudding = sample_recipe(self.user, 'pudding', [rice, milk])
+        self.pudding.tags.add(self.vegan)
+        self.rice_milk = sample_recipe(self.user, 'rice milk', [rice, milk])
+        self.fried_rice = sample_recipe(self.user, 'fried rice', [rice, egg])
+        self.fried_rice.tags.add(self.vegan)
+        sample_recipe(self.user, 'boiled egg', [egg])
+
+    def test_similar_by_tags_and_ingredients(self):
+        """Test that recipes sharing more features rank first"""
+        res = self.client.get(similar_url(self.pudding.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # {Vegan, rice, milk} vs {rice, milk} and {Vegan, rice, egg}
+        self.assertEqual([recipe['title'] for recipe in res.data],
+                         ['rice milk', 'fried rice'])
+        self.assertAlmostEqual(res.data[0]['similarity'], 2 / 3)
+        self.assertAlmostEqual(res.data[1]['similarity'], 2 / 4)
+
+    def test_limit(self):
+        """Test that the limit caps the number of recipes"""
+        res = self.client.get(similar_url(self.pudding.id), {'limit': 1})
+
+        self.assertEqual([recipe['title'] for recipe in res.data],
+                         ['rice milk'])
+
+    def test_other_users_recipe_not_found(self):
+        """Test that recipes of other users cannot be compared"""
+        other = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+        recipe = sample_recipe(other, 'steak', [])
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_scores_from_one_index_snapshot(self):
+        """Test that both recipes' features come from the cached index"""
+        self.client.get(similar_url(self.pudding.id))
+        # Unlike .clear(), deleting the rows sends no m2m_changed signal
+        Recipe.ingredients.through.objects \
+            .filter(recipe=self.pudding).delete()
+        Recipe.tags.through.objects.filter(recipe=self.pudding).delete()
+
+        res = self.client.get(similar_url(self.pudding.id))
+
+        self.assertAlmostEqual(res.data[0]['similarity'], 2 / 3)
+        self.assertAlmostEqual(res.data[1]['similarity'], 2 / 4)
@@ -1,12 +1,25 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from PIL import Image
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core import images
+from core.models import Recipe, Tag, Ingredient, StoredFile
 
+from recipe.pagination import RecipeCursorPagination
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 RECIPES_URL = reverse('recipe:recipe-list')
@@ -17,6 +30,11 @@ def detail_url(recipe_id):
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def image_upload_url(recipe_id):
+    """Return URL for recipe image upload"""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
 def sample_tag(user, name='meat'):
     """Create and return a sample tag"""
     return Tag.objects.create(user=user, name=name)
@@ -241,3 +259,400 @@ class PrivateAPITest(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+    def test_filter_recipes_by_tag_unique(self):
+        """Test that recipes matching several tags are listed once"""
+        recipe = sample_recipe(user=self.user)
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Quick')
+        ingredient = sample_ingredient(user=self.user)
+        recipe.tags.add(tag1, tag2)
+        recipe.ingredients.add(ingredient)
+
+        res = self.client.get(RECIPES_URL, {
+            'tags': '%s,%s' % (tag1.id, tag2.id),
+            'ingredients': ingredient.id,
+        })
+
+        self.assertEqual(len(res.data), 1)
+
+    def test_filter_recipes_with_all_tags(self):
+        """Test filtering recipes linked to every listed tag"""
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Quick')
+        ingredient = sample_ingredient(user=self.user)
+        both = sample_recipe(user=self.user, title='both')
+        both.tags.add(tag1, tag2)
+        both.ingredients.add(ingredient)
+        sample_recipe(user=self.user, title='one').tags.add(tag1)
+
+        res = self.client.get(RECIPES_URL,
+                              {'tags_all': '%s,%s,%s' % (tag1.id, tag2.id,
+                                                         tag1.id)})
+
+        self.assertEqual([recipe['title'] for recipe in res.data], ['both'])
+
+        res = self.client.get(RECIPES_URL, {
+            'tags_all': tag1.id,
+            'ingredients_all': ingredient.id,
+        })
+
+        self.assertEqual([recipe['title'] for recipe in res.data], ['both'])
+
+    def test_filter_recipes_by_time_and_price(self):
+        """Test filtering recipes by maximum time and a price range"""
+        sample_recipe(user=self.user, title='quick', time_minutes=10,
+                      price=4.00)
+        sample_recipe(user=self.user, title='slow', time_minutes=90,
+                      price=4.00)
+        sample_recipe(user=self.user, title='pricey', time_minutes=10,
+                      price=25.00)
+
+        res = self.client.get(RECIPES_URL, {'max_time': 30})
+        self.assertEqual(sorted(recipe['title'] for recipe in res.data),
+                         ['pricey', 'quick'])
+
+        res = self.client.get(RECIPES_URL, {'min_price': '3.50',
+                                            'max_price': '5',
+                                            'max_time': 10})
+        self.assertEqual([recipe['title'] for recipe in res.data],
+                         ['quick'])
+
+    def test_invalid_filters(self):
+        """Test that malformed filter values are rejected"""
+        for params in ({'tags_all': '1,x'}, {'max_time': 'soon'},
+                       {'min_price': 'cheap'}):
+            res = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(list(params)[0], res.data)
+
+    def test_recipes_unpaginated_by_default(self):
+        """Test that listing without page params returns a plain list"""
+        sample_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertIsInstance(res.data, list)
+
+    def test_recipes_cursor_pagination(self):
+        """Test paging through recipes with an opaque cursor"""
+        recipes = [sample_recipe(user=self.user) for _ in range(5)]
+        recipe_ids = [recipe.id for recipe in reversed(recipes)]
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data['results']],
+                         recipe_ids[:2])
+        self.assertIsNone(res.data['previous'])
+
+        seen = []
+        url = RECIPES_URL + '?page_size=2'
+        while url:
+            res = self.client.get(url)
+            seen.extend(r['id'] for r in res.data['results'])
+            url = res.data['next']
+
+        self.assertEqual(seen, recipe_ids)
+
+    def test_recipes_page_size_is_capped(self):
+        """Test that clients can not request more than the max page size"""
+        sample_recipe(user=self.user)
+        sample_recipe(user=self.user)
+
+        with patch.object(RecipeCursorPagination, 'max_page_size', 1):
+            res = self.client.get(RECIPES_URL, {'page_size': 50})
+
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_recipes_invalid_cursor(self):
+        """Test that a tampered cursor is rejected"""
+        res = self.client.get(RECIPES_URL, {'cursor': 'garbage'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_recipes(self):
+        """Test searching recipes by title, tag and ingredient names"""
+        recipe1 = sample_recipe(user=self.user, title='Thai curry')
+        recipe2 = sample_recipe(user=self.user, title='Lentil soup')
+        recipe3 = sample_recipe(user=self.user, title='Pancakes')
+        recipe2.tags.add(sample_tag(user=self.user, name='Curry night'))
+        recipe3.ingredients.add(sample_ingredient(user=self.user,
+                                                  name='Curry powder'))
+        sample_recipe(user=self.user, title='Steak')
+
+        res = self.client.get(RECIPES_URL, {'search': 'curry'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(r['id'] for r in res.data),
+                         sorted([recipe1.id, recipe2.id, recipe3.id]))
+
+    def test_search_pagination_keeps_rank_order(self):
+        """Test that paginated search results stay in relevance order"""
+        recipes = [sample_recipe(user=self.user, title='Curry %d' % i)
+                   for i in range(3)]
+
+        # Rank oldest first, unlike the default newest first ordering
+        with patch('recipe.views.search_recipes',
+                   side_effect=lambda queryset, terms:
+                   queryset.order_by('id')):
+            res = self.client.get(RECIPES_URL, {'search': 'curry',
+                                                'page_size': 2})
+            self.assertEqual([r['id'] for r in res.data['results']],
+                             [recipes[0].id, recipes[1].id])
+
+            res = self.client.get(res.data['next'])
+
+        self.assertEqual([r['id'] for r in res.data['results']],
+                         [recipes[2].id])
+        self.assertIsNone(res.data['next'])
+
+    def test_search_matches_all_words(self):
+        """Test that every searched word has to match"""
+        recipe = sample_recipe(user=self.user, title='Thai curry')
+        sample_recipe(user=self.user, title='Indian curry')
+
+        res = self.client.get(RECIPES_URL, {'search': 'thai curry'})
+
+        self.assertEqual([r['id'] for r in res.data], [recipe.id])
+
+    def test_search_follows_renamed_and_removed_tags(self):
+        """Test that the search index tracks tag changes"""
+        recipe = sample_recipe(user=self.user, title='Soup')
+        tag = sample_tag(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+
+        tag.name = 'Winter'
+        tag.save()
+        res = self.client.get(RECIPES_URL, {'search': 'winter'})
+        self.assertEqual([r['id'] for r in res.data], [recipe.id])
+
+        tag.delete()
+        res = self.client.get(RECIPES_URL, {'search': 'winter'})
+        self.assertEqual(res.data, [])
+
+    def test_search_limited_to_user(self):
+        """Test that search only returns the user's recipes"""
+        user2 = get_user_model().objects.create_user(
+            'salman@outlook.com',
+            'pass1234'
+        )
+        sample_recipe(user=user2, title='Curry')
+
+        res = self.client.get(RECIPES_URL, {'search': 'curry'})
+
+        self.assertEqual(res.data, [])
+
+
+class RecipeImageUploadTest(TestCase):
+    """Test uploading recipe images and generating thumbnails"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'salman@gmail.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def upload(self, recipe=None, color='red', size=(10, 10)):
+        recipe = recipe or self.recipe
+        with tempfile.NamedTemporaryFile(suffix='.JPG') as ntf:
+            Image.new('RGB', size, color).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(image_upload_url(recipe.id),
+                                   {'image': ntf}, format='multipart')
+        recipe.refresh_from_db()
+        return res
+
+    @patch('core.images.submit')
+    def test_upload_image_to_recipe(self, submit):
+        """Test uploading an image returns before thumbnails exist"""
+        res = self.upload()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('image', res.data)
+        self.assertIsNone(res.data['thumbnails'])
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertTrue(self.recipe.image.name.endswith('.jpg'))
+        submit.assert_called_once_with(images.generate_thumbnails,
+                                       self.recipe.image.name)
+
+    @patch('core.images.submit')
+    def test_duplicate_uploads_stored_once(self, submit):
+        """Test that identical images share one file"""
+        recipe2 = sample_recipe(user=self.user)
+        self.upload()
+        self.upload(recipe2)
+
+        self.assertEqual(self.recipe.image.name, recipe2.image.name)
+        self.assertEqual(
+            StoredFile.objects.get(name=recipe2.image.name).refcount, 2)
+        self.assertEqual(
+            len(os.listdir(os.path.dirname(recipe2.image.path))), 1)
+
+    @patch('django.db.transaction.on_commit', side_effect=lambda fn: fn())
+    @patch('core.images.submit')
+    def test_last_reference_removes_files(self, submit, on_commit):
+        """Test that files are removed once no recipe uses them"""
+        recipe2 = sample_recipe(user=self.user)
+        self.upload()
+        self.upload(recipe2)
+        path = recipe2.image.path
+
+        self.recipe.delete()
+        self.assertTrue(os.path.exists(path))
+
+        self.upload(recipe2, color='blue')
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(StoredFile.objects.get().name, recipe2.image.name)
+
+    @patch('core.images.submit')
+    def test_bulk_delete_releases_images(self, submit):
+        """Test that each deleted recipe drops its image reference"""
+        recipes = [self.recipe] + [sample_recipe(user=self.user)
+                                   for _ in range(2)]
+        for recipe in recipes:
+            self.upload(recipe)
+
+        self.client.delete(reverse('recipe:recipe-bulk'),
+                           [recipe.id for recipe in recipes[:2]],
+                           format='json')
+
+        self.assertEqual(StoredFile.objects.get().refcount, 1)
+
+    @patch('core.images.submit')
+    def test_files_kept_on_rollback(self, submit):
+        """Test that a rolled back release keeps the files"""
+        self.upload(size=(2400, 1800))
+        images.generate_thumbnails(self.recipe.image.name)
+        name = self.recipe.image.name
+        thumbnail = images.thumbnail_name(name, 'small', 'JPEG')
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.recipe.delete()
+                raise ValueError
+
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertTrue(default_storage.exists(thumbnail))
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+
+    @patch('django.db.transaction.on_commit', side_effect=lambda fn: fn())
+    @patch('core.images.submit')
+    def test_thumbnails_removed_with_image(self, submit, on_commit):
+        """Test that thumbnails go when the last reference is released"""
+        self.upload(size=(2400, 1800))
+        images.generate_thumbnails(self.recipe.image.name)
+        thumbnail = images.thumbnail_name(self.recipe.image.name, 'small',
+                                          'JPEG')
+
+        self.recipe.delete()
+
+        self.assertFalse(default_storage.exists(thumbnail))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_file_stored_again_is_kept(self):
+        """Test that a file stored again before removal stays in place"""
+        storage = images.image_storage()
+        name = storage.save('uploads/recipe/a.txt', ContentFile(b'data'))
+        storage.delete(name)
+        storage.save('uploads/recipe/b.txt', ContentFile(b'data'))
+
+        storage._remove(name)
+
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+
+    @patch('core.images.submit')
+    def test_thumbnails_reused(self, submit):
+        """Test that thumbnails of a known image are not made again"""
+        self.upload(size=(2400, 1800))
+        images.generate_thumbnails(self.recipe.image.name)
+        recipe2 = sample_recipe(user=self.user)
+        submit.reset_mock()
+
+        res = self.upload(recipe2, size=(2400, 1800))
+
+        submit.assert_not_called()
+        self.assertEqual(sorted(res.data['thumbnails']),
+                         ['large', 'medium', 'small'])
+        self.assertTrue(recipe2.thumbnails_ready)
+
+    def test_upload_image_bad_request(self):
+        """Test uploading an invalid image"""
+        res = self.client.post(image_upload_url(self.recipe.id),
+                               {'image': 'notimage'}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('core.images.submit')
+    def test_generate_thumbnails(self, submit):
+        """Test that every size and format is written and exposed"""
+        recipe2 = sample_recipe(user=self.user)
+        self.upload(size=(2400, 1800))
+        self.upload(recipe2, size=(2400, 1800))
+
+        images.generate_thumbnails(self.recipe.image.name)
+
+        for label, size in images.settings.THUMBNAIL_SIZES:
+            for image_format in images.settings.THUMBNAIL_FORMATS:
+                name = images.thumbnail_name(self.recipe.image.name, label,
+                                             image_format)
+                with default_storage.open(name) as f:
+                    thumbnail = Image.open(f)
+                    self.assertEqual(thumbnail.format, image_format)
+                    self.assertEqual(max(thumbnail.size), size)
+        res = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(sorted(res.data['thumbnails']['small']),
+                         ['jpg', 'webp'])
+        recipe2.refresh_from_db()
+        self.assertTrue(recipe2.thumbnails_ready)
+
+    @patch('core.images.submit')
+    def test_unsupported_thumbnail_format_skipped(self, submit):
+        """Test that formats missing from Pillow are left out, not fatal"""
+        self.upload(size=(2400, 1800))
+        images._missing_formats.clear()
+
+        with patch('core.images.features.check',
+                   side_effect=lambda feature: feature != 'webp'), \
+                self.assertLogs('core.images', 'WARNING') as logs:
+            images.generate_thumbnails(self.recipe.image.name)
+            res = self.client.get(detail_url(self.recipe.id))
+
+        self.assertIn('Pillow lacks webp support', logs.output[0])
+        self.assertEqual(sorted(res.data['thumbnails']['small']), ['jpg'])
+        self.assertFalse(default_storage.exists(images.thumbnail_name(
+            self.recipe.image.name, 'small', 'WEBP')))
+
+    @patch('core.images.submit')
+    def test_thumbnails_of_released_image_ignored(self, submit):
+        """Test that a stale job neither fails nor marks a new image"""
+        self.upload()
+        stale = self.recipe.image.name
+        self.upload(color='blue')
+
+        images.generate_thumbnails(stale)
+
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.thumbnails_ready)
+
+    def test_storage_hashes_in_memory_content(self):
+        """Test saving content which was not uploaded to a temp file"""
+        storage = images.image_storage()
+
+        name = storage.save('uploads/recipe/a.txt', ContentFile(b'data'))
+        again = storage.save('uploads/recipe/b.TXT', ContentFile(b'data'))
+
+        self.assertEqual(name, 'uploads/recipe/3a/%s.txt' % (
+            hashlib.sha256(b'data').hexdigest()))
+        self.assertEqual(again, name)
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 2)
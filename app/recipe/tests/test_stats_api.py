@@ -0,0 +1,165 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import stats
+from core.models import Recipe, RecipeStats, Tag, Ingredient
+
+STATS_URL = reverse('recipe:stats')
+RECIPES_BULK_URL = reverse('recipe:recipe-bulk')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    default = {
+        'title': 'sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    default.update(params)
+    return Recipe.objects.create(user=user, **default)
+
+
+class PublicStatsAPITest(TestCase):
+    """Test unauthenticated stats access"""
+
+    def test_login_required(self):
+        """Test that authentication is required"""
+        res = APIClient().get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsAPITest(TestCase):
+    """Test the per-user recipe stats"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='salman@gmail.com', password='test1234')
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = Tag.objects.create(user=self.user, name='Quick')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+
+    def assertStatsConsistent(self):
+        """Assert the incremental counters match a rebuild from scratch"""
+        self.assertEqual(stats.rebuild_stats([self.user.pk]), 0)
+
+    def test_empty_stats(self):
+        """Test the stats of a user without recipes"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 0)
+        self.assertIsNone(res.data['average_price'])
+        self.assertIsNone(res.data['average_time_minutes'])
+
+    def test_retrieve_stats(self):
+        """Test totals, averages and the most used tags"""
+        self.client.get(STATS_URL)
+        curry = sample_recipe(self.user, price=4.00, time_minutes=30)
+        curry.tags.add(self.vegan, self.quick)
+        sample_recipe(self.user, price=7.00, time_minutes=15) \
+            .tags.add(self.vegan)
+        sample_recipe(get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234'), price=99)
+
+        with self.assertNumQueries(3):
+            res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(res.data['average_price'], '5.50')
+        self.assertEqual(res.data['average_time_minutes'], 22.5)
+        self.assertEqual(res.data['tags'], [
+            {'id': self.vegan.id, 'name': 'Vegan', 'recipe_count': 2},
+            {'id': self.quick.id, 'name': 'Quick', 'recipe_count': 1},
+        ])
+        self.assertEqual(res.data['ingredients'][0]['recipe_count'], 0)
+
+    def test_stats_follow_updates(self):
+        """Test that edits, relation changes and deletes are counted"""
+        self.client.get(STATS_URL)
+        recipe = sample_recipe(self.user)
+        recipe.tags.add(self.vegan, self.quick)
+        recipe.ingredients.add(self.salt)
+        self.assertStatsConsistent()
+
+        recipe.price = Decimal('8.25')
+        recipe.time_minutes = 40
+        recipe.save()
+        recipe.tags.remove(self.quick, self.quick)
+        self.assertStatsConsistent()
+
+        recipe.tags.clear()
+        self.vegan.recipe_set.add(recipe, sample_recipe(self.user))
+        self.assertStatsConsistent()
+
+        self.vegan.recipe_set.remove(recipe)
+        self.salt.recipe_set.clear()
+        recipe.delete()
+        self.assertStatsConsistent()
+
+        stats_row = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats_row.recipe_count, 1)
+        self.assertEqual(Tag.objects.get(pk=self.vegan.pk).usage_count, 1)
+
+    def test_stats_follow_stale_instance_updates(self):
+        """Test that each save swaps the price stored at that moment"""
+        recipe = sample_recipe(self.user)
+        stale = Recipe.objects.get(pk=recipe.pk)
+
+        recipe.price = Decimal('8.25')
+        recipe.save()
+        stale.price = Decimal('3.50')
+        stale.save()
+
+        self.assertStatsConsistent()
+        self.assertEqual(RecipeStats.objects.get(user=self.user)
+                         .price_total, Decimal('3.50'))
+
+    def test_stats_follow_bulk_writes(self):
+        """Test that the bulk endpoints maintain the counters"""
+        self.client.get(STATS_URL)
+        res = self.client.post(RECIPES_BULK_URL, [{
+            'title': 'recipe %d' % i, 'time_minutes': 10, 'price': '2.00',
+            'tags': [self.vegan.id], 'ingredients': [self.salt.id],
+        } for i in range(3)], format='json')
+        self.assertStatsConsistent()
+
+        self.client.patch(RECIPES_BULK_URL, [
+            {'id': res.data[0]['id'], 'price': '9.00',
+             'tags': [self.quick.id]},
+            {'id': res.data[1]['id'], 'time_minutes': 50},
+        ], format='json')
+        self.assertStatsConsistent()
+
+        self.client.delete(RECIPES_BULK_URL, [res.data[2]['id']],
+                           format='json')
+        self.assertStatsConsistent()
+        self.assertEqual(self.client.get(STATS_URL).data['average_price'],
+                         '5.50')
+
+    def test_stats_created_with_user(self):
+        """Test that new users start with empty totals"""
+        user = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test1234')
+
+        stats_row = RecipeStats.objects.get(user=user)
+        self.assertEqual(stats_row.recipe_count, 0)
+        self.assertEqual(stats_row.price_total, 0)
+
+    def test_stats_read_without_writes(self):
+        """Test that reading the stats neither rebuilds nor writes them"""
+        sample_recipe(self.user, price=3.00)
+
+        with self.assertNumQueries(3):
+            res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 1)
+        self.assertEqual(res.data['average_price'], '3.00')
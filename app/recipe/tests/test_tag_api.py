@@ -111,3 +111,78 @@ class PrivateTagAPITest(TestCase):
                               {'assigned_only': 1})
 
         self.assertEqual(len(res.data), 1)
+
+    def test_tags_cursor_pagination(self):
+        """Test paging through tags ordered by name"""
+        for name in ('a', 'b', 'b', 'c'):
+            Tag.objects.create(user=self.user, name=name)
+        expected = TagSerializer(
+            Tag.objects.order_by('-name', '-id'), many=True).data
+
+        seen = []
+        url = TAGS_URL + '?page_size=3'
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            seen.extend(res.data['results'])
+            url = res.data['next']
+
+        self.assertEqual(seen, expected)
+
+    def test_tags_autocomplete(self):
+        """Test suggesting tags by prefix"""
+        for name in ('Vegan', 'vegetarian', 'Dessert'):
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_URL, {'prefix': 'veg'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag['name'] for tag in res.data],
+                         ['Vegan', 'vegetarian'])
+
+    def test_tags_with_counts(self):
+        """Test annotating tags with the number of recipes using them"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Dessert')
+        for title in ('Curry', 'Salad'):
+            recipe = Recipe.objects.create(user=self.user, title=title,
+                                           time_minutes=10, price=5.00)
+            recipe.tags.add(vegan)
+
+        res = self.client.get(TAGS_URL, {'with_counts': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': vegan.id, 'name': 'Vegan', 'recipe_count': 2},
+            {'id': vegan.id + 1, 'name': 'Dessert', 'recipe_count': 0},
+        ])
+
+        res = self.client.get(TAGS_URL, {'with_counts': 1,
+                                         'assigned_only': 1})
+
+        self.assertEqual([tag['name'] for tag in res.data], ['Vegan'])
+
+    def test_flags_accept_boolean_words(self):
+        """Test that flags accept true/yes and reject other values"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Dessert')
+        recipe = Recipe.objects.create(user=self.user, title='Curry',
+                                       time_minutes=10, price=5.00)
+        recipe.tags.add(vegan)
+
+        res = self.client.get(TAGS_URL, {'with_counts': 'true',
+                                         'assigned_only': 'yes'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': vegan.id, 'name': 'Vegan', 'recipe_count': 1},
+        ])
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 'false'})
+
+        self.assertEqual(len(res.data), 2)
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 'maybe'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('assigned_only', res.data)
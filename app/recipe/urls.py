@@ -11,5 +11,7 @@ router.register('recipes', views.RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('cache-stats/', views.CacheStatsView.as_view(), name='cache-stats'),
+    path('stats/', views.RecipeStatsView.as_view(), name='stats'),
     path('', include(router.urls)),
 ]
@@ -1,30 +1,102 @@
-from rest_framework import viewsets, mixins
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import fields, mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from core import autocomplete, caching, export, images, ranking, stats
+from core.authentication import CachedTokenAuthentication
+from core.storage import HashingUploadHandler
 from core.models import Tag, Ingredient, Recipe
+from core.search import search_recipes
 from . import serializers
+from .mixins import BulkModelMixin, CachedListMixin, ConditionalGetMixin
+from .pagination import NameCursorPagination, RecipeCursorPagination, \
+    RecipeSearchPagination
 
 
-class BaseTagIngredientViewSet(viewsets.GenericViewSet,
+def get_limit(request, default, maximum):
+    """Return the requested number of results, capped at maximum"""
+    limit = request.query_params.get('limit', default)
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValidationError({'limit': [
+            _('Ensure this value is a positive integer.')
+        ]})
+    return min(limit, maximum)
+
+
+class BaseTagIngredientViewSet(ConditionalGetMixin,
+                               CachedListMixin,
+                               BulkModelMixin,
+                               viewsets.GenericViewSet,
                                mixins.ListModelMixin,
                                mixins.CreateModelMixin):
     """Base class for ingredient and tag with common functionalities"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = NameCursorPagination
 
     def get_queryset(self):
         """get objects belong to authenticated user"""
-        assigned_only = bool(
-            int(self.request.query_params.get('assigned_only', 0))
-        )
-        queryset = self.queryset
-        if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+        assigned_only = self.get_flag('assigned_only')
+        queryset = self.queryset.filter(user=self.request.user)
+        if self.get_flag('with_counts'):
+            queryset = queryset.with_recipe_counts()
+            if assigned_only:
+                queryset = queryset.filter(recipe_count__gt=0)
+        elif assigned_only:
+            queryset = queryset.assigned()
 
-        return queryset.filter(
-            user=self.request.user
-        ).order_by('-name').distinct()
+        return queryset.order_by('-name')
+
+    def get_flag(self, name):
+        """Parse a boolean query parameter such as 1, true or no"""
+        value = self.request.query_params.get(name)
+        if not value:
+            return False
+        try:
+            return fields.BooleanField().run_validation(value)
+        except ValidationError as exc:
+            raise ValidationError({name: exc.detail})
+
+    def get_serializer_class(self):
+        if self.action == 'list' and self.get_flag('with_counts'):
+            return self.count_serializer_class
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        """Autocomplete names when a prefix is given"""
+        prefix = request.query_params.get('prefix')
+        if prefix is None:
+            return super().list(request, *args, **kwargs)
+        limit = get_limit(request,
+                          getattr(settings, 'AUTOCOMPLETE_LIMIT', 10),
+                          getattr(settings, 'AUTOCOMPLETE_MAX_LIMIT', 50))
+        if self.get_flag('assigned_only'):
+            matches = [{'id': pk, 'name': name} for pk, name in
+                       autocomplete.match_names(self.get_queryset(),
+                                                prefix, limit)]
+        else:
+            matches = autocomplete.complete(self.queryset.model,
+                                            request.user.pk, prefix, limit)
+        return Response(matches)
+
+    def get_etag_querysets(self):
+        """Assignment to recipes is tracked by the recipes' updated_at"""
+        querysets = super().get_etag_querysets()
+        if self.get_flag('assigned_only') or self.get_flag('with_counts'):
+            querysets += (Recipe.objects.filter(user=self.request.user),)
+        return querysets
 
     def perform_create(self, serializer):
         """Create a new object with authenticated user"""
@@ -35,46 +107,235 @@ class TagViewSet(BaseTagIngredientViewSet):
     """Manage Tag """
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
+    count_serializer_class = serializers.TagCountSerializer
+    bulk_serializer_class = serializers.TagBulkSerializer
 
 
 class IngredientViewSet(BaseTagIngredientViewSet):
     """Manage Ingredient"""
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
+    count_serializer_class = serializers.IngredientCountSerializer
+    bulk_serializer_class = serializers.IngredientBulkSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, CachedListMixin, BulkModelMixin,
+                    viewsets.ModelViewSet):
     """Manage recipes"""
     serializer_class = serializers.RecipeSerializer
+    bulk_serializer_class = serializers.RecipeBulkSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = RecipeCursorPagination
+
+    # Query parameter -> lookup, validating field
+    range_filters = (
+        ('max_time', 'time_minutes__lte', fields.IntegerField()),
+        ('min_price', 'price__gte',
+         fields.DecimalField(max_digits=8, decimal_places=2)),
+        ('max_price', 'price__lte',
+         fields.DecimalField(max_digits=8, decimal_places=2)),
+    )
 
-    def _params_to_ids(self, qs):
+    def _params_to_ids(self, name, qs):
         """Convert list of string IDs to integer IDs"""
-        return [int(str_id) for str_id in qs.split(',')]
+        try:
+            return [int(str_id) for str_id in qs.split(',')]
+        except ValueError:
+            raise ValidationError(
+                {name: [_('Expected a comma separated list of ids.')]})
+
+    def _filter_related(self, queryset):
+        """Filter on tags/ingredients matching any or all listed ids"""
+        params = self.request.query_params
+        for relation in ('tags', 'ingredients'):
+            if params.get(relation):
+                ids = self._params_to_ids(relation, params[relation])
+                queryset = queryset.related_to_any(relation, ids)
+            name = relation + '_all'
+            if params.get(name):
+                ids = self._params_to_ids(name, params[name])
+                queryset = queryset.related_to_all(relation, ids)
+        return queryset
+
+    def _filter_ranges(self, queryset):
+        """Filter on the time and price limits given"""
+        params = self.request.query_params
+        for name, lookup, field in self.range_filters:
+            if params.get(name):
+                try:
+                    value = field.run_validation(params[name])
+                except ValidationError as exc:
+                    raise ValidationError({name: exc.detail})
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    @property
+    def paginator(self):
+        """Page search results by offset, cursors would drop the rank"""
+        if self.request.query_params.get('search'):
+            self.pagination_class = RecipeSearchPagination
+        return super().paginator
 
     def get_queryset(self):
         """Retrieve limits to authenticated user"""
-        tags = self.request.query_params.get('tags')
-        ingredients = self.request.query_params.get('ingredients')
-        queryset = self.queryset
-        if tags:
-            tag_ids = self._params_to_ids(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
-        if ingredients:
-            ingredient_ids = self._params_to_ids(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
-
-        return queryset.filter(user=self.request.user).order_by('-id')
+        queryset = self._filter_ranges(self._filter_related(self.queryset))
+
+        queryset = queryset.filter(user=self.request.user).order_by('-id')
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = search_recipes(queryset, search)
+
+        return queryset.defer('search_vector') \
+            .prefetch_related(*self._get_prefetches())
+
+    def _get_prefetches(self):
+        """Prefetch only the related columns the serializer renders
+
+        Writes render from a fresh instance, so only reads prefetch.
+        """
+        if self.action in ('list', 'cookable', 'similar'):
+            fields = ('id',)
+        elif self.action == 'retrieve':
+            fields = ('id', 'name')
+        else:
+            return ()
+        return (
+            Prefetch('tags', queryset=Tag.objects.only(*fields)),
+            Prefetch('ingredients', queryset=Ingredient.objects.only(*fields)),
+        )
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
         if self.action == 'retrieve':  # means request is for fetching detail
             return serializers.RecipeDetailSerializer
+        elif self.action == 'upload_image':
+            return serializers.RecipeImageSerializer
+        elif self.action == 'cookable':
+            return serializers.RecipeCoverageSerializer
+        elif self.action == 'similar':
+            return serializers.RecipeSimilaritySerializer
         # Otherwise returns specified serializer
-        return self.serializer_class
+        return super().get_serializer_class()
+
+    def bump_data_version(self):
+        """Bulk writes also replace the tags and ingredients of recipes"""
+        caching.bump_data_version(self.request.user.pk, 'recipe',
+                                  ranking.LINKS_SCOPE)
 
     def perform_create(self, serializer):
         """Create recipe for current authenticated user"""
         serializer.save(user=self.request.user)
+
+    @action(methods=['post'], detail=True, url_path='upload-image')
+    def upload_image(self, request, pk=None):
+        """Store a recipe image, thumbnails are made in the background"""
+        # Uploads are hashed while streamed to disk, see core.storage
+        request._request.upload_handlers = [
+            HashingUploadHandler(request._request)]
+        recipe = self.get_object()
+        previous = recipe.image.name
+        serializer = self.get_serializer(recipe, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save(thumbnails_ready=False)
+            if previous:
+                images.release_image(previous)
+            recipe.thumbnails_ready = \
+                images.schedule_thumbnails(recipe.image.name)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=False)
+    def cookable(self, request):
+        """Rank recipes by the fraction of their ingredients at hand
+
+        `have` lists the ids of the ingredients at hand.
+        """
+        if not request.query_params.get('have'):
+            raise ValidationError({'have': [_('This field is required.')]})
+        have = set(self._params_to_ids('have', request.query_params['have']))
+        limit = get_limit(request, getattr(settings, 'RANKING_LIMIT', 10),
+                          getattr(settings, 'RANKING_MAX_LIMIT', 100))
+
+        results = []
+        for recipe, score in self._load_ranked(
+                ranking.recipes_to_cook(request.user, have, limit)):
+            recipe.coverage = score
+            recipe.missing_ingredients = sorted(
+                ingredient.id for ingredient in recipe.ingredients.all()
+                if ingredient.id not in have)
+            results.append(recipe)
+        return Response(self.get_serializer(results, many=True).data)
+
+    @action(methods=['get'], detail=True)
+    def similar(self, request, pk=None):
+        """List the recipes sharing the most tags and ingredients"""
+        recipe = self.get_object()
+        limit = get_limit(request, getattr(settings, 'RANKING_LIMIT', 10),
+                          getattr(settings, 'RANKING_MAX_LIMIT', 100))
+
+        results = []
+        for other, score in self._load_ranked(
+                ranking.similar_recipes(recipe, limit)):
+            other.similarity = score
+            results.append(other)
+        return Response(self.get_serializer(results, many=True).data)
+
+    def _load_ranked(self, ranked):
+        """Yield (recipe, score) of ranked (recipe id, score) in order"""
+        recipes = self.queryset.filter(user=self.request.user) \
+            .defer('search_vector') \
+            .prefetch_related(*self._get_prefetches()) \
+            .in_bulk([recipe_id for recipe_id, score in ranked])
+        for recipe_id, score in ranked:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:  # Deleted since the index was read
+                yield recipe, score
+
+    @action(methods=['get'], detail=False)
+    def export(self, request):
+        """Stream all of the user's recipes as NDJSON or CSV"""
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in export.EXPORT_FORMATS:
+            raise ValidationError({'export_format': [
+                _('Choose one of: %s.') % ', '.join(export.EXPORT_FORMATS)
+            ]})
+        lines, content_type = export.EXPORT_FORMATS[export_format]
+
+        recipes = export.iter_recipes(
+            Recipe.objects.filter(user=request.user),
+            getattr(settings, 'EXPORT_CHUNK_SIZE', 2000))
+        response = StreamingHttpResponse(lines(recipes),
+                                         content_type=content_type)
+        response['Content-Disposition'] = \
+            'attachment; filename="recipes.%s"' % export_format
+        return response
+
+
+class CacheStatsView(APIView):
+    """Report list response cache hits and misses of this process"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(caching.stats.as_dict())
+
+
+class RecipeStatsView(APIView):
+    """Report the user's recipe totals and most used tags and ingredients
+
+    Served from the denormalized core.stats counters, never scans recipes.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        limit = getattr(settings, 'RECIPE_STATS_TOP_NAMES', 10)
+        data = serializers.RecipeStatsSerializer(
+            stats.get_recipe_stats(request.user)).data
+        data['tags'] = serializers.TagCountSerializer(
+            stats.top_used(Tag, request.user, limit), many=True).data
+        data['ingredients'] = serializers.IngredientCountSerializer(
+            stats.top_used(Ingredient, request.user, limit), many=True).data
+        return Response(data)
@@ -1,6 +1,9 @@
-from rest_framework import generics, permissions, authentication
+from django.contrib.auth import get_user_model
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
+
+from core.authentication import CachedTokenAuthentication
 from .serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -18,9 +21,13 @@ class AuthTokenView(ObtainAuthToken):
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """Manage authenticated user profile"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
-        """Retrieve authenticated user"""
-        return self.request.user
+        """Retrieve authenticated user
+
+        Reloaded, request.user may be built from the token cache and
+        saving it must not write back stale fields.
+        """
+        return get_user_model().objects.get(pk=self.request.user.pk)